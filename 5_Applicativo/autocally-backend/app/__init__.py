@@ -1,6 +1,6 @@
 from flask import Flask
 from .config import Config
-from .extensions import db, migrate, cors, ma, socketio
+from .extensions import db, migrate, cors, ma, socketio, sock
 from flask_wtf.csrf import CSRFProtect
 from .security.routes import create_default_user
 
@@ -15,6 +15,7 @@ def create_app():
     cors.init_app(app, resources={r"/*": {"origins": "*"}})
     ma.init_app(app)
     socketio.init_app(app, cors_allowed_origins="*", async_mode='eventlet', ping_timeout=60, ping_interval=25)
+    sock.init_app(app)
 
 
     with app.app_context():
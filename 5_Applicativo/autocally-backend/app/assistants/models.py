@@ -1,6 +1,8 @@
 from ..extensions import db
 from ..phone_numbers.models import PhoneNumber
 
+RAG_MODES = ('agent', 'direct')
+
 class Assistant(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(64), nullable=False)
@@ -10,6 +12,10 @@ class Assistant(db.Model):
     llm_model = db.Column(db.String(64), default="llama-3.3-70b-versatile")
     llm_temperature = db.Column(db.Float, default=0.0)
     llm_max_tokens = db.Column(db.Integer, default=100)
+    # 'agent' lets the LLM call a tool per knowledge base, 'direct' retrieves first and makes a single LLM call
+    rag_mode = db.Column(db.String(16), default="agent")
+    # Reuse the answers to first questions similar to past ones
+    answer_cache = db.Column(db.Boolean, default=False)
 
     phone_number_id = db.Column(db.Integer, db.ForeignKey('phone_number.id'), nullable=True)
     phone_number = db.relationship('PhoneNumber', backref='assistants', lazy='joined')
@@ -3,10 +3,14 @@ from flask import jsonify, request, Response, current_app
 from flask_httpauth import HTTPTokenAuth
 from . import assistants
 from ..extensions import db
-from .models import Assistant
+from .models import Assistant, RAG_MODES
 from ..security.routes import auth
 from .serializers import AssistantSchema
 from libs.assistant.assistant_llm import AssistantLLM
+from libs.assistant.component_pool import component_pool
+from libs.assistant.answer_cache import answer_cache, prompt_version
+from libs.assistant.audio_cache import greeting_cache
+from libs.assistant.text_to_speech import greeting_cache_key, greeting_text, warm_greeting_audio
 import flask
 import asyncio
 import requests
@@ -46,9 +50,14 @@ def create_assistant():
         profile_id=current_profile.id,
         llm_model=data.get('llm_model', "llama-3.3-70b-versatile"),
         llm_temperature=data.get('llm_temperature', 0.0),
-        llm_max_tokens=data.get('llm_max_tokens', 100)
+        llm_max_tokens=data.get('llm_max_tokens', 100),
+        rag_mode=data.get('rag_mode') or 'agent',
+        answer_cache=bool(data.get('answer_cache', False))
     )
     
+    if new_assistant.rag_mode not in RAG_MODES:
+        return jsonify({'error': f"rag_mode must be one of {', '.join(RAG_MODES)}"}), 400
+    
     db.session.add(new_assistant)
     db.session.commit()
     
@@ -63,7 +72,9 @@ def create_assistant():
             'phone_number_id': new_assistant.phone_number_id,
             'llm_model': new_assistant.llm_model,
             'llm_temperature': new_assistant.llm_temperature,
-            'llm_max_tokens': new_assistant.llm_max_tokens
+            'llm_max_tokens': new_assistant.llm_max_tokens,
+            'rag_mode': new_assistant.rag_mode,
+            'answer_cache': new_assistant.answer_cache
         }
     }), 201
 
@@ -88,6 +99,7 @@ def delete_assistant(assistant_id):
             
         db.session.delete(assistant)
         db.session.commit()
+        component_pool.invalidate(assistant_id)
         
         return jsonify({'message': 'Assistant deleted successfully'}), 200
     except Exception as e:
@@ -143,6 +155,8 @@ def update_assistant(assistant_id):
         return jsonify({'error': 'Unauthorized access'}), 403
         
     data = request.get_json()
+    old_greeting_key = greeting_cache_key(greeting_text(assistant), assistant.cartesia_voice_id)
+    old_prompt_version = prompt_version(assistant)
     
     if 'name' in data:
         assistant.name = data['name']
@@ -160,8 +174,24 @@ def update_assistant(assistant_id):
         assistant.llm_temperature = data['llm_temperature']
     if 'llm_max_tokens' in data:
         assistant.llm_max_tokens = data['llm_max_tokens']
+    if data.get('rag_mode'):
+        if data['rag_mode'] not in RAG_MODES:
+            return jsonify({'error': f"rag_mode must be one of {', '.join(RAG_MODES)}"}), 400
+        assistant.rag_mode = data['rag_mode']
+    if 'answer_cache' in data:
+        assistant.answer_cache = bool(data['answer_cache'])
     
     db.session.commit()
+    component_pool.invalidate(assistant.id)
+    
+    # Answers given with the previous prompt are not reused
+    if prompt_version(assistant) != old_prompt_version or not assistant.answer_cache:
+        answer_cache.invalidate(assistant.id)
+    
+    # Replace the cached greeting audio when its text or voice changed
+    if greeting_cache_key(greeting_text(assistant), assistant.cartesia_voice_id) != old_greeting_key:
+        greeting_cache.discard(old_greeting_key)
+        eventlet.spawn(warm_greeting_audio, current_app._get_current_object(), assistant.id)
     
     return jsonify({
         'message': 'Assistant updated successfully',
@@ -174,7 +204,9 @@ def update_assistant(assistant_id):
             'phone_number_id': assistant.phone_number_id,
             'llm_model': assistant.llm_model,
             'llm_temperature': assistant.llm_temperature,
-            'llm_max_tokens': assistant.llm_max_tokens
+            'llm_max_tokens': assistant.llm_max_tokens,
+            'rag_mode': assistant.rag_mode,
+            'answer_cache': assistant.answer_cache
         }
     })
 
@@ -4,12 +4,12 @@ from .models import Assistant
 from libs.assistant.assistant_llm import AssistantLLM
 from libs.assistant.text_to_speech import TTS
 from libs.assistant.speech_to_text import SpeechToText
+from libs.assistant.stt_dispatcher import stt_dispatcher
 #from .transcript_handler import TranscriptHandler
 from ..security.routes import auth
 from flask import request
 import logging
 import time
-import asyncio
 import eventlet
 from eventlet import spawn_after
 from ..extensions import socketio
@@ -123,19 +123,7 @@ def handle_start_stt():
             
         speech_to_text = stt_cache[assistant_id]
         
-        def start_stream_task():
-            try:
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                try:
-                    loop.run_until_complete(speech_to_text.start_stream())
-                finally:
-                    loop.close()
-            except Exception as e:
-                logging.error(f"Error starting STT stream: {str(e)}")
-                socketio.emit('error', {'message': str(e)})
-        
-        eventlet.spawn(start_stream_task)
+        eventlet.spawn(start_stream_task, speech_to_text)
         socketio.emit('stt_started', {'status': 'ready', 'assistant_id': assistant_id})
         
     except Exception as e:
@@ -151,30 +139,15 @@ def handle_audio_chunk(data):
         if assistant_id and audio_data:
             if assistant_id in stt_cache:
                 speech_to_text = stt_cache[assistant_id]
-                eventlet.spawn(process_stt_chunk, speech_to_text, {
-                    'audio': audio_data
-                })
+                process_stt_chunk(speech_to_text, audio_data)
             else:
                 # Automatically restart STT if not in cache
                 stt_cache[assistant_id] = SpeechToText(assistant_id)
                 speech_to_text = stt_cache[assistant_id]
                 
-                def start_stream_task():
-                    try:
-                        loop = asyncio.new_event_loop()
-                        asyncio.set_event_loop(loop)
-                        try:
-                            loop.run_until_complete(speech_to_text.start_stream())
-                        finally:
-                            loop.close()
-                    except Exception as e:
-                        logging.error(f"Error starting STT stream: {str(e)}")
-                        socketio.emit('error', {'message': str(e)})
-                
-                eventlet.spawn(start_stream_task)
-                eventlet.spawn(process_stt_chunk, speech_to_text, {
-                    'audio': audio_data
-                })
+                eventlet.spawn(start_stream_task, speech_to_text)
+                # Buffered by the stream until its connection is open
+                stt_dispatcher.submit(speech_to_text, audio_data)
                 socketio.emit('stt_started', {'status': 'ready', 'assistant_id': assistant_id})
     except Exception as e:
         logging.error(f"Exception in handle_audio_chunk: {str(e)}")
@@ -194,12 +167,7 @@ def handle_stop_stt():
             
             def stop_stream_task():
                 try:
-                    loop = asyncio.new_event_loop()
-                    asyncio.set_event_loop(loop)
-                    try:
-                        loop.run_until_complete(speech_to_text.stop_stream())
-                    finally:
-                        loop.close()
+                    stt_dispatcher.stop(speech_to_text).wait()
                     logging.info(f"STT stream stopped for assistant {assistant_id}")
                     
                     # Don't remove from cache here - only on disconnect
@@ -236,12 +204,7 @@ def handle_chat_cleanup(data):
                 
                 def cleanup_task():
                     try:
-                        loop = asyncio.new_event_loop()
-                        asyncio.set_event_loop(loop)
-                        try:
-                            loop.run_until_complete(speech_to_text.stop_stream())
-                        finally:
-                            loop.close()
+                        stt_dispatcher.stop(speech_to_text).wait()
                         
                         del stt_cache[assistant_id]
                         logging.info(f"Cleaned up resources for assistant {assistant_id}")
@@ -254,18 +217,23 @@ def handle_chat_cleanup(data):
     except Exception as e:
         logging.error(f"Error in chat cleanup handler: {str(e)}")
 
-def process_stt_chunk(speech_to_text, audio_chunk_data):
+def start_stream_task(speech_to_text):
+    try:
+        # start_stream is synchronous, it opens the connection on its own event loop
+        if not speech_to_text.start_stream():
+            socketio.emit('error', {'message': 'Could not start the STT stream'})
+    except Exception as e:
+        logging.error(f"Error starting STT stream: {str(e)}")
+        socketio.emit('error', {'message': str(e)})
+
+def process_stt_chunk(speech_to_text, audio_data):
     try:
         if not speech_to_text.is_streaming:
             logging.warning("STT stream not started, ignoring audio chunk")
             return
-            
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        try:
-            loop.run_until_complete(speech_to_text.process_chunk(audio_chunk_data))
-        finally:
-            loop.close()
+        
+        # Sent in order by the STT dispatcher, no event loop per chunk
+        stt_dispatcher.submit(speech_to_text, audio_data)
     except Exception as e:
         logging.error(f"Error in process_stt_chunk: {str(e)}")
 
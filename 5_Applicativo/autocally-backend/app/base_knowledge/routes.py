@@ -8,6 +8,8 @@ import shutil
 from pathlib import Path
 from ..config import BASE_DIR
 from werkzeug.utils import secure_filename
+from libs.assistant.vector_store_registry import vector_store_registry
+from libs.assistant.answer_cache import answer_cache
 import os
 
 @base_knowledge.route('/', methods=['GET'])
@@ -114,6 +116,9 @@ def start_processing(base_knowledge_id):
     db.session.commit()
     
     task = process_base_knowledge.apply_async(args=[base_knowledge_id])
+    # The new index gets a new generation, answers based on the old one are dropped now
+    for assistant in base_knowledge.assistants:
+        answer_cache.invalidate(assistant.id)
     return jsonify({
         'task_id': task.id,
         'status': 'PENDING'
@@ -208,6 +213,8 @@ def get_base_knowledge_files(base_knowledge_id):
 @base_knowledge.route('/<int:base_knowledge_id>/assistants', methods=['POST'])
 @auth.login_required
 def add_assistant_to_base_knowledge(base_knowledge_id):
+    from libs.assistant.component_pool import component_pool
+    
     current_user = auth.current_user()
     current_profile = current_user.profile
     
@@ -237,6 +244,7 @@ def add_assistant_to_base_knowledge(base_knowledge_id):
     
     try:
         db.session.commit()
+        component_pool.invalidate(assistant.id)
         return jsonify({
             'message': 'Assistant added successfully',
             'assistant_ids': [a.id for a in base_knowledge.assistants]
@@ -248,6 +256,8 @@ def add_assistant_to_base_knowledge(base_knowledge_id):
 @base_knowledge.route('/<int:base_knowledge_id>/assistants/<int:assistant_id>', methods=['DELETE'])
 @auth.login_required
 def remove_assistant_from_base_knowledge(base_knowledge_id, assistant_id):
+    from libs.assistant.component_pool import component_pool
+    
     current_user = auth.current_user()
     current_profile = current_user.profile
     
@@ -268,6 +278,7 @@ def remove_assistant_from_base_knowledge(base_knowledge_id, assistant_id):
     
     try:
         db.session.commit()
+        component_pool.invalidate(assistant.id)
         return jsonify({
             'message': 'Assistant removed successfully',
             'assistant_ids': [a.id for a in base_knowledge.assistants]
@@ -279,6 +290,8 @@ def remove_assistant_from_base_knowledge(base_knowledge_id, assistant_id):
 @base_knowledge.route('/<int:base_knowledge_id>', methods=['PUT'])
 @auth.login_required
 def update_base_knowledge(base_knowledge_id):
+    from libs.assistant.component_pool import component_pool
+    
     current_user = auth.current_user()
     current_profile = current_user.profile
     
@@ -299,6 +312,7 @@ def update_base_knowledge(base_knowledge_id):
     
     try:
         db.session.commit()
+        component_pool.invalidate_knowledge(base_knowledge)
         return jsonify({
             'id': base_knowledge.id,
             'name': base_knowledge.name,
@@ -315,6 +329,8 @@ def update_base_knowledge(base_knowledge_id):
 @base_knowledge.route('/<int:base_knowledge_id>', methods=['DELETE'])
 @auth.login_required
 def delete_base_knowledge(base_knowledge_id):
+    from libs.assistant.component_pool import component_pool
+    
     current_user = auth.current_user()
     current_profile = current_user.profile
     
@@ -338,11 +354,15 @@ def delete_base_knowledge(base_knowledge_id):
       
         TaskStatusBaseKnowledge.query.filter_by(base_knowledge_id=base_knowledge_id).delete()
         
+        assistant_ids = [assistant.id for assistant in base_knowledge.assistants]
         base_knowledge.assistants = []
         
 
         db.session.delete(base_knowledge)
         db.session.commit()
+        for assistant_id in assistant_ids:
+            component_pool.invalidate(assistant_id)
+        vector_store_registry.invalidate(base_knowledge_id)
 
         
         if files_path.exists():
@@ -2,4 +2,4 @@ from flask import Blueprint
 
 calls = Blueprint('calls', __name__)
 
-from . import routes, models, forms, serializers, test_call_routes
\ No newline at end of file
+from . import routes, models, forms, serializers, test_call_routes, media_stream
\ No newline at end of file
@@ -0,0 +1,81 @@
+"""Fake Twilio client replaying recorded media stream frames against the backend.
+
+Record a real call by setting MEDIA_STREAM_RECORD_DIR, then replay it with:
+
+    python replay_media_stream.py recording.jsonl --url ws://localhost:5000/api/calls/media-stream --call-id 42
+
+Frames are sent at the pace of their media timestamps. The assistant audio
+is counted and, like Twilio, every mark is echoed back once it is received.
+"""
+import argparse
+import base64
+import json
+import threading
+import time
+
+from websockets.sync.client import connect
+
+
+def load_frames(path, call_id=None):
+    frames = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            frame = json.loads(line)
+            # The call of the recording usually does not exist on the target database
+            if call_id is not None and frame.get('event') == 'start':
+                frame['start'].setdefault('customParameters', {})['call_id'] = str(call_id)
+            frames.append(frame)
+    return frames
+
+
+def receive(ws, stats):
+    """Read the messages sent by the backend, echoing marks like Twilio does."""
+    for message in ws:
+        frame = json.loads(message)
+        event = frame.get('event')
+        stats[event] = stats.get(event, 0) + 1
+        if event == 'media':
+            stats['audio_bytes'] = stats.get('audio_bytes', 0) + len(base64.b64decode(frame['media']['payload']))
+            stats.setdefault('first_media_at', time.time())
+        elif event == 'mark':
+            print(f"mark {frame['mark']['name']}")
+            ws.send(json.dumps({'event': 'mark', 'streamSid': frame.get('streamSid'), 'mark': frame['mark']}))
+        elif event == 'clear':
+            print('clear')
+
+
+def replay(url, frames, tail):
+    stats = {}
+    with connect(url) as ws:
+        receiver = threading.Thread(target=receive, args=(ws, stats), daemon=True)
+        receiver.start()
+
+        start = time.time()
+        for frame in frames:
+            media = frame.get('media')
+            if media and 'timestamp' in media:
+                delay = start + int(media['timestamp']) / 1000 - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            if frame.get('event') == 'stop':
+                # Leave time for the answer to the last utterance
+                time.sleep(tail)
+            ws.send(json.dumps(frame))
+
+        time.sleep(1)
+        stats['duration'] = round(time.time() - start, 2)
+    return stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('recording', help='JSON lines file written by the media stream endpoint')
+    parser.add_argument('--url', default='ws://localhost:5000/api/calls/media-stream')
+    parser.add_argument('--call-id', help='call the replayed stream is bound to')
+    parser.add_argument('--tail', type=float, default=5.0, help='seconds to wait before sending stop')
+    args = parser.parse_args()
+
+    stats = replay(args.url, load_frames(args.recording, args.call_id), args.tail)
+    print(json.dumps(stats, indent=2))
@@ -0,0 +1,84 @@
+import logging
+from ..extensions import socketio
+from .. import metrics
+from libs.assistant.audio_codec import (
+    FRAME_FINAL, FRAME_FIRST, FRAME_GREETING, pack_audio_frame, unpack_audio_frame
+)
+
+# Slots fit the 16 bit field of the frame header
+MAX_CALL_SLOTS = 65536
+
+# Open channels by call slot
+channels = {}
+
+
+class BinaryAudioChannel:
+    """Binary audio framing negotiated by the Socket.IO client of a call.
+
+    The format of the audio is sent once in call_ready, afterwards audio_chunk
+    and stt_audio_chunk carry a frame with the call slot, a sequence number
+    and flags in a fixed header followed by the raw audio.
+    """
+
+    __slots__ = ('call_id', 'room', 'slot', 'sequence', 'received')
+
+    def __init__(self, call_id, room, slot):
+        self.call_id = call_id
+        self.room = room
+        self.slot = slot
+        self.sequence = 0
+        # Sequence number of the last frame received from the client
+        self.received = None
+
+    def send(self, payload):
+        """Send an audio_chunk payload of the pacer as a binary frame."""
+        flags = 0
+        if payload.get('final'):
+            flags |= FRAME_FINAL
+        if payload.get('is_greeting'):
+            flags |= FRAME_GREETING
+        if 'first_chunk_time' in payload:
+            flags |= FRAME_FIRST
+        audio = payload.get('audio')
+        frame = pack_audio_frame(self.slot, self.sequence, flags, audio['data'] if audio else b'')
+        self.sequence = (self.sequence + 1) & 0xFFFFFFFF
+        socketio.emit('audio_chunk', frame, to=self.room)
+
+    def receive(self, sequence):
+        """Track the sequence of an inbound frame, counting the frames lost or reordered before it."""
+        if self.received is not None:
+            gap = (sequence - self.received - 1) & 0xFFFFFFFF
+            if gap and gap < 0x80000000:
+                metrics.increment('stt.frames_lost', gap)
+            elif gap:
+                metrics.increment('stt.frames_reordered')
+        self.received = sequence
+
+
+def open_channel(call_id, room):
+    """Give a call the lowest free slot, None when they are all taken."""
+    for slot in range(1, MAX_CALL_SLOTS):
+        if slot not in channels:
+            channel = channels[slot] = BinaryAudioChannel(call_id, room, slot)
+            return channel
+    logging.error(f"❌ [ERROR] No free audio slot for call {call_id}")
+    return None
+
+
+def close_channel(channel):
+    if channels.get(channel.slot) is channel:
+        del channels[channel.slot]
+
+
+def read_frame(frame):
+    """Channel, sequence and audio of an inbound binary frame, channel is None when its slot is not open.
+
+    The slot alone does not prove the sender owns the call, the caller checks
+    the client before counting the sequence with channel.receive.
+    """
+    try:
+        slot, sequence, flags, audio = unpack_audio_frame(frame)
+    except ValueError as e:
+        logging.warning(f"🎤 [STT] Invalid audio frame: {str(e)}")
+        return None, None, None
+    return channels.get(slot), sequence, audio
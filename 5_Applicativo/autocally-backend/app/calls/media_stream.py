@@ -0,0 +1,160 @@
+from flask import current_app
+from eventlet.semaphore import Semaphore
+import base64
+import eventlet
+import json
+import logging
+import os
+import time
+from ..extensions import sock
+from ..phone_numbers.models import PhoneNumber
+from .. import metrics
+from .models import Call
+from .session import CallSession
+from .socket_events import (
+    active_calls, dispatch_stt_transcript, dispatch_speech_started, end_call_session,
+    process_audio_chunk, start_greeting, start_stt_stream
+)
+from libs.assistant.audio_codec import TELEPHONY_AUDIO_FORMAT
+from . import calls
+
+
+class TwilioMediaStream:
+    """Websocket of a Twilio Media Stream.
+
+    Inbound media frames carry 8 kHz mu-law audio that is streamed to
+    Deepgram as is. The pacer sends the assistant audio back through send,
+    which wraps every frame in a media message and the end of each response
+    in a mark that Twilio echoes once it has been played.
+    """
+
+    def __init__(self, ws, record_path=None):
+        self.ws = ws
+        self.stream_sid = None
+        self.call_id = None
+        self.marks_sent = 0
+        self.marks_played = 0
+        # The pacer greenlet and barge-in both write to the websocket
+        self.send_lock = Semaphore()
+        self.record_file = open(record_path, 'a') if record_path else None
+
+    def send(self, payload):
+        """Send an audio_chunk payload of the pacer as Twilio messages."""
+        audio = payload.get('audio')
+        if audio and audio.get('data'):
+            self._send({
+                'event': 'media',
+                'streamSid': self.stream_sid,
+                'media': {'payload': base64.b64encode(audio['data']).decode('ascii')}
+            })
+        if payload.get('final'):
+            self.marks_sent += 1
+            self._send({
+                'event': 'mark',
+                'streamSid': self.stream_sid,
+                'mark': {'name': f"{'greeting' if payload.get('is_greeting') else 'response'}-{self.marks_sent}"}
+            })
+
+    def clear(self):
+        """Make Twilio drop the audio it has buffered but not played."""
+        self._send({'event': 'clear', 'streamSid': self.stream_sid})
+
+    def serve(self):
+        """Handle the messages of the stream until Twilio stops it or disconnects."""
+        try:
+            while True:
+                message = self.ws.receive()
+                if message is None:
+                    break
+                if self.record_file:
+                    self.record_file.write(message.rstrip('\n') + '\n')
+                frame = json.loads(message)
+                event = frame.get('event')
+
+                if event == 'media':
+                    self.handle_media(frame['media'])
+                elif event == 'start':
+                    self.handle_start(frame['start'])
+                elif event == 'mark':
+                    self.marks_played += 1
+                    logging.info(f"🔊 [AUDIO] Twilio played {frame['mark'].get('name')} on call {self.call_id}")
+                elif event == 'connected':
+                    logging.warning(f"📞 [CALL] Twilio media stream connected ({frame.get('protocol')} {frame.get('version')})")
+                elif event == 'stop':
+                    logging.warning(f"📞 [CALL] Twilio media stream {self.stream_sid} stopped")
+                    break
+        finally:
+            if self.record_file:
+                self.record_file.close()
+            if self.call_id:
+                end_call_session(self.call_id)
+
+    def handle_start(self, start):
+        """Bind the stream to its call and start STT and the greeting."""
+        self.stream_sid = start.get('streamSid')
+        parameters = start.get('customParameters') or {}
+        call = Call.query.get(int(parameters.get('call_id', 0)))
+        if not call:
+            logging.error(f"❌ [ERROR] Twilio media stream {self.stream_sid} for unknown call {parameters}")
+            return
+
+        phone_number = PhoneNumber.query.get(call.phone_number_id)
+        if not phone_number or not phone_number.assistants:
+            logging.error(f"❌ [ERROR] No assistant associated with the phone number of call {call.id}")
+            return
+
+        media_format = start.get('mediaFormat') or {}
+        logging.warning(f"📞 [CALL] Twilio media stream {self.stream_sid} started for call {call.id}, format {media_format}")
+
+        session = CallSession.create(
+            call.id,
+            phone_number.assistants[0].id,
+            current_app._get_current_object(),
+            on_transcript=dispatch_stt_transcript,
+            on_speech_started=dispatch_speech_started,
+            client_sid=self.stream_sid,
+            stt_encoding='mulaw',
+            stt_sample_rate=media_format.get('sampleRate', TELEPHONY_AUDIO_FORMAT.sample_rate)
+        )
+        session.audio_format = TELEPHONY_AUDIO_FORMAT
+        session.media_stream = self
+        active_calls[session.call_id] = session
+        self.call_id = session.call_id
+        metrics.increment('calls.media_streams')
+
+        eventlet.spawn(start_stt_stream, session.stt, session.call_id)
+        start_greeting(session, call)
+
+    def handle_media(self, media):
+        """Stream an inbound mu-law frame to the STT of the call."""
+        session = active_calls.get(self.call_id) if self.call_id else None
+        if not session or media.get('track', 'inbound') != 'inbound':
+            return
+        session.touch()
+        process_audio_chunk(
+            session.stt,
+            base64.b64decode(media['payload']),
+            session.call_id,
+            TELEPHONY_AUDIO_FORMAT.sample_rate,
+            'mulaw'
+        )
+
+    def _send(self, message):
+        with self.send_lock:
+            try:
+                self.ws.send(json.dumps(message))
+            except Exception as e:
+                logging.error(f"❌ [ERROR] Error sending to Twilio media stream {self.stream_sid}: {str(e)}")
+
+
+@sock.route('/media-stream', bp=calls)
+def media_stream(ws):
+    """Twilio Media Streams endpoint, the TwiML of incoming calls connects the call here."""
+    record_path = None
+    record_dir = current_app.config.get('MEDIA_STREAM_RECORD_DIR')
+    if record_dir:
+        # Recorded frames can be replayed with app/calls/example/replay_media_stream.py
+        os.makedirs(record_dir, exist_ok=True)
+        record_path = os.path.join(record_dir, f"media_stream_{time.strftime('%Y%m%d-%H%M%S')}.jsonl")
+
+    TwilioMediaStream(ws, record_path).serve()
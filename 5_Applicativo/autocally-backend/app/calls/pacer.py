@@ -0,0 +1,189 @@
+from collections import deque
+import logging
+import time
+
+import eventlet
+from eventlet.event import Event
+
+from ..extensions import socketio
+from .. import metrics
+
+# Audio kept in flight ahead of the client playout clock, absorbs network jitter
+JITTER_BUFFER_TARGET = 0.2
+# Audio a producer can queue before it has to wait for the pacer
+MAX_QUEUED_SECONDS = 5.0
+# Resolution of the pacer clock
+TICK = 0.01
+
+
+class PacedStream:
+    """Outbound audio of one call with its playout clock and counters."""
+
+    __slots__ = (
+        'call_id',
+        'room',
+        'sink',
+        'queue',
+        'queued_duration',
+        'playout_time',
+        'playing',
+        'drained',
+        'underruns',
+        'overruns',
+    )
+
+    def __init__(self, call_id, room, sink=None):
+        self.call_id = call_id
+        self.room = room
+        # Object with a send(payload) method used instead of the Socket.IO room
+        self.sink = sink
+        self.queue = deque()
+        self.queued_duration = 0.0
+        # Monotonic time at which the client runs out of the audio sent so far
+        self.playout_time = 0.0
+        self.playing = False
+        self.drained = Event()
+        self.underruns = 0
+        self.overruns = 0
+
+    def ahead(self, now):
+        """Seconds of audio the client has buffered."""
+        return max(0.0, self.playout_time - now)
+
+
+class AudioPacer:
+    """Sends the audio of every speaking call from a single greenlet.
+
+    Producers queue chunks as fast as the TTS returns them. On every tick the
+    pacer sends each call just enough audio to stay JITTER_BUFFER_TARGET
+    seconds ahead of its playout clock, so the pacing does not drift with the
+    time spent in emit and the producers hold no sleep loop.
+    """
+
+    def __init__(self, jitter_buffer=JITTER_BUFFER_TARGET, max_queued=MAX_QUEUED_SECONDS, tick=TICK):
+        self.jitter_buffer = jitter_buffer
+        self.max_queued = max_queued
+        self.tick = tick
+        self.streams = {}
+        self.wakeup = Event()
+        self.runner = None
+        
+        metrics.register_gauge('pacer.calls', self.stats)
+
+    def stream(self, call_id, room, sink=None):
+        """Paced stream of a call, created on first use."""
+        stream = self.streams.get(call_id)
+        if stream is None:
+            stream = self.streams[call_id] = PacedStream(call_id, room, sink)
+        else:
+            # The client can renegotiate its transport when it reconnects
+            stream.sink = sink
+        if self.runner is None:
+            self.runner = eventlet.spawn(self._run)
+        return stream
+
+    def send(self, stream, payload, duration):
+        """Queue an audio_chunk payload lasting duration seconds, waits while the queue is full."""
+        if stream.queued_duration > self.max_queued:
+            stream.overruns += 1
+            metrics.increment('pacer.overruns')
+            while stream.queued_duration > self.max_queued and self.streams.get(stream.call_id) is stream:
+                eventlet.sleep(self.tick)
+        
+        if stream.drained.ready():
+            stream.drained = Event()
+        stream.queue.append((payload, duration))
+        stream.queued_duration += duration
+        self._wake()
+
+    def finish(self, stream, payload):
+        """Queue the final marker and wait until the client has played the stream."""
+        self.send(stream, payload, 0.0)
+        stream.drained.wait()
+        
+        remaining = stream.ahead(time.monotonic())
+        if remaining:
+            eventlet.sleep(remaining)
+
+    def flush(self, call_id):
+        """Drop the audio of a call that was not sent yet."""
+        stream = self.streams.get(call_id)
+        if stream:
+            self._drop(stream)
+
+    def close(self, call_id):
+        stream = self.streams.pop(call_id, None)
+        if stream:
+            self._drop(stream)
+
+    def stats(self):
+        return {
+            call_id: {
+                'underruns': stream.underruns,
+                'overruns': stream.overruns,
+                'queued_seconds': round(stream.queued_duration, 3),
+            }
+            for call_id, stream in list(self.streams.items())
+        }
+
+    def _drop(self, stream):
+        stream.queue.clear()
+        stream.queued_duration = 0.0
+        stream.playing = False
+        # The client flushes its playback buffer as well
+        stream.playout_time = 0.0
+        if not stream.drained.ready():
+            stream.drained.send()
+
+    def _wake(self):
+        if not self.wakeup.ready():
+            self.wakeup.send()
+
+    def _run(self):
+        while True:
+            try:
+                busy = False
+                now = time.monotonic()
+                for stream in list(self.streams.values()):
+                    self._pump(stream, now)
+                    busy = busy or bool(stream.queue)
+                
+                if busy:
+                    eventlet.sleep(self.tick)
+                else:
+                    self.wakeup.wait()
+                    self.wakeup = Event()
+            except Exception as e:
+                logging.error(f"❌ [AUDIO] Error in audio pacer: {str(e)}")
+                eventlet.sleep(self.tick)
+
+    def _pump(self, stream, now):
+        """Send the chunks of a stream that are due."""
+        while stream.queue and stream.ahead(now) <= self.jitter_buffer:
+            payload, duration = stream.queue.popleft()
+            stream.queued_duration = max(0.0, stream.queued_duration - duration)
+            
+            if duration:
+                if not stream.playing:
+                    # New utterance, it plays after whatever is still buffered
+                    stream.playing = True
+                    stream.playout_time = max(stream.playout_time, now)
+                elif stream.playout_time < now:
+                    # The client played everything it had before this chunk arrived
+                    stream.underruns += 1
+                    metrics.increment('pacer.underruns')
+                    stream.playout_time = now
+                stream.playout_time += duration
+            
+            if stream.sink:
+                stream.sink.send(payload)
+            else:
+                socketio.emit('audio_chunk', payload, to=stream.room)
+            
+            if payload.get('final'):
+                stream.playing = False
+                if not stream.drained.ready():
+                    stream.drained.send()
+
+
+audio_pacer = AudioPacer()
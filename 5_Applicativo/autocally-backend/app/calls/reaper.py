@@ -0,0 +1,62 @@
+from .models import Call
+from .socket_events import socketio, active_calls, call_room, end_call_session
+from ..extensions import db
+from .. import metrics
+from datetime import datetime
+import eventlet
+import logging
+import time
+
+
+def persist_call_end(call_id):
+    """Store ended_at and duration of a call that ended without a status update."""
+    call = Call.query.get(int(call_id))
+    if not call or call.ended_at:
+        return
+    
+    call.ended_at = datetime.utcnow()
+    call.status = 'completed'
+    if call.started_at:
+        call.duration = int((call.ended_at - call.started_at).total_seconds())
+    db.session.commit()
+
+def reap_idle_calls(app, idle_ttl):
+    """End the calls whose client has been silent for more than idle_ttl seconds."""
+    now = time.time()
+    idle_sessions = [session for session in list(active_calls.values()) if now - session.last_seen > idle_ttl]
+    
+    for session in idle_sessions:
+        call_id = session.call_id
+        logging.warning(f"📞 [CALL] Reaping call {call_id}, idle for {now - session.last_seen:.0f}s")
+        
+        end_call_session(call_id)
+        
+        try:
+            with app.app_context():
+                persist_call_end(call_id)
+        except Exception as e:
+            logging.error(f"❌ [ERROR] Error persisting end of reaped call {call_id}: {str(e)}")
+        
+        socketio.emit('call_ended', {'call_id': call_id}, to=call_room(call_id))
+        metrics.increment('calls.reaped')
+    
+    return len(idle_sessions)
+
+def run_call_reaper(app):
+    """Periodically reap idle calls, runs for the whole life of the worker."""
+    idle_ttl = app.config['CALL_IDLE_TTL']
+    interval = app.config['CALL_REAPER_INTERVAL']
+    logging.warning(f"📞 [CALL] Call reaper started, idle TTL {idle_ttl}s, checking every {interval}s")
+    
+    while True:
+        eventlet.sleep(interval)
+        try:
+            reap_idle_calls(app, idle_ttl)
+        except Exception as e:
+            logging.error(f"❌ [ERROR] Error in call reaper: {str(e)}")
+            import traceback
+            logging.error(traceback.format_exc())
+
+def start_call_reaper(app):
+    """Start the reaper greenlet of this worker."""
+    return eventlet.spawn(run_call_reaper, app)
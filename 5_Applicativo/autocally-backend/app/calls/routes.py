@@ -1,11 +1,13 @@
-from flask import Blueprint, request, jsonify
-from twilio.twiml.voice_response import VoiceResponse
+from flask import Blueprint, request, jsonify, url_for
+from twilio.twiml.voice_response import VoiceResponse, Connect
 from .models import Call, CallType, ConversationTranscript, ConversationRole
 from ..phone_numbers.models import PhoneNumber
 from ..extensions import db
 import logging
 from datetime import datetime
-from .socket_events import socketio
+from .socket_events import socketio, call_room, end_call_session
+from ..security.routes import auth
+from .. import metrics
 from . import calls
 
 @calls.route('/incoming-call', methods=['POST'])
@@ -37,8 +39,12 @@ def handle_incoming_call():
         # Create TwiML response
         response = VoiceResponse()
         
-        # Start a websocket connection with call info
-        response.start().stream(url=f'/socket.io/?call_id={call.id}&phone_number_id={phone_number.id}')
+        # Connect the call audio to our media stream websocket, the call is passed as stream parameters
+        connect = Connect()
+        stream = connect.stream(url=url_for('calls.media_stream', _external=True, _scheme='wss'))
+        stream.parameter(name='call_id', value=call.id)
+        stream.parameter(name='phone_number_id', value=phone_number.id)
+        response.append(connect)
         
         return str(response)
         
@@ -60,7 +66,8 @@ def handle_call_status():
             # If call ended, update end time and clean up websocket connection
             if call_status in ['completed', 'busy', 'failed', 'no-answer', 'canceled']:
                 call.ended_at = datetime.utcnow()
-                socketio.emit('call_ended', {'call_id': call.id})
+                end_call_session(call.id)
+                socketio.emit('call_ended', {'call_id': call.id}, to=call_room(call.id))
                 
             db.session.commit()
                 
@@ -69,3 +76,8 @@ def handle_call_status():
     except Exception as e:
         logging.error(f"Error handling call status: {str(e)}")
         return jsonify({'error': str(e)}), 500
+
+@calls.route('/metrics', methods=['GET'])
+@auth.login_required
+def get_call_metrics():
+    return jsonify(metrics.snapshot())
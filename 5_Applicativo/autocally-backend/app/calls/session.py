@@ -0,0 +1,201 @@
+from libs.assistant.audio_codec import AudioTranscoder, TTS_AUDIO_FORMAT
+from libs.assistant.component_pool import component_pool
+from libs.assistant.speech_to_text import SpeechToText
+from collections import deque
+import enum
+import logging
+import time
+
+# Bounds for the per call queues, the oldest entries are dropped when full
+MAX_PENDING_AUDIO_CHUNKS = 1024
+MAX_PENDING_RESPONSES = 4
+
+
+class CallState(enum.Enum):
+    greeting = 'greeting'
+    listening = 'listening'
+    thinking = 'thinking'
+    speaking = 'speaking'
+    ended = 'ended'
+
+
+# Allowed transitions between call states
+CALL_STATE_TRANSITIONS = {
+    CallState.greeting: {CallState.thinking, CallState.speaking, CallState.listening, CallState.ended},
+    CallState.listening: {CallState.thinking, CallState.speaking, CallState.ended},
+    CallState.thinking: {CallState.speaking, CallState.listening, CallState.ended},
+    CallState.speaking: {CallState.listening, CallState.thinking, CallState.ended},
+    CallState.ended: set(),
+}
+
+
+class CallSession:
+    """State and assistant components of one active call."""
+
+    __slots__ = (
+        'call_id',
+        'assistant_id',
+        'app',
+        'assistant_llm',
+        'tts',
+        'stt',
+        'client_sid',
+        'state',
+        'greeting_sent',
+        'is_greeting_audio',
+        'audio_format',
+        'media_stream',
+        'audio_channel',
+        'pending_audio',
+        'pending_responses',
+        'output_generation',
+        'started_at',
+        'last_seen',
+    )
+
+    def __init__(self, call_id, assistant_id, app, assistant_llm, tts, stt, client_sid=None):
+        self.call_id = str(call_id)
+        self.assistant_id = assistant_id
+        self.app = app
+        self.assistant_llm = assistant_llm
+        self.tts = tts
+        self.stt = stt
+        self.client_sid = client_sid
+        self.state = CallState.greeting
+        self.greeting_sent = False
+        self.is_greeting_audio = True
+        # Format negotiated by the client, the TTS format until it asks for another
+        self.audio_format = TTS_AUDIO_FORMAT
+        # Twilio media stream of a phone call, None for Socket.IO clients
+        self.media_stream = None
+        # Binary framing negotiated by a Socket.IO client, None for dict payloads
+        self.audio_channel = None
+        self.pending_audio = deque(maxlen=MAX_PENDING_AUDIO_CHUNKS)
+        self.pending_responses = deque(maxlen=MAX_PENDING_RESPONSES)
+        # Bumped on barge-in, audio loops stop when it changes under them
+        self.output_generation = 0
+        self.started_at = time.time()
+        self.last_seen = self.started_at
+
+    @classmethod
+    def create(cls, call_id, assistant_id, app, on_transcript=None, on_speech_started=None, client_sid=None,
+               stt_encoding='linear16', stt_sample_rate=16000):
+        """Take warm assistant components for a call and wrap them in a session."""
+        call_id = str(call_id)
+        assistant_llm, tts = component_pool.acquire(assistant_id)
+        return cls(
+            call_id,
+            assistant_id,
+            app,
+            assistant_llm=assistant_llm,
+            tts=tts,
+            stt=SpeechToText(
+                assistant_id,
+                call_id=call_id,
+                on_transcript=on_transcript,
+                on_speech_started=on_speech_started,
+                encoding=stt_encoding,
+                sample_rate=stt_sample_rate
+            ),
+            client_sid=client_sid,
+        )
+
+    def __repr__(self):
+        return f'<CallSession {self.call_id} {self.state.value}>'
+
+    @property
+    def is_speaking(self):
+        return self.state is CallState.speaking
+
+    @property
+    def is_responding(self):
+        """Whether a response holds the audio output, while it is prepared or played."""
+        return self.state in (CallState.thinking, CallState.speaking)
+
+    def touch(self):
+        """Record activity from the client of the call."""
+        self.last_seen = time.time()
+
+    def transition(self, new_state):
+        """Move to new_state if the transition is allowed, returns whether it happened."""
+        if new_state is self.state:
+            return True
+        if new_state not in CALL_STATE_TRANSITIONS[self.state]:
+            logging.warning(f"📞 [CALL] Invalid state transition for call {self.call_id}: {self.state.value} -> {new_state.value}")
+            return False
+        self.state = new_state
+        return True
+
+    def close(self):
+        """End the call and drop the conversation memory, the STT stream is stopped by the caller."""
+        # A response still being generated would write into the memory of the next call
+        recyclable = self.state in (CallState.greeting, CallState.listening)
+        self.transition(CallState.ended)
+        self.pending_audio.clear()
+        self.pending_responses.clear()
+        try:
+            self.assistant_llm.clear_memory()
+            if recyclable:
+                component_pool.release(self.assistant_id, self.assistant_llm, self.tts)
+        except Exception as e:
+            logging.error(f"❌ [ERROR] Error releasing components of call {self.call_id}: {str(e)}")
+
+    def start_speaking(self):
+        """Claim the audio output of the call, False if something is already playing.
+
+        Check and set happen without yielding to the hub, so two greenlets
+        can never both start streaming audio for the same call. The call is
+        thinking until the first audio frame is sent, see audio_started.
+        """
+        if self.is_responding or self.state is CallState.ended:
+            return False
+        return self.transition(CallState.thinking)
+
+    def audio_started(self):
+        """The first audio frame of the claimed output was sent, the call is speaking."""
+        if self.state is CallState.thinking:
+            self.transition(CallState.speaking)
+
+    def finish_speaking(self, generation):
+        """Release the audio output and return the next queued response, if any.
+
+        An output of an older generation was released by interrupt, the call
+        may already be answering the next turn and is left as it is.
+        """
+        if self.state is CallState.ended or generation != self.output_generation:
+            return None
+        if self.pending_responses:
+            return self.pending_responses.popleft()
+        self.transition(CallState.listening)
+        return None
+
+    def interrupt(self):
+        """Drop what the call is preparing, saying and has queued, False if nothing was playing."""
+        if not self.is_responding:
+            return False
+        self.output_generation += 1
+        self.pending_audio.clear()
+        self.pending_responses.clear()
+        # The audio loops stop on the new generation, the next turn can claim the output meanwhile
+        self.transition(CallState.listening)
+        return True
+
+    def new_transcoder(self):
+        """Transcoder from the TTS audio to the format of the client, one per audio stream."""
+        return AudioTranscoder(self.audio_format)
+
+    def queue_response(self, response):
+        """Queue a response to speak once the current audio is finished."""
+        if len(self.pending_responses) == self.pending_responses.maxlen:
+            logging.warning(f"🔊 [AUDIO] Pending responses full for call {self.call_id}, dropping the oldest")
+        self.pending_responses.append(response)
+
+    def queue_audio(self, chunk):
+        """Keep a TTS audio chunk for a client that is not connected yet, it is transcoded on delivery."""
+        self.pending_audio.append(chunk)
+
+    def take_pending_audio(self):
+        """Return the pending audio chunks and clear the queue."""
+        chunks = list(self.pending_audio)
+        self.pending_audio.clear()
+        return chunks
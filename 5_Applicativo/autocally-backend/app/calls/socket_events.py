@@ -1,28 +1,87 @@
 from ..phone_numbers.models import PhoneNumber
-from libs.assistant.assistant_llm import AssistantLLM
-from libs.assistant.text_to_speech import TTS
-from libs.assistant.speech_to_text import SpeechToText
 from ..security.routes import auth
 from ..extensions import db, socketio
 from flask import request, current_app
 import logging
 import time
-import asyncio
 import eventlet
 from eventlet import spawn_after
 from datetime import datetime
 import numpy as np
-from flask_socketio import emit
+from flask_socketio import emit, join_room
+from .. import metrics
 from .models import Call, ConversationTranscript, ConversationRole, CallSystemMessage, CallSystemMessageType
+from .session import CallSession
+from .pacer import audio_pacer
+from .framing import close_channel, open_channel, read_frame
+from libs.assistant.audio_cache import greeting_cache
+from libs.assistant.audio_codec import audio_format_dict, parse_audio_format
+from libs.assistant.text_to_speech import DEFAULT_GREETING, greeting_text
+from libs.assistant.text_segmenter import segment_text
+from libs.assistant.stt_dispatcher import stt_dispatcher
 
 # We're using the socketio instance from extensions to avoid circular imports
 # This is the same instance used in assistants/socket_events.py
 
 eventlet.monkey_patch()
 
-# Cache for active calls - simplified structure
+# Active calls by call_id, each entry is a CallSession
 active_calls = {}
 
+# Words a transcript needs to interrupt the assistant, shorter ones are noise or backchannel
+BARGE_IN_MIN_WORDS = 2
+
+def call_room(call_id):
+    """Name of the Socket.IO room joined by the clients of a call."""
+    return f"call_{call_id}"
+
+def audio_payload(call_id, frame, audio_format, is_greeting):
+    """audio_chunk event carrying one frame in the format negotiated by the call."""
+    return {
+        'call_id': call_id,
+        'audio': {
+            'data': frame,
+            'format': 'raw',
+            'encoding': audio_format.encoding,
+            'sample_rate': audio_format.sample_rate
+        },
+        'is_greeting': is_greeting,
+        'final': False
+    }
+
+def call_audio_stream(session):
+    """Paced audio stream of a call, sent to its Twilio media stream, as binary frames or as dicts to its room."""
+    return audio_pacer.stream(session.call_id, call_room(session.call_id), session.media_stream or session.audio_channel)
+
+def call_ready_payload(session, phone_number_id):
+    """call_ready event, it carries the audio format and framing once for the whole call."""
+    payload = {
+        'call_id': session.call_id,
+        'phone_number_id': phone_number_id,
+        'audio_format': audio_format_dict(session.audio_format),
+        'binary_frames': session.audio_channel is not None
+    }
+    if session.audio_channel:
+        payload['call_slot'] = session.audio_channel.slot
+    return payload
+
+def send_audio_frames(stream, transcoder, frames, call_id, is_greeting, first_chunk_time=None):
+    """Send transcoded frames through the pacer, the first one carries first_chunk_time if given."""
+    for frame in frames:
+        audio_data = audio_payload(call_id, frame, transcoder.audio_format, is_greeting)
+        if first_chunk_time is not None:
+            audio_data['first_chunk_time'] = first_chunk_time
+            first_chunk_time = None
+        audio_pacer.send(stream, audio_data, transcoder.duration(frame))
+    return len(frames)
+
+def call_app(call_id):
+    """Flask app of a call, greenlets spawned for it have no app context of their own."""
+    session = active_calls.get(str(call_id))
+    if session and session.app:
+        return session.app
+    return current_app._get_current_object()
+
 @socketio.on('connect')
 def handle_connect():
     """Handle new WebSocket connections - simplified like in assistants."""
@@ -32,52 +91,31 @@ def handle_connect():
     
     logging.warning(f"🔌 [SOCKET] Connection parameters: call_id={call_id}, phone_number_id={phone_number_id}")
     
+    # Bind the client to the room of its call so call events only reach it
+    if call_id:
+        join_room(call_room(call_id))
+    
     # Always emit connection established event
     socketio.emit('connection_established', {
         'status': 'connected',
         'call_id': call_id
-    })
+    }, to=request.sid)
     
     # Check if we're reconnecting to an active call
-    if call_id and call_id in active_calls:
-        call_data = active_calls[call_id]
-        call_data['last_seen'] = time.time()  # Track when we last saw this client
+    session = active_calls.get(call_id) if call_id else None
+    if session:
+        session.touch()  # Track when we last saw this client
+        session.client_sid = request.sid
         
         # Send call_ready to confirm the connection
-        socketio.emit('call_ready', {
-            'call_id': call_id,
-            'phone_number_id': phone_number_id
-        })
+        socketio.emit('call_ready', call_ready_payload(session, phone_number_id), to=call_room(call_id))
         
         # If there's pending audio, deliver it with a small delay to ensure client is ready
-        if 'pending_audio' in call_data and call_data['pending_audio']:
+        if session.pending_audio:
             logging.warning(f"🔌 [SOCKET] Found pending audio for call {call_id}, scheduling delivery")
             # Use a small delay to make sure client is ready to receive
             eventlet.spawn_after(0.5, deliver_pending_audio, call_id)
 
-def ping_client(call_id):
-    """Send periodic pings to verify connection."""
-    try:
-        if call_id not in active_calls:
-            return
-            
-        call_data = active_calls[call_id]
-        
-        # Send a ping
-        socketio.emit('server_ping', {
-            'timestamp': time.time(),
-            'call_id': call_id
-        })
-        
-        # Update last seen time
-        call_data['last_seen'] = time.time()
-        
-        # Schedule next ping
-        eventlet.spawn_after(5.0, ping_client, call_id)
-            
-    except Exception as e:
-        logging.error(f"❌ [ERROR] Error in ping_client: {str(e)}")
-
 @socketio.on('disconnect')
 def handle_disconnect():
     logging.warning("🔌 [SOCKET] Client disconnected")
@@ -85,76 +123,54 @@ def handle_disconnect():
 def deliver_pending_audio(call_id):
     """Deliver any pending audio chunks."""
     try:
-        if call_id not in active_calls:
+        session = active_calls.get(call_id)
+        if not session:
             logging.warning(f"❌ [AUDIO] Cannot deliver pending audio: call {call_id} not in active calls")
             return
             
-        call_data = active_calls[call_id]
-        if 'pending_audio' not in call_data or not call_data['pending_audio']:
+        if not session.pending_audio:
             logging.warning(f"❌ [AUDIO] No pending audio found for call {call_id}")
             return
             
-        pending_audio = call_data['pending_audio']
-        is_greeting = call_data.get('is_greeting_audio', False)
-        audio_format = call_data.get('audio_format', 'pcm_f32le')
+        pending_audio = session.take_pending_audio()
+        is_greeting = session.is_greeting_audio
+        transcoder = session.new_transcoder()
+        generation = session.output_generation
         
         logging.warning(f"🔊 [AUDIO] Attempting to deliver {len(pending_audio)} pending chunks for call {call_id}")
         
+        stream = call_audio_stream(session)
+        chunks_delivered = 0
         chunks_sent = 0
         for chunk in pending_audio:
+            if session.output_generation != generation:
+                logging.info(f"🔊 [AUDIO] Pending audio delivery interrupted for call {call_id}")
+                break
             if not chunk:
                 logging.warning(f"❌ [AUDIO] Empty chunk, skipping")
                 continue
-                
-            try:
-                audio_data = {
-                    'call_id': call_id,
-                    'audio': {
-                        'data': chunk,
-                        'format': 'raw',
-                        'encoding': audio_format,
-                        'sample_rate': 22050
-                    },
-                    'is_greeting': is_greeting,
-                    'final': False
-                }
-                
-                socketio.emit('audio_chunk', audio_data)
-                chunks_sent += 1
-                
-                # Calculate appropriate delay based on audio chunk length
-                # For PCM_F32LE format, each sample is 4 bytes (32 bits)
-                # So the duration is (bytes / 4) / sample_rate
-                chunk_duration = len(chunk) / 4 / 22050  # duration in seconds
-                
-                # Add a small buffer to ensure smooth playback (90% of the actual duration)
-                sleep_time = chunk_duration * 0.9
-                
-                logging.debug(f"🔊 [AUDIO] Chunk size: {len(chunk)} bytes, duration: {chunk_duration:.4f}s, sleeping for {sleep_time:.4f}s")
-                eventlet.sleep(sleep_time)
-                
-            except Exception as e:
-                logging.error(f"❌ [AUDIO] Error sending pending chunk: {str(e)}")
+            
+            chunks_sent += send_audio_frames(stream, transcoder, transcoder.process(chunk), call_id, is_greeting)
+            chunks_delivered += 1
         
-        # Only clear pending audio if we sent all chunks
-        if chunks_sent == len(pending_audio):
-            call_data['pending_audio'] = []
-            logging.info(f"🔊 [AUDIO] All pending chunks sent, cleared pending audio")
+        if chunks_delivered < len(pending_audio):
+            logging.warning(f"❌ [AUDIO] Only sent {chunks_delivered}/{len(pending_audio)} chunks")
         else:
-            logging.warning(f"❌ [AUDIO] Only sent {chunks_sent}/{len(pending_audio)} chunks")
+            chunks_sent += send_audio_frames(stream, transcoder, transcoder.flush(), call_id, is_greeting)
+            logging.info("🔊 [AUDIO] All pending chunks sent")
         
-        # Send completion marker
-        try:
-            socketio.emit('audio_chunk', {
-                'call_id': call_id,
-                'final': True,
-                'chunks_sent': chunks_sent,
-                'is_greeting': is_greeting
-            })
-            
-            logging.warning(f"🔊 [AUDIO] Completed delivery of {chunks_sent} pending chunks")
-        except Exception as e:
-            logging.error(f"❌ [AUDIO] Error sending final marker: {str(e)}")
+        if session.output_generation != generation:
+            # The stream was flushed, a marker now would end the response of the next turn
+            return
+        
+        # Send completion marker once the client has played the audio
+        audio_pacer.finish(stream, {
+            'call_id': call_id,
+            'final': True,
+            'chunks_sent': chunks_sent,
+            'is_greeting': is_greeting
+        })
+        logging.warning(f"🔊 [AUDIO] Completed delivery of {chunks_sent} pending chunks")
         
     except Exception as e:
         logging.error(f"🔊 [AUDIO] Error in pending audio delivery: {str(e)}")
@@ -171,18 +187,24 @@ def handle_call_started(data):
         logging.warning(f"📞 [CALL] Starting call with ID {call_id} and phone_number_id {phone_number_id}")
         
         if not call_id or not phone_number_id:
-            socketio.emit('error', {'message': 'Missing call_id or phone_number_id'})
+            socketio.emit('error', {'message': 'Missing call_id or phone_number_id'}, to=request.sid)
             return
+        
+        # Join the call room, this also rebinds clients that reconnected with a new sid
+        join_room(call_room(call_id))
             
         # Get call and phone number from the database
         call = Call.query.get_or_404(call_id)
         phone_number = PhoneNumber.query.get_or_404(phone_number_id)
         
         # Initialize call components or update existing call data
-        if str(call_id) in active_calls:
+        session = active_calls.get(str(call_id))
+        if session:
             # Update existing call data
-            call_data = active_calls[str(call_id)]
-            call_data['last_seen'] = time.time()  # Update last seen time
+            session.touch()  # Update last seen time
+            session.client_sid = request.sid
+            if data.get('audio_format'):
+                session.audio_format = parse_audio_format(data['audio_format'])
             logging.warning(f"📞 [CALL] Reconnected to existing call {call_id}")
         else:
             # Initialize call components
@@ -191,166 +213,143 @@ def handle_call_started(data):
                 assistant_id = phone_number.assistants[0].id
             
             if not assistant_id:
-                socketio.emit('error', {'message': 'No assistant associated with this phone number'})
+                socketio.emit('error', {'message': 'No assistant associated with this phone number'}, to=request.sid)
                 return
             
-            active_calls[str(call_id)] = {
-                'assistant_llm': AssistantLLM(assistant_id),
-                'tts': TTS(assistant_id),
-                'stt': SpeechToText(assistant_id),
-                'is_speaking': False,
-                'pending_audio': [],
-                'greeting_sent': False,  # Track if greeting has been sent
-                'last_seen': time.time()
-            }
+            session = CallSession.create(
+                call_id,
+                assistant_id,
+                current_app._get_current_object(),
+                on_transcript=dispatch_stt_transcript,
+                on_speech_started=dispatch_speech_started,
+                client_sid=request.sid
+            )
+            # The browser asks for its playback format, clients that do not get the TTS format
+            session.audio_format = parse_audio_format(data.get('audio_format'))
+            active_calls[session.call_id] = session
             
             logging.warning(f"📞 [CALL] Initialized new call {call_id}")
         
-        # Send call ready event
-        socketio.emit('call_ready', {
-            'call_id': call_id,
-            'phone_number_id': phone_number_id
-        })
+        # Clients that support it exchange audio as binary frames
+        if data.get('binary_frames') and not session.audio_channel:
+            session.audio_channel = open_channel(session.call_id, call_room(session.call_id))
         
-        # Get reference to the call data
-        call_data = active_calls[str(call_id)]
+        # Send call ready event with the audio format the call will receive
+        socketio.emit('call_ready', call_ready_payload(session, phone_number_id), to=call_room(call_id))
         
         # Check for pending audio
-        if len(call_data.get('pending_audio', [])) > 0:
-            logging.warning(f"📞 [CALL] Found {len(call_data['pending_audio'])} pending audio chunks, scheduling delivery")
-            eventlet.spawn_after(0.5, deliver_pending_audio, str(call_id))
+        if session.pending_audio:
+            logging.warning(f"📞 [CALL] Found {len(session.pending_audio)} pending audio chunks, scheduling delivery")
+            eventlet.spawn_after(0.5, deliver_pending_audio, session.call_id)
             return
             
         # If no pending audio and greeting not sent, start with a greeting
-        if not call_data.get('greeting_sent', False):
-            # Get the assistant associated with this phone number
-            assistant_id = None
-            if phone_number.assistants and len(phone_number.assistants) > 0:
-                assistant_id = phone_number.assistants[0].id
-            
-            # Default greeting in case we don't have a custom one
-            default_greeting = "Ciao sono il tuo assistente virtuale, come posso aiutarti oggi?"
-            greeting = default_greeting
-            
-            # If we have an assistant, try to get a custom greeting
-            if assistant_id:
-                from ..assistants.models import Assistant
-                assistant = Assistant.query.get(assistant_id)
-                if assistant and assistant.greeting_message:
-                    greeting = assistant.greeting_message
-                    logging.info(f"📞 [CALL] Using custom greeting for assistant {assistant_id}: {greeting[:50]}...")
-                else:
-                    logging.info(f"📞 [CALL] No custom greeting found for assistant {assistant_id}, using default")
-            else:
-                logging.warning(f"📞 [CALL] No assistant associated with phone number {phone_number_id}, using default greeting")
-            
-            # Store greeting transcript in the database within this request context
-            transcript = ConversationTranscript(
-                call_id=call.id,
-                transcript=greeting,
-                role=ConversationRole.assistant,
-                created_at=datetime.utcnow()
-            )
-            db.session.add(transcript)
-            db.session.commit()
-            
-            # Mark greeting as sent to prevent duplicate greetings
-            call_data['greeting_sent'] = True
-            
-            # Process greeting in a separate thread (audio only)
-            eventlet.spawn(process_greeting, str(call_id), greeting)
-            logging.warning(f"📞 [CALL] Greeting scheduled for call {call_id}")
-        else:
-            logging.warning(f"📞 [CALL] Greeting already sent for call {call_id}, skipping")
+        start_greeting(session, call)
         
     except Exception as e:
         logging.error(f"❌ [ERROR] Exception in call_started handler: {str(e)}")
-        socketio.emit('error', {'message': str(e)})
+        socketio.emit('error', {'message': str(e)}, to=request.sid)
+
+def start_greeting(session, call):
+    """Store the greeting of the assistant and speak it, once per call. Needs an app context."""
+    if session.greeting_sent:
+        logging.warning(f"📞 [CALL] Greeting already sent for call {session.call_id}, skipping")
+        return
+    
+    # Try to get a custom greeting from the assistant of the call
+    from ..assistants.models import Assistant
+    assistant = Assistant.query.get(session.assistant_id)
+    greeting = greeting_text(assistant) if assistant else DEFAULT_GREETING
+    if assistant and assistant.greeting_message:
+        logging.info(f"📞 [CALL] Using custom greeting for assistant {session.assistant_id}: {greeting[:50]}...")
+    else:
+        logging.info(f"📞 [CALL] No custom greeting found for assistant {session.assistant_id}, using default")
+    
+    # Store greeting transcript in the database within this request context
+    transcript = ConversationTranscript(
+        call_id=call.id,
+        transcript=greeting,
+        role=ConversationRole.assistant,
+        created_at=datetime.utcnow()
+    )
+    db.session.add(transcript)
+    db.session.commit()
+    
+    # Mark greeting as sent to prevent duplicate greetings
+    session.greeting_sent = True
+    
+    # Process greeting in a separate thread (audio only)
+    eventlet.spawn(process_greeting, session.call_id, greeting)
+    logging.warning(f"📞 [CALL] Greeting scheduled for call {session.call_id}")
 
 def process_greeting(call_id, greeting):
     """Process greeting in a separate thread - audio generation and delivery only."""
     try:
         # Skip if the call no longer exists
-        if call_id not in active_calls:
+        session = active_calls.get(call_id)
+        if not session:
             logging.warning(f"❌ [AUDIO] Cannot process greeting: call {call_id} not found")
             return
             
-        call_data = active_calls[call_id]
-        
-        # Check if already speaking (prevent duplicate audio streaming)
-        if call_data.get('is_speaking', False):
+        # Claim the audio output (prevent duplicate audio streaming)
+        if not session.start_speaking():
             logging.warning(f"❌ [AUDIO] Cannot process greeting: already speaking for call {call_id}")
             return
-            
-        # Mark as speaking to prevent duplicate audio streaming
-        call_data['is_speaking'] = True
         
         greeting_start_time = time.time()
-        tts = call_data['tts']
+        tts = session.tts
+        generation = session.output_generation
         
         logging.info(f"🔊 [AUDIO] Starting TTS for call {call_id}")
         
         try:
-            audio_stream = tts.get_audio_stream(greeting)
+            # Greetings rarely change, replay them from the cache when possible
+            audio_stream = tts.get_cached_audio_stream(greeting, greeting_cache)
             
             # Stream audio chunks immediately as they're generated
-            first_chunk = True
-            first_chunk_time = time.time() - greeting_start_time
+            stream = call_audio_stream(session)
+            transcoder = session.new_transcoder()
             chunks_sent = 0
             
             for chunk in audio_stream:
+                if session.output_generation != generation:
+                    logging.info(f"🔊 [AUDIO] Greeting interrupted by the caller for call {call_id}")
+                    break
                 if chunk and len(chunk) > 0:
-                    try:
-                        audio_data = {
-                            'call_id': call_id,
-                            'audio': {
-                                'data': chunk,
-                                'format': 'raw',
-                                'encoding': 'pcm_f32le',
-                                'sample_rate': 22050
-                            },
-                            'is_greeting': True,
-                            'final': False
-                        }
-                        
-                        if first_chunk:
-                            audio_data['first_chunk_time'] = first_chunk_time
-                            first_chunk = False
-                            logging.info(f"🔊 [AUDIO] Sending first greeting chunk with size {len(chunk)} bytes")
-                        
-                        socketio.emit('audio_chunk', audio_data)
-                        chunks_sent += 1
-                        
-                        # Calculate appropriate delay based on audio chunk length
-                        # For PCM_F32LE format, each sample is 4 bytes (32 bits)
-                        # So the duration is (bytes / 4) / sample_rate
-                        chunk_duration = len(chunk) / 4 / 22050  # duration in seconds
-                        
-                        # Add a small buffer to ensure smooth playback (90% of the actual duration)
-                        sleep_time = chunk_duration * 0.9
-                        
-                        logging.debug(f"🔊 [AUDIO] Chunk size: {len(chunk)} bytes, duration: {chunk_duration:.4f}s, sleeping for {sleep_time:.4f}s")
-                        eventlet.sleep(sleep_time)
-                        
-                    except Exception as e:
-                        logging.error(f"❌ [AUDIO] Error sending chunk: {str(e)}")
-            
-            # Send completion marker after all chunks
-            try:
-                socketio.emit('audio_chunk', {
+                    # Keep the audio until a client joins the call
+                    if not session.client_sid:
+                        session.is_greeting_audio = True
+                        session.queue_audio(chunk)
+                        continue
+                    
+                    first_chunk_time = None
+                    if not chunks_sent:
+                        first_chunk_time = time.time() - greeting_start_time
+                        logging.info(f"🔊 [AUDIO] Sending first greeting chunk with size {len(chunk)} bytes")
+                        session.audio_started()
+                    
+                    chunks_sent += send_audio_frames(stream, transcoder, transcoder.process(chunk), call_id, True, first_chunk_time)
+            
+            if session.output_generation == generation:
+                chunks_sent += send_audio_frames(stream, transcoder, transcoder.flush(), call_id, True)
+            
+            # Send completion marker once the client has played the greeting
+            if chunks_sent and session.output_generation == generation:
+                audio_pacer.finish(stream, {
                     'call_id': call_id,
                     'final': True,
                     'chunks_sent': chunks_sent,
                     'is_greeting': True
                 })
                 logging.info(f"🔊 [AUDIO] Successfully completed greeting audio delivery for call {call_id}")
-            except Exception as e:
-                logging.error(f"❌ [AUDIO] Error sending final marker: {str(e)}")
+            elif not chunks_sent:
+                logging.warning(f"🔊 [AUDIO] No client connected for call {call_id}, stored {len(session.pending_audio)} greeting chunks")
                 
         finally:
-            # Reset speaking state regardless of success or failure
-            if call_id in active_calls:
-                active_calls[call_id]['is_speaking'] = False
+            # Closing the stream cancels the synthesis when it was interrupted
+            audio_stream.close()
+            # Release the audio output regardless of success or failure
+            release_audio_output(session, generation)
                 
     except Exception as e:
         logging.error(f"❌ [ERROR] Error processing greeting: {str(e)}")
@@ -364,41 +363,43 @@ def handle_start_stt(data):
         call_id = data.get('call_id')
         
         if not call_id:
-            socketio.emit('error', {'message': 'Missing call_id'})
+            socketio.emit('error', {'message': 'Missing call_id'}, to=request.sid)
             return
             
         if call_id not in active_calls:
-            socketio.emit('error', {'message': 'Call not found'})
+            socketio.emit('error', {'message': 'Call not found'}, to=request.sid)
             return
             
-        call_data = active_calls[call_id]
-        speech_to_text = call_data['stt']
+        session = active_calls[call_id]
+        session.touch()
         
-        logging.info(f"🎤 [STT] Starting speech-to-text stream for call {call_id}")
-        
-        def start_stt_stream():
-            try:
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                loop.run_until_complete(speech_to_text.start_stream())
-                socketio.emit('stt_started', {'status': 'ready', 'call_id': call_id})
-                logging.info(f"🎤 [STT] Speech recognition started successfully for call {call_id}")
-            except Exception as e:
-                logging.error(f"Error starting STT stream: {str(e)}")
-                socketio.emit('error', {'message': str(e)})
-            finally:
-                loop.close()
-        
-        eventlet.spawn(start_stt_stream)
+        eventlet.spawn(start_stt_stream, session.stt, call_id)
         
     except Exception as e:
         logging.error(f"Error in start_stt: {str(e)}")
-        socketio.emit('error', {'message': str(e)})
+        socketio.emit('error', {'message': str(e)}, to=request.sid)
+
+def start_stt_stream(speech_to_text, call_id):
+    """Open the Deepgram stream of a call, audio sent before it is open is buffered."""
+    logging.info(f"🎤 [STT] Starting speech-to-text stream for call {call_id}")
+    try:
+        # start_stream runs the connection setup on its own event loop
+        if not speech_to_text.start_stream():
+            raise RuntimeError('Could not open the Deepgram stream')
+        socketio.emit('stt_started', {'status': 'ready', 'call_id': call_id}, to=call_room(call_id))
+        logging.info(f"🎤 [STT] Speech recognition started successfully for call {call_id}")
+    except Exception as e:
+        logging.error(f"Error starting STT stream: {str(e)}")
+        socketio.emit('error', {'message': str(e)}, to=call_room(call_id))
 
 @socketio.on('stt_audio_chunk')
 def handle_audio_chunk(data):
     """Handle continuous audio chunks for STT processing."""
     try:
+        if isinstance(data, (bytes, bytearray)):
+            handle_audio_frame(data)
+            return
+        
         call_id = data.get('call_id')
         audio_data = data.get('audio')
         sample_rate = data.get('sample_rate', 16000)
@@ -407,12 +408,14 @@ def handle_audio_chunk(data):
         if not call_id or not audio_data:
             return
             
-        if call_id in active_calls:
-            call_data = active_calls[call_id]
-            speech_to_text = call_data['stt']
+        session = active_calls.get(call_id)
+        if session:
+            if not is_call_client(session):
+                return
+            session.touch()
             
-            # Process the chunk in a non-blocking way
-            eventlet.spawn(process_audio_chunk, speech_to_text, audio_data, call_id, sample_rate, format)
+            # Queued in order for the STT dispatcher, this does not block
+            process_audio_chunk(session.stt, audio_data, call_id, sample_rate, format)
         else:
             logging.warning(f"Call {call_id} not found in active calls")
             
@@ -421,6 +424,29 @@ def handle_audio_chunk(data):
         import traceback
         logging.error(traceback.format_exc())
 
+def is_call_client(session):
+    """Whether the audio comes from the client bound to the call, the audio of any other socket is dropped."""
+    if request.sid == session.client_sid:
+        return True
+    metrics.increment('calls.foreign_audio')
+    logging.warning(f"🎤 [STT] Dropped audio for call {session.call_id} from client {request.sid}")
+    return False
+
+def handle_audio_frame(frame):
+    """Binary stt_audio_chunk, the call slot in the header identifies the call."""
+    channel, sequence, audio = read_frame(frame)
+    session = active_calls.get(channel.call_id) if channel else None
+    if not session:
+        logging.warning("🎤 [STT] Audio frame for an unknown call slot")
+        return
+    # Slots are small numbers, any client could guess the slot of another call
+    if not is_call_client(session):
+        return
+    
+    channel.receive(sequence)
+    session.touch()
+    process_audio_chunk(session.stt, audio, session.call_id)
+
 @socketio.on('stop_stt')
 def handle_stop_stt(data):
     """Handle stopping the STT stream properly."""
@@ -428,68 +454,53 @@ def handle_stop_stt(data):
         call_id = data.get('call_id')
         
         if not call_id:
-            socketio.emit('error', {'message': 'Missing call_id'})
+            socketio.emit('error', {'message': 'Missing call_id'}, to=request.sid)
             return
             
         if call_id not in active_calls:
-            socketio.emit('error', {'message': 'Call not found'})
+            socketio.emit('error', {'message': 'Call not found'}, to=request.sid)
             return
         
         logging.info(f"🎤 [STT] Stopping speech recognition for call {call_id}")
         
-        call_data = active_calls[call_id]
-        speech_to_text = call_data['stt']
-        
-        def stop_stream_task():
-            try:
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                try:
-                    loop.run_until_complete(speech_to_text.stop_stream())
-                    logging.info(f"🎤 [STT] Successfully stopped STT stream for call {call_id}")
-                finally:
-                    loop.close()
-            except Exception as e:
-                logging.error(f"Error stopping STT stream: {str(e)}")
-        
-        eventlet.spawn(stop_stream_task)
-        socketio.emit('stt_stopped', {'status': 'stopped', 'call_id': call_id})
+        eventlet.spawn(stop_stt_stream, active_calls[call_id].stt, call_id)
+        socketio.emit('stt_stopped', {'status': 'stopped', 'call_id': call_id}, to=call_room(call_id))
         
     except Exception as e:
         logging.error(f"Error in stop_stt: {str(e)}")
-        socketio.emit('error', {'message': str(e)})
+        socketio.emit('error', {'message': str(e)}, to=request.sid)
+
+def stop_stt_stream(speech_to_text, call_id):
+    """Close the Deepgram stream of a call once the audio queued before is sent."""
+    try:
+        stt_dispatcher.stop(speech_to_text).wait()
+        logging.info(f"🎤 [STT] Successfully stopped STT stream for call {call_id}")
+    except Exception as e:
+        logging.error(f"Error stopping STT stream: {str(e)}")
+
+def end_call_session(call_id):
+    """Remove a call from active_calls and release its STT stream and LLM memory."""
+    session = active_calls.pop(str(call_id), None)
+    if not session:
+        return None
+    
+    session.close()
+    audio_pacer.close(session.call_id)
+    if session.audio_channel:
+        close_channel(session.audio_channel)
+    eventlet.spawn(stop_stt_stream, session.stt, session.call_id)
+    logging.warning(f"📞 [CALL] Released resources of call {session.call_id}")
+    return session
 
 def process_audio_chunk(speech_to_text, audio_data, call_id, sample_rate=16000, format='linear16'):
-    """Process audio chunk for STT and generate response with proper error handling."""
+    """Queue an audio chunk of a call for its STT stream.
+    
+    sample_rate and format are kept for the callers, the stream format
+    is fixed when the Deepgram connection is opened.
+    """
     try:
-        # Process audio using the SpeechToText process_chunk method
-        # This needs to be handled properly since it's an async method
-        
-        # Create data structure expected by process_chunk
-        audio_chunk_data = {
-            'audio': audio_data,
-            'sample_rate': sample_rate,
-            'format': format,
-            'call_id': call_id
-        }
-        
-        # Since process_chunk is an async method, we need to run it in an event loop
-        def process_in_eventlet():
-            try:
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                try:
-                    loop.run_until_complete(speech_to_text.process_chunk(audio_chunk_data))
-                    logging.info(f"🎤 [STT] Successfully processed audio chunk for call {call_id}")
-                finally:
-                    loop.close()
-            except Exception as e:
-                logging.error(f"Error processing audio in eventlet: {str(e)}")
-                import traceback
-                logging.error(traceback.format_exc())
-        
-        # Spawn the async processing in an eventlet greenthread
-        eventlet.spawn(process_in_eventlet)
+        # The STT dispatcher sends the chunks of each call in order from its own greenlet
+        stt_dispatcher.submit(speech_to_text, audio_data)
         
         # The transcription handling will be done by the SpeechToText class
         # which emits 'stt_transcript' events when transcriptions are available
@@ -502,11 +513,7 @@ def process_audio_chunk(speech_to_text, audio_data, call_id, sample_rate=16000,
 def store_transcripts(call_id, caller_text, assistant_text):
     """Store transcripts in database with proper app context."""
     try:
-        # Import Flask current_app
-        from flask import current_app
-        
-        # Create a copy to ensure we have a reference to the app
-        app = current_app._get_current_object()
+        app = call_app(call_id)
         
         with app.app_context():
             # Store in database
@@ -545,91 +552,138 @@ def store_transcripts(call_id, caller_text, assistant_text):
     except Exception as e:
         logging.error(f"Error in store_transcripts: {str(e)}")
 
-def generate_response_audio(call_id, response):
-    """Generate audio for response with improved streaming and state management."""
+def stream_response_audio(session, audio_stream, start_time, generation):
+    """Send the chunks of a response audio stream to the call through the pacer."""
+    call_id = session.call_id
+    stream = call_audio_stream(session)
+    transcoder = session.new_transcoder()
+    chunks_sent = 0
+    
+    for chunk in audio_stream:
+        if session.output_generation != generation:
+            logging.info(f"🔊 [AUDIO] Response interrupted by the caller for call {call_id}")
+            # Cancels the TTS generator and its Cartesia context
+            audio_stream.close()
+            break
+        if chunk and len(chunk) > 0:
+            first_chunk_time = None
+            if not chunks_sent:
+                first_chunk_time = time.time() - start_time
+                logging.info(f"🔊 [AUDIO] First response chunk for call {call_id} after {first_chunk_time:.2f}s")
+                session.audio_started()
+            
+            chunks_sent += send_audio_frames(stream, transcoder, transcoder.process(chunk), call_id, False, first_chunk_time)
+    
+    if session.output_generation != generation:
+        # The stream was flushed, a marker now would end the response of the next turn
+        return chunks_sent
+    
+    chunks_sent += send_audio_frames(stream, transcoder, transcoder.flush(), call_id, False)
+    
+    # Send completion marker once the client has played the response
+    audio_pacer.finish(stream, {
+        'call_id': call_id,
+        'final': True,
+        'chunks_sent': chunks_sent,
+        'is_greeting': False
+    })
+    logging.info(f"🔊 [AUDIO] Successfully completed response audio delivery ({chunks_sent} chunks)")
+    
+    return chunks_sent
+
+def barge_in(session, reason):
+    """Stop the audio of a call because the caller started speaking."""
+    if not session.interrupt():
+        return False
+    
+    logging.warning(f"🔊 [AUDIO] Barge-in on call {session.call_id} ({reason}), stopping playback")
+    metrics.increment('calls.barge_ins')
+    audio_pacer.flush(session.call_id)
+    # The client drops the audio it has buffered but not played yet
+    if session.media_stream:
+        session.media_stream.clear()
+    socketio.emit('audio_flush', {'call_id': session.call_id}, to=call_room(session.call_id))
+    return True
+
+def is_barge_in(transcript):
+    """Whether a transcript is the caller talking, not a noise or a short backchannel."""
+    return len(transcript.split()) >= BARGE_IN_MIN_WORDS
+
+def dispatch_speech_started(call_id):
+    """Deepgram VAD detected speech on a call, its transcripts decide whether it is a barge-in."""
+    if call_id in active_calls:
+        metrics.increment('calls.speech_started')
+
+def release_audio_output(session, generation):
+    """Release the output of a call or start the next queued response."""
+    next_response = session.finish_speaking(generation)
+    if next_response:
+        logging.info(f"🔊 [AUDIO] Processing pending response for call {session.call_id}")
+        eventlet.spawn_after(0.5, generate_response_audio, session.call_id, next_response, generation)
+
+def generate_response_audio(call_id, response, generation):
+    """Stream the audio of a response, the caller must have claimed the output with start_speaking."""
+    session = active_calls.get(call_id)
+    if not session:
+        logging.warning(f"❌ [AUDIO] Cannot generate response audio: call {call_id} not in active calls")
+        return
+    
     try:
-        if call_id not in active_calls:
-            logging.warning(f"❌ [AUDIO] Cannot generate response audio: call {call_id} not in active calls")
-            return
-            
-        call_data = active_calls[call_id]
-        tts = call_data['tts']
-        
-        # Set speaking state to prevent overlapping audio
-        call_data['is_speaking'] = True
-        
+        session.is_greeting_audio = False
         logging.info(f"🔊 [AUDIO] Starting response audio generation for call {call_id}")
         
         # Generate and stream audio chunks immediately
-        audio_stream = tts.get_audio_stream(response)
-        
-        chunks_sent = 0
-        first_chunk = True
-        tts_start_time = time.time()
-        
-        for chunk in audio_stream:
-            if chunk and len(chunk) > 0:
-                try:
-                    audio_data = {
-                        'call_id': call_id,
-                        'audio': {
-                            'data': chunk,
-                            'format': 'raw',
-                            'encoding': 'pcm_f32le',
-                            'sample_rate': 22050
-                        },
-                        'is_greeting': False,
-                        'final': False
-                    }
-                    
-                    if first_chunk:
-                        first_chunk_time = time.time() - tts_start_time
-                        audio_data['first_chunk_time'] = first_chunk_time
-                        first_chunk = False
-                    
-                    socketio.emit('audio_chunk', audio_data)
-                    chunks_sent += 1
-                    
-                    # Calculate appropriate delay based on audio chunk length
-                    chunk_duration = len(chunk) / 4 / 22050  # duration in seconds
-                    sleep_time = chunk_duration * 0.9
-                    
-                    logging.debug(f"🔊 [AUDIO] Chunk size: {len(chunk)} bytes, duration: {chunk_duration:.4f}s, sleeping for {sleep_time:.4f}s")
-                    eventlet.sleep(sleep_time)
-                    
-                except Exception as e:
-                    logging.error(f"❌ [AUDIO] Error sending response chunk: {str(e)}")
-        
-        # Send completion marker
-        try:
-            socketio.emit('audio_chunk', {
-                'call_id': call_id,
-                'final': True,
-                'chunks_sent': chunks_sent,
-                'is_greeting': False
-            })
-            
-            logging.info(f"🔊 [AUDIO] Successfully completed response audio delivery ({chunks_sent} chunks)")
-        except Exception as e:
-            logging.error(f"❌ [AUDIO] Error sending final marker: {str(e)}")
-        
-        # Reset speaking state and check for pending responses
-        call_data['is_speaking'] = False
-        
-        # Process any pending responses
-        if 'pending_responses' in call_data and call_data['pending_responses']:
-            next_response = call_data['pending_responses'].pop(0)
-            logging.info(f"🔊 [AUDIO] Processing pending response for call {call_id}")
-            eventlet.spawn_after(0.5, generate_response_audio, call_id, next_response)
+        stream_response_audio(session, session.tts.get_audio_stream(response), time.time(), generation)
             
     except Exception as e:
         logging.error(f"❌ [ERROR] Error generating response audio: {str(e)}")
         import traceback
         logging.error(traceback.format_exc())
-        
-        # Make sure we reset the speaking state even on error
-        if call_id in active_calls:
-            active_calls[call_id]['is_speaking'] = False
+    
+    release_audio_output(session, generation)
+
+def generate_streamed_response(call_id, transcript, generation):
+    """Answer a transcript speaking each sentence as soon as the LLM has written it.
+
+    The caller must have claimed the output with start_speaking. The full
+    response is stored and sent as a transcript once the LLM is done.
+    """
+    session = active_calls.get(call_id)
+    if not session:
+        logging.warning(f"❌ [AUDIO] Cannot generate response: call {call_id} not in active calls")
+        return
+    
+    start_time = time.time()
+    spoken = []
+    
+    def segments():
+        for segment in segment_text(session.assistant_llm.stream_response(transcript)):
+            if not spoken:
+                logging.info(f"🤖 [LLM] First segment for call {call_id} after {time.time() - start_time:.2f}s: '{segment}'")
+            spoken.append(segment)
+            yield segment
+    
+    try:
+        session.is_greeting_audio = False
+        stream_response_audio(session, session.tts.synthesize_stream(segments()), start_time, generation)
+    except Exception as e:
+        logging.error(f"❌ [ERROR] Error generating streamed response: {str(e)}")
+        import traceback
+        logging.error(traceback.format_exc())
+    
+    response = ' '.join(spoken)
+    logging.info(f"🤖 [LLM] Response for call {call_id} in {time.time() - start_time:.2f}s: '{response}'")
+    
+    if response:
+        eventlet.spawn(store_transcripts, call_id, transcript, response)
+        socketio.emit('transcript', {
+            'call_id': call_id,
+            'text': response,
+            'assistant_id': session.assistant_id,
+            'final': True
+        }, to=call_room(call_id))
+    
+    release_audio_output(session, generation)
 
 @socketio.on('direct_test_audio')
 def handle_direct_test_audio():
@@ -665,7 +719,7 @@ def handle_direct_test_audio():
             'final': False
         }
         
-        socketio.emit('audio_chunk', audio_data)
+        socketio.emit('audio_chunk', audio_data, to=request.sid)
         
         # Send completion marker
         socketio.emit('audio_chunk', {
@@ -674,7 +728,7 @@ def handle_direct_test_audio():
             'chunks_sent': 1,
             'total_chunks': 1,
             'is_test_tone': True
-        })
+        }, to=request.sid)
         
         logging.warning(f"📢 [TEST AUDIO] Test tone sent")
         
@@ -691,7 +745,7 @@ def handle_debug_ping(data):
         socketio.emit('debug_pong', {
             'text': 'Debug pong from server!',
             'timestamp': time.time()
-        })
+        }, to=request.sid)
         
         # Also broadcast to all
         socketio.emit('debug_broadcast', {
@@ -712,7 +766,7 @@ def handle_simple_test(data):
             'text': 'Simple test response from server',
             'timestamp': time.time(),
             'received_data': data
-        })
+        }, to=request.sid)
         
     except Exception as e:
         logging.error(f"Error in simple_test handler: {str(e)}")
@@ -754,8 +808,7 @@ def handle_tts(call_id, text, thread_safe=False):
 def store_assistant_transcript(call_id, text):
     """Store assistant transcript with proper app context."""
     try:
-        from flask import current_app
-        app = current_app._get_current_object()
+        app = call_app(call_id)
         
         with app.app_context():
             try:
@@ -781,29 +834,27 @@ def store_assistant_transcript(call_id, text):
 def handle_request_audio(data):
     """Handle client request for any pending audio."""
     try:
-        client_sid = "1234"  # Fixed client SID
         call_id = data.get('call_id')
         
         if not call_id:
             logging.warning("❌ [AUDIO] Missing call_id in request_audio event")
             return
         
-        logging.warning(f"🔊 [AUDIO] Client {client_sid} explicitly requested audio for call {call_id}")
+        logging.warning(f"🔊 [AUDIO] Client {request.sid} explicitly requested audio for call {call_id}")
         
         # Check if call exists
-        if call_id not in active_calls:
+        session = active_calls.get(call_id)
+        if not session:
             logging.warning(f"❌ [AUDIO] Cannot deliver audio: call {call_id} not found")
             socketio.emit('test_audio_result', {
                 'success': False,
                 'message': 'Call not found'
-            })
+            }, to=request.sid)
             return
         
-        call_data = active_calls[call_id]
-        
         # Check for pending audio
-        if 'pending_audio' in call_data and call_data['pending_audio']:
-            pending_count = len(call_data['pending_audio'])
+        if session.pending_audio:
+            pending_count = len(session.pending_audio)
             logging.warning(f"🔊 [AUDIO] Found {pending_count} pending chunks for call {call_id}")
             
             # Use eventlet to spawn delivery with a slight delay to ensure connection is ready
@@ -813,63 +864,71 @@ def handle_request_audio(data):
                 'success': True,
                 'message': 'Delivering pending audio',
                 'chunks_pending': pending_count
-            })
+            }, to=request.sid)
         else:
             logging.warning(f"❌ [AUDIO] No pending audio found for call {call_id}")
             socketio.emit('test_audio_result', {
                 'success': False,
                 'message': 'No pending audio found'
-            })
+            }, to=request.sid)
             
     except Exception as e:
         logging.error(f"❌ [ERROR] Error in request_audio handler: {str(e)}")
         socketio.emit('test_audio_result', {
             'success': False,
             'message': f'Error: {str(e)}'
-        })
+        }, to=request.sid)
 
 # Add a handler for the stt_transcript event emitted by the SpeechToText class
 @socketio.on('stt_transcript')
 def handle_stt_transcript(data):
-    """Handle transcript events from the SpeechToText class and generate responses."""
+    """Handle transcript events carrying the call_id of the SpeechToText stream."""
+    dispatch_stt_transcript(str(data.get('call_id')), data.get('transcript'), data.get('final', False))
+
+def dispatch_stt_transcript(call_id, transcript, is_final):
+    """Route a transcript to its call with a direct lookup and generate the response."""
+    session = active_calls.get(call_id)
+    
+    if not session:
+        logging.warning(f"🎤 [STT] Received transcript for unknown call_id: {call_id}")
+        return
+    
+    with session.app.app_context():
+        process_stt_transcript(session, transcript, is_final)
+
+def process_stt_transcript(session, transcript, is_final):
+    """Forward the transcript to the call and answer final ones with the LLM."""
     try:
-        assistant_id = data.get('assistant_id')
-        transcript = data.get('transcript')
-        is_final = data.get('final', False)
+        call_id = session.call_id
         
-        logging.info(f"🎤 [STT] Received transcript from SpeechToText: '{transcript}', final: {is_final}")
+        logging.info(f"🎤 [STT] Received transcript for call {call_id}: '{transcript}', final: {is_final}")
         
-        # Find the corresponding call for this assistant_id
-        call_id = None
-        for cid, call_data in active_calls.items():
-            if call_data.get('assistant_llm') and call_data['assistant_llm'].assistant_id == assistant_id:
-                call_id = cid
-                break
+        # The caller is talking over the assistant, the interrupted output is released for this turn
+        if is_barge_in(transcript):
+            barge_in(session, 'interim transcript' if not is_final else 'final transcript')
         
-        if not call_id:
-            logging.warning(f"🎤 [STT] Received transcript for unknown assistant_id: {assistant_id}")
-            return
-            
         # Forward the transcript to the frontend
         socketio.emit('stt_transcript', {
             'call_id': call_id,
             'transcript': transcript,
             'final': is_final
-        })
+        }, to=call_room(call_id))
         
         # If this is a final transcript, process it with the LLM and generate a response
         if is_final and transcript:
             logging.info(f"🎤 [STT] Processing final transcript for call {call_id}: '{transcript}'")
             
-            call_data = active_calls[call_id]
-            assistant_llm = call_data['assistant_llm']
+            # Speak the response sentence by sentence while the LLM writes it
+            if session.start_speaking():
+                eventlet.spawn(generate_streamed_response, call_id, transcript, session.output_generation)
+                return
             
-            # Get response from LLM
+            # Something is already playing, prepare the whole response and queue it
             llm_start_time = time.time()
-            response = assistant_llm.get_response(transcript)
+            response = session.assistant_llm.get_response(transcript)
             llm_response_time = time.time() - llm_start_time
             
-            logging.info(f"🤖 [LLM] Response for call {call_id}: '{response}'")
+            logging.info(f"🤖 [LLM] Response for call {call_id} in {llm_response_time:.2f}s: '{response}'")
             
             # Store transcripts in database
             eventlet.spawn(store_transcripts, call_id, transcript, response)
@@ -878,20 +937,19 @@ def handle_stt_transcript(data):
             socketio.emit('transcript', {
                 'call_id': call_id,
                 'text': response,
-                'assistant_id': assistant_id,
+                'assistant_id': session.assistant_id,
                 'final': True
-            })
+            }, to=call_room(call_id))
             
             # Generate and stream audio response
-            if not call_data.get('is_speaking', False):
-                eventlet.spawn(generate_response_audio, call_id, response)
+            if session.start_speaking():
+                eventlet.spawn(generate_response_audio, call_id, response, session.output_generation)
             else:
                 logging.warning(f"🔊 [AUDIO] Already speaking for call {call_id}, queueing response")
-                if 'pending_responses' not in call_data:
-                    call_data['pending_responses'] = []
-                call_data['pending_responses'].append(response)
+                session.queue_response(response)
                 
     except Exception as e:
         logging.error(f"Error handling stt_transcript: {str(e)}")
         import traceback
         logging.error(traceback.format_exc())
+
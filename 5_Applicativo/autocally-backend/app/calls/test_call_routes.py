@@ -1,14 +1,12 @@
-from flask import jsonify, request
+from flask import jsonify, request, current_app
 from . import calls
 from ..security.routes import auth
 from .models import Call, CallType, ConversationTranscript, ConversationRole
 from ..phone_numbers.models import PhoneNumber
 from ..extensions import db
 from datetime import datetime
-from .socket_events import socketio, active_calls, handle_tts
-from libs.assistant.assistant_llm import AssistantLLM
-from libs.assistant.text_to_speech import TTS
-from libs.assistant.speech_to_text import SpeechToText
+from .socket_events import socketio, active_calls, handle_tts, call_room, dispatch_stt_transcript, dispatch_speech_started, end_call_session
+from .session import CallSession
 import logging
 import time
 from threading import Thread
@@ -58,16 +56,13 @@ def start_test_call():
         
         # Initialize call components in active_calls cache - IMPORTANT: client_sid starts as None
         call_id_str = str(new_call.id)
-        active_calls[call_id_str] = {
-            'assistant_llm': AssistantLLM(assistant.id),
-            'tts': TTS(assistant.id),
-            'stt': SpeechToText(assistant.id),
-            'is_speaking': False,
-            'client_sid': None,  # Initialize as None, will be updated when client connects
-            'pending_audio': [],  # Initialize empty pending audio list
-            'is_greeting_audio': True,  # Mark that next audio will be greeting
-            'call_started_time': datetime.utcnow().timestamp()  # Add timestamp for tracking
-        }
+        active_calls[call_id_str] = CallSession.create(
+            call_id_str,
+            assistant.id,
+            current_app._get_current_object(),
+            on_transcript=dispatch_stt_transcript,
+            on_speech_started=dispatch_speech_started
+        )
         logging.warning(f"📞 [TEST-CALL] Initialized components for call {new_call.id}")
 
         # Store greeting as assistant message
@@ -88,8 +83,7 @@ def start_test_call():
         def delayed_greeting_generation():
             # Check if client has connected yet
             if call_id_str in active_calls:
-                call_data = active_calls[call_id_str]
-                client_sid = call_data.get('client_sid')
+                client_sid = active_calls[call_id_str].client_sid
                 
                 if client_sid:
                     logging.warning(f"📞 [TEST-CALL] Client {client_sid} already connected, generating greeting")
@@ -137,12 +131,10 @@ def end_test_call():
         db.session.commit()
         
         # Clean up active calls cache
-        call_id_str = str(call_id)
-        if call_id_str in active_calls:
-            del active_calls[call_id_str]
+        end_call_session(call_id)
         
         # Emit call_ended event to socket
-        socketio.emit('call_ended', {'call_id': call_id})
+        socketio.emit('call_ended', {'call_id': call_id}, to=call_room(call_id))
         
         return jsonify({'status': 'success'})
         
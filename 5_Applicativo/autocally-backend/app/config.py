@@ -43,3 +43,13 @@ class Config:
     REDIS_DB = 0
     REDIS_DECODE_RESPONSES = True
 
+    # Calls without client activity for this many seconds are ended by the reaper
+    CALL_IDLE_TTL = int(os.environ.get('CALL_IDLE_TTL', 120))
+    CALL_REAPER_INTERVAL = int(os.environ.get('CALL_REAPER_INTERVAL', 15))
+
+    # Warm AssistantLLM/TTS instances kept ready for each assistant
+    CALL_COMPONENT_POOL_SIZE = int(os.environ.get('CALL_COMPONENT_POOL_SIZE', 2))
+
+    # When set, the frames of every Twilio media stream are recorded here as JSON lines
+    MEDIA_STREAM_RECORD_DIR = os.environ.get('MEDIA_STREAM_RECORD_DIR')
+
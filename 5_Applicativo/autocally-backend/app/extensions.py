@@ -3,11 +3,14 @@ from flask_migrate import Migrate
 from flask_cors import CORS
 from flask_marshmallow import Marshmallow
 from flask_socketio import SocketIO
+from flask_sock import Sock
 
 db = SQLAlchemy()
 migrate = Migrate()
 cors = CORS()
 ma = Marshmallow()
+# Raw websockets, used by the Twilio media streams
+sock = Sock()
 
 # Create a single SocketIO instance to be shared across the application
 socketio = SocketIO(
@@ -0,0 +1,32 @@
+import threading
+
+# Process-wide counters, read through the /api/calls/metrics route
+_counters = {}
+# Values computed when the metrics are read, name -> function
+_gauges = {}
+_lock = threading.Lock()
+
+
+def increment(name, value=1):
+    """Add value to the counter called name."""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def get(name, default=0):
+    """Current value of a counter."""
+    return _counters.get(name, default)
+
+
+def register_gauge(name, func):
+    """Report func() under name every time the metrics are read."""
+    _gauges[name] = func
+
+
+def snapshot():
+    """Copy of all the counters and current value of the gauges."""
+    with _lock:
+        values = dict(_counters)
+    for name, func in list(_gauges.items()):
+        values[name] = func()
+    return values
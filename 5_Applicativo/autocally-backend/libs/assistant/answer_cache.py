@@ -0,0 +1,125 @@
+from collections import OrderedDict
+import hashlib
+import logging
+import os
+
+import numpy as np
+
+from app import metrics
+
+# Cosine similarity above which a past question is considered the same question
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", 0.95))
+# Answers kept per assistant, the least recently used is dropped past it
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", 256))
+# Versions kept per assistant, pooled instances of the old and the new version answer side by side for a while
+ANSWER_CACHE_VERSIONS = 2
+
+
+def prompt_version(assistant):
+    """Hash of the settings that change the answers of an assistant."""
+    settings = f"{assistant.prompt}|{assistant.llm_model}|{assistant.llm_temperature}|{assistant.llm_max_tokens}|{assistant.rag_mode}"
+    return hashlib.sha1(settings.encode('utf-8')).hexdigest()
+
+
+def normalize(embedding):
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class AssistantAnswers:
+    """Answers of one assistant, with the normalized embeddings of their questions in one matrix."""
+
+    __slots__ = ('version', 'embeddings', 'answers', 'last_used', 'clock')
+
+    def __init__(self, version):
+        self.version = version
+        self.embeddings = None
+        self.answers = []
+        self.last_used = []
+        self.clock = 0
+
+    def __len__(self):
+        return len(self.answers)
+
+    def lookup(self, embedding, threshold):
+        if not self.answers:
+            return None
+        similarities = self.embeddings @ embedding
+        best = int(np.argmax(similarities))
+        if similarities[best] < threshold:
+            return None
+        self.clock += 1
+        self.last_used[best] = self.clock
+        return self.answers[best]
+
+    def store(self, embedding, answer, size):
+        self.clock += 1
+        if len(self.answers) >= size:
+            oldest = int(np.argmin(self.last_used))
+            self.embeddings[oldest] = embedding
+            self.answers[oldest] = answer
+            self.last_used[oldest] = self.clock
+            metrics.increment('answer_cache.evicted')
+            return
+        row = embedding.reshape(1, -1)
+        self.embeddings = row if self.embeddings is None else np.vstack([self.embeddings, row])
+        self.answers.append(answer)
+        self.last_used.append(self.clock)
+
+
+class AnswerCache:
+    """Answers to the first question of a conversation, reused for similar questions.
+
+    Assistants opt in with answer_cache. Answers are kept per assistant
+    under a version made of the prompt settings and of the generations of
+    the knowledge bases, so a new prompt or a reprocessed knowledge base
+    starts from an empty set of answers. The last versions_size versions of
+    an assistant are kept, instances still on the old version do not clear
+    the answers of the new one. Only first turns are cached, later ones
+    depend on the conversation.
+    """
+
+    def __init__(self, threshold=ANSWER_CACHE_THRESHOLD, size=ANSWER_CACHE_SIZE, versions_size=ANSWER_CACHE_VERSIONS):
+        self.threshold = threshold
+        self.size = size
+        self.versions_size = versions_size
+        # assistant_id -> version -> AssistantAnswers, the least recently used version first
+        self.assistants = {}
+
+        metrics.register_gauge('answer_cache', self.stats)
+
+    def lookup(self, assistant_id, version, embedding):
+        """Cached answer to a question similar to the one of embedding, or None."""
+        answers = self.answers(assistant_id, version)
+        answer = answers.lookup(normalize(embedding), self.threshold)
+        metrics.increment('answer_cache.hits' if answer is not None else 'answer_cache.misses')
+        return answer
+
+    def store(self, assistant_id, version, embedding, answer):
+        self.answers(assistant_id, version).store(normalize(embedding), answer, self.size)
+
+    def invalidate(self, assistant_id):
+        if self.assistants.pop(assistant_id, None) is not None:
+            metrics.increment('answer_cache.invalidations')
+            logging.info(f"🤖 [LLM] Invalidated cached answers of assistant {assistant_id}")
+
+    def answers(self, assistant_id, version):
+        versions = self.assistants.setdefault(assistant_id, OrderedDict())
+        answers = versions.get(version)
+        if answers is None:
+            answers = versions[version] = AssistantAnswers(version)
+            if len(versions) > self.versions_size:
+                versions.popitem(last=False)
+                metrics.increment('answer_cache.invalidations')
+        versions.move_to_end(version)
+        return answers
+
+    def stats(self):
+        return {
+            str(assistant_id): sum(len(answers) for answers in list(versions.values()))
+            for assistant_id, versions in list(self.assistants.items())
+        }
+
+
+answer_cache = AnswerCache()
@@ -1,13 +1,14 @@
-import os
 import re
 import logging
 from dotenv import load_dotenv
 import time
+import weakref
+import eventlet
+from eventlet.queue import Queue
 from app.extensions import db
 from app.assistants.models import Assistant
 from app.base_knowledge.models import BaseKnowledge, assistant_base_knowledge
 
-from langchain_core.prompts import ChatPromptTemplate
 from langchain_groq import ChatGroq
 from langchain.memory import ConversationBufferMemory
 from langchain.prompts import (
@@ -18,51 +19,104 @@ from langchain.prompts import (
 )
 from langchain.agents import AgentExecutor, create_tool_calling_agent
 from langchain.tools import Tool
-from langchain.chains import RetrievalQA
-from langchain_chroma import Chroma
-from langchain_openai import OpenAIEmbeddings
 from langchain_openai import ChatOpenAI
 from langchain.tools.retriever import create_retriever_tool
+from langchain_core.callbacks import BaseCallbackHandler
+from libs.assistant.vector_store_registry import vector_store_registry
+from libs.assistant.federated_retriever import FederatedRetriever
+from libs.assistant.answer_cache import answer_cache, prompt_version
 
 load_dotenv()
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+FALLBACK_RESPONSE = "I apologize, but I encountered an error while processing your request."
+
+# Name of the single tool searching all the knowledge bases in agent mode
+KNOWLEDGE_TOOL_NAME = "knowledge_base"
+
+TOOL_GUIDELINES = """### Tool Usage Guidelines
+- Only use a tool if it directly contributes to answering the user's query.
+- Limit to one tool call per query. Do not call additional tools afterward.
+- Never reveal the tool’s name or internal details in your response.
+- After using a tool, incorporate the findings into your response without mentioning the tool.
+- Do not invent information; rely on tool outputs or your general knowledge."""
+
+DIRECT_GUIDELINES = """### Knowledge Guidelines
+- Use the knowledge excerpts only if they directly contribute to answering the user's query.
+- Never mention the excerpts, documents or where the information comes from.
+- Do not invent information; rely on the excerpts or your general knowledge."""
+
+
+class TokenQueueHandler(BaseCallbackHandler):
+    """Push the tokens of the answer generated by the LLM into a queue.
+
+    Generations calling a tool are intermediate steps of the agent, their
+    tokens are dropped from the first tool call chunk on. Groq sends the
+    tool calls of a generation without any text before them.
+    """
+
+    def __init__(self, queue):
+        self.queue = queue
+        # Runs of the LLM that called a tool
+        self.tool_runs = set()
+
+    def on_llm_new_token(self, token, *, chunk=None, run_id=None, **kwargs):
+        message = getattr(chunk, 'message', None)
+        if message is not None and (getattr(message, 'tool_call_chunks', None) or 'function_call' in message.additional_kwargs):
+            self.tool_runs.add(run_id)
+        if token and run_id not in self.tool_runs:
+            self.queue.put(('token', token))
+
+
+def release_vector_stores(keys):
+    for key in keys:
+        vector_store_registry.release(key)
+
 
 class AssistantLLM:
-    def __init__(self, assistant_id):
+    def __init__(self, assistant_id, rag_mode=None):
         self.assistant_id = assistant_id
         self.assistant = Assistant.query.get(self.assistant_id)
         
         self.llm = ChatGroq(
             model=self.assistant.llm_model,
             temperature=self.assistant.llm_temperature,
-            max_tokens=self.assistant.llm_max_tokens
+            max_tokens=self.assistant.llm_max_tokens,
+            # Reports the tokens to the callbacks while they arrive, see stream_response
+            streaming=True
         )
 
         self.memory = ConversationBufferMemory(memory_key="chat_history", return_messages=True)
-        self.embedding_function = OpenAIEmbeddings()
         self.tools = []
+        # rag_mode overrides the setting of the assistant, used to compare the modes
+        self.rag_mode = rag_mode or self.assistant.rag_mode or 'agent'
+        # (knowledge base name, store) of the linked knowledge bases, searched together
+        self.vector_stores = []
+        self.retriever = None
+        # Keys of the shared vector stores in use, released when the instance is collected
+        self.vector_store_keys = []
+        weakref.finalize(self, release_vector_stores, self.vector_store_keys)
 
         self.get_knowledge_base()
         self.prompt = self.get_prompt()
+        # Opt-in reuse of the answers to similar first questions, for this prompt and these indexes
+        self.answer_cache_enabled = bool(self.assistant.answer_cache)
+        self.answer_cache_version = (prompt_version(self.assistant), tuple(self.vector_store_keys))
         
-
-        self.agent = create_tool_calling_agent(self.llm, self.tools, self.prompt)
-        self.agent_executor = AgentExecutor(
-            agent=self.agent,
-            tools=self.tools,
-            memory=self.memory,
-            verbose=True,
-            max_iterations=2  # Limit to 2 iterations per query to avoid repeated tool calls.
-        )
-
-    def create_tool_func(self, info_chain):
-        """Helper to create a function that calls the corresponding info_chain."""
-        def tool_func(query):
-            return info_chain({"query": query})
-        return tool_func
+        if self.rag_mode == 'direct':
+            # One LLM call per turn, the knowledge is in the prompt
+            self.chain = self.prompt | self.llm
+        else:
+            self.agent = create_tool_calling_agent(self.llm, self.tools, self.prompt)
+            self.agent_executor = AgentExecutor(
+                agent=self.agent,
+                tools=self.tools,
+                memory=self.memory,
+                verbose=True,
+                max_iterations=2  # Limit to 2 iterations per query to avoid repeated tool calls.
+            )
 
     def get_knowledge_base(self):
         try:
@@ -73,25 +127,24 @@ class AssistantLLM:
                 .all()
             )
          
+            descriptions = []
             for knowledge in base_knowledge:
                 name = knowledge.name
-                path = os.path.join(knowledge.folder_path, 'chroma_db')
                 description = knowledge.description
 
-                db_chroma = Chroma(persist_directory=path, embedding_function=self.embedding_function)
-                info_chain = RetrievalQA.from_chain_type(
-                    llm=self.llm, 
-                    chain_type="stuff", 
-                    retriever=db_chroma.as_retriever(), 
-                    return_source_documents=True,
-                    verbose=True
-                )
-                tool = Tool(
-                    name=name,
-                    description=f"Use this tool to get information about: {description}",
-                    func=self.create_tool_func(info_chain)
-                )
-                self.tools.append(tool)
+                key, db_chroma = vector_store_registry.acquire(knowledge)
+                self.vector_store_keys.append(key)
+                self.vector_stores.append((name, db_chroma))
+                descriptions.append(f"{name}: {description}" if description else name)
+
+            self.retriever = FederatedRetriever(self.vector_stores, vector_store_registry.get_embedding_function())
+            if self.vector_stores and self.rag_mode != 'direct':
+                # One tool searching every knowledge base, the agent never has to pick one
+                self.tools.append(Tool(
+                    name=KNOWLEDGE_TOOL_NAME,
+                    description=f"Use this tool to get information about: {'; '.join(descriptions)}",
+                    func=self.retriever.retrieve
+                ))
 
         except Exception as e:
             logger.error(f"Error getting knowledge base: {str(e)}")
@@ -108,6 +161,14 @@ class AssistantLLM:
                 for tool in self.tools
             ])
             
+            if self.rag_mode == 'direct':
+                guidelines = DIRECT_GUIDELINES
+                # {context} is filled with the retrieved chunks on every turn
+                resources = "## Knowledge\nExcerpts of the knowledge bases related to the last message:\n{context}"
+            else:
+                guidelines = TOOL_GUIDELINES
+                resources = f"## Tools\nYou have access to the following tools:  \n{tools_str}"
+            
             system_prompt = f"""
             
 
@@ -116,12 +177,7 @@ You are a helpful conversational AI assistant. Your goal is to assist users by p
 ## Rules
 - **Strict Rule Compliance:** Follow these rules precisely. Any violation is not tolerated.
 
-### Tool Usage Guidelines
-- Only use a tool if it directly contributes to answering the user's query.
-- Limit to one tool call per query. Do not call additional tools afterward.
-- Never reveal the tool’s name or internal details in your response.
-- After using a tool, incorporate the findings into your response without mentioning the tool.
-- Do not invent information; rely on tool outputs or your general knowledge.
+{guidelines}
 
 ### Conversation Style
 - Write numbers, dates and times in words.
@@ -136,15 +192,20 @@ You are a helpful conversational AI assistant. Your goal is to assist users by p
 - Base replies on provided information or general knowledge only.
 - Be open to refining your responses based on user feedback to improve accuracy and relevance.
 
-## Tools
-You have access to the following tools:  
-{tools_str}
+{resources}
 
 ## Conversation Prompt
 {self.assistant.prompt}
 
 """
 
+            if self.rag_mode == 'direct':
+                return ChatPromptTemplate.from_messages([
+                    ("system", system_prompt),
+                    MessagesPlaceholder(variable_name="chat_history"),
+                    ("human", "{input}")
+                ])
+
             return ChatPromptTemplate.from_messages([
                 ("system", system_prompt),
                 MessagesPlaceholder(variable_name="chat_history"),
@@ -163,19 +224,54 @@ You have access to the following tools:
         cleaned_text = re.sub(r'<function=.*?</function>', '', text)
         return cleaned_text
 
+    def clear_memory(self):
+        """Forget the conversation held so far."""
+        self.memory.clear()
+
+    def retrieve(self, text):
+        """Best chunks of all the knowledge bases for text, merged by the federated retriever."""
+        if not self.vector_stores:
+            return "No knowledge base available."
+        return self.retriever.retrieve(text)
+
+    def invoke(self, text, config=None):
+        """Answer text with the RAG mode of the assistant, the memory holds the turn afterwards."""
+        embedding = None
+        if self.answer_cache_enabled and not self.memory.chat_memory.messages:
+            embedding = vector_store_registry.get_embedding_function().embed_query(text)
+            answer = answer_cache.lookup(self.assistant_id, self.answer_cache_version, embedding)
+            if answer is not None:
+                logger.info(f"Answered from the answer cache: {answer}")
+                self.memory.chat_memory.add_user_message(text)
+                self.memory.chat_memory.add_ai_message(answer)
+                return answer
+        
+        if self.rag_mode == 'direct':
+            history = list(self.memory.chat_memory.messages)
+            context = self.retrieve(text)
+            self.memory.chat_memory.add_user_message(text)
+            response = self.chain.invoke(
+                {"input": text, "chat_history": history, "context": context},
+                config=config
+            )
+            answer = response.content
+        else:
+            self.memory.chat_memory.add_user_message(text)
+            response = self.agent_executor.invoke(
+                {"input": text, "chat_history": self.memory.chat_memory.messages},
+                config=config
+            )
+            answer = response["output"]
+        
+        self.memory.chat_memory.add_ai_message(answer)
+        if embedding is not None and answer:
+            answer_cache.store(self.assistant_id, self.answer_cache_version, embedding, answer)
+        return answer
+
     def get_response(self, text):
         try:
             logger.info(f"Assistant is responding...")
-            self.memory.chat_memory.add_user_message(text)
-            logger.info(f"Added message to memory: {text}")
-            
-            response = self.agent_executor.invoke({
-                "input": text,
-                "chat_history": self.memory.chat_memory.messages
-            })
-            
-            answer = response["output"]
-            self.memory.chat_memory.add_ai_message(answer)
+            answer = self.invoke(text)
             logger.info(f"Added message to memory: {text}")
             
             logger.info(f"Memory: {self.memory.load_memory_variables({})}")
@@ -184,8 +280,81 @@ You have access to the following tools:
 
         except Exception as e:
             logger.error(f"Error getting response: {str(e)}")
-            return "I apologize, but I encountered an error while processing your request."
+            return FALLBACK_RESPONSE
+
+    def stream_response(self, text):
+        """Yield the answer token by token while the agent generates it.
+
+        The agent runs in its own greenlet and the memory is updated the same
+        way as in get_response.
+        """
+        queue = Queue()
+        
+        def run_agent():
+            try:
+                answer = self.invoke(text, config={"callbacks": [TokenQueueHandler(queue)]})
+                queue.put(('done', answer))
+            except Exception as e:
+                logger.error(f"Error streaming response: {str(e)}")
+                queue.put(('error', e))
+        
+        eventlet.spawn(run_agent)
+        
+        streamed = False
+        while True:
+            kind, value = queue.get()
+            if kind == 'token':
+                streamed = True
+                yield value
+            elif kind == 'done':
+                # Models without token streaming only report the full answer
+                if not streamed:
+                    yield value
+                return
+            else:
+                if not streamed:
+                    yield FALLBACK_RESPONSE
+                return
 
 
 if __name__ == "__main__":
-    pass
+    # Latency of the two RAG modes on a replayable question set:
+    # python -m libs.assistant.assistant_llm <assistant_id> app/assistants/example/rag_questions.txt
+    import sys
+    from app import create_app
+    from app.assistants.models import RAG_MODES
+
+    assistant_id, questions_path = int(sys.argv[1]), sys.argv[2]
+    with open(questions_path, encoding='utf-8') as f:
+        questions = [line.strip() for line in f if line.strip()]
+
+    app = create_app()
+    with app.app_context():
+        for mode in RAG_MODES:
+            assistant_llm = AssistantLLM(assistant_id, rag_mode=mode)
+            # Cached answers would hide the LLM calls being compared
+            assistant_llm.answer_cache_enabled = False
+            # Time spent in the federated search, apart from the LLM round trips
+            searches = []
+            search = assistant_llm.retriever.search
+
+            def timed_search(query, search=search, searches=searches):
+                start = time.perf_counter()
+                try:
+                    return search(query)
+                finally:
+                    searches.append(time.perf_counter() - start)
+
+            assistant_llm.retriever.search = timed_search
+            timings = []
+            for question in questions:
+                # Every question is a first turn, so both modes see the same prompt
+                assistant_llm.clear_memory()
+                start = time.perf_counter()
+                assistant_llm.get_response(question)
+                timings.append(time.perf_counter() - start)
+            timings.sort()
+            print(f"{mode}: {len(timings)} questions, mean {sum(timings) / len(timings):.2f}s, "
+                  f"p50 {timings[len(timings) // 2]:.2f}s, p95 {timings[min(len(timings) - 1, int(len(timings) * 0.95))]:.2f}s, "
+                  f"retrieval mean {sum(searches) / max(len(searches), 1):.3f}s over {len(searches)} searches "
+                  f"of {len(assistant_llm.vector_stores)} knowledge bases")
@@ -0,0 +1,176 @@
+from collections import OrderedDict
+from pathlib import Path
+import hashlib
+import json
+import logging
+import os
+import re
+import struct
+
+from app import metrics
+from app.config import BASE_DIR
+from libs.assistant.audio_codec import SAMPLE_WIDTHS, TTS_AUDIO_FORMAT
+
+# Each chunk is stored on disk as a 4 byte little endian length followed by its bytes
+CHUNK_HEADER = struct.Struct('<I')
+
+
+def normalize_text(text):
+    """Collapse whitespace so texts that sound the same share an entry."""
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def audio_cache_key(text, voice_id, model_id, output_format):
+    """Content address of a synthesized text."""
+    payload = json.dumps([normalize_text(text), voice_id, model_id, output_format], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class AudioCache:
+    """LRU cache of synthesized audio kept as the list of chunks returned by the TTS.
+
+    Entries live in memory up to max_bytes, entries larger than max_entry_bytes
+    are not kept. When a directory is given they are also written to disk,
+    bounded by max_disk_bytes, so they survive restarts. Hits, misses and the
+    bytes served from the cache are counted in app.metrics under name.
+    """
+
+    def __init__(self, name, max_bytes, directory=None, max_disk_bytes=None, max_entry_bytes=None):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes or max_bytes
+        self.directory = Path(directory) if directory else None
+        self.max_disk_bytes = max_disk_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        
+        if self.directory:
+            self.directory.mkdir(parents=True, exist_ok=True)
+        
+        metrics.register_gauge(f'{name}.hit_rate', self.hit_rate)
+        metrics.register_gauge(f'{name}.bytes', lambda: self.size)
+
+    def hit_rate(self):
+        hits = metrics.get(f'{self.name}.hits')
+        lookups = hits + metrics.get(f'{self.name}.misses')
+        return hits / lookups if lookups else 0.0
+
+    def get(self, key):
+        """Chunks stored for key, None on a miss."""
+        chunks = self.entries.get(key)
+        if chunks is not None:
+            self.entries.move_to_end(key)
+        else:
+            chunks = self._read(key)
+            if chunks is not None:
+                self._remember(key, chunks)
+        
+        if chunks is None:
+            metrics.increment(f'{self.name}.misses')
+        else:
+            metrics.increment(f'{self.name}.hits')
+            metrics.increment(f'{self.name}.bytes_saved', sum(len(chunk) for chunk in chunks))
+        return chunks
+
+    def put(self, key, chunks):
+        chunks = [bytes(chunk) for chunk in chunks]
+        if not chunks or sum(len(chunk) for chunk in chunks) > self.max_entry_bytes:
+            return
+        self._remember(key, chunks)
+        self._write(key, chunks)
+
+    def discard(self, key):
+        chunks = self.entries.pop(key, None)
+        if chunks is not None:
+            self.size -= sum(len(chunk) for chunk in chunks)
+        path = self._path(key)
+        if path and path.exists():
+            path.unlink()
+
+    def _remember(self, key, chunks):
+        entry_size = sum(len(chunk) for chunk in chunks)
+        if entry_size > self.max_entry_bytes:
+            return
+        
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.size -= sum(len(chunk) for chunk in old)
+        self.entries[key] = chunks
+        self.size += entry_size
+        
+        while self.size > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= sum(len(chunk) for chunk in evicted)
+
+    def _path(self, key):
+        if not self.directory:
+            return None
+        return self.directory / f'{key}.chunks'
+
+    def _read(self, key):
+        path = self._path(key)
+        if not path or not path.exists():
+            return None
+        
+        try:
+            data = path.read_bytes()
+            chunks = []
+            offset = 0
+            while offset < len(data):
+                (length,) = CHUNK_HEADER.unpack_from(data, offset)
+                offset += CHUNK_HEADER.size
+                chunks.append(data[offset:offset + length])
+                offset += length
+            # Mark as recently used for the disk eviction
+            os.utime(path)
+            return chunks
+        except Exception as e:
+            logging.error(f"Error reading cached audio {path}: {str(e)}")
+            return None
+
+    def _write(self, key, chunks):
+        path = self._path(key)
+        if not path:
+            return
+        
+        try:
+            tmp_path = path.with_suffix('.tmp')
+            with open(tmp_path, 'wb') as f:
+                for chunk in chunks:
+                    f.write(CHUNK_HEADER.pack(len(chunk)))
+                    f.write(chunk)
+            os.replace(tmp_path, path)
+            self._evict_disk()
+        except Exception as e:
+            logging.error(f"Error writing cached audio {path}: {str(e)}")
+
+    def _evict_disk(self):
+        if not self.max_disk_bytes:
+            return
+        
+        files = sorted(self.directory.glob('*.chunks'), key=lambda p: p.stat().st_mtime)
+        total = sum(p.stat().st_size for p in files)
+        for path in files:
+            if total <= self.max_disk_bytes:
+                break
+            total -= path.stat().st_size
+            path.unlink()
+
+
+# Greetings are synthesized once per (text, voice, model, format) and kept across restarts
+greeting_cache = AudioCache(
+    'greeting_audio_cache',
+    max_bytes=int(os.environ.get('GREETING_AUDIO_CACHE_BYTES', 32 * 1024 * 1024)),
+    directory=os.environ.get('GREETING_AUDIO_CACHE_DIR', BASE_DIR / 'files' / 'greeting_audio'),
+    max_disk_bytes=int(os.environ.get('GREETING_AUDIO_CACHE_DISK_BYTES', 256 * 1024 * 1024)),
+)
+
+# Longest phrase kept, whole answers are seldom repeated and would only evict the short ones
+TTS_PHRASE_CACHE_ENTRY_SECONDS = float(os.environ.get('TTS_PHRASE_CACHE_ENTRY_SECONDS', 3.0))
+
+# Short phrases repeated by the assistants (fallbacks, confirmations), memory only
+phrase_cache = AudioCache(
+    'tts_phrase_cache',
+    max_bytes=int(os.environ.get('TTS_PHRASE_CACHE_BYTES', 64 * 1024 * 1024)),
+    max_entry_bytes=int(TTS_PHRASE_CACHE_ENTRY_SECONDS * TTS_AUDIO_FORMAT.sample_rate * SAMPLE_WIDTHS[TTS_AUDIO_FORMAT.encoding]),
+)
@@ -0,0 +1,302 @@
+from collections import namedtuple
+import logging
+import struct
+
+import numpy as np
+
+# Encodings a call can ask for, with the bytes taken by one sample
+SAMPLE_WIDTHS = {
+    'pcm_f32le': 4,
+    'pcm_s16le': 2,
+    'mulaw': 1,
+}
+SAMPLE_RATES = (8000, 16000, 22050, 24000, 44100, 48000)
+FRAME_DURATIONS_MS = (20, 40, 60, 100, 200)
+
+# frame_ms None keeps the chunks as the TTS returns them
+AudioFormat = namedtuple('AudioFormat', ['encoding', 'sample_rate', 'frame_ms'])
+
+# Format Cartesia synthesizes, calls that do not negotiate receive it untouched
+TTS_AUDIO_FORMAT = AudioFormat('pcm_f32le', 22050, None)
+# Twilio Media Streams only take 8 kHz mu-law in 20 ms frames
+TELEPHONY_AUDIO_FORMAT = AudioFormat('mulaw', 8000, 20)
+
+# G.711 mu-law constants
+MULAW_BIAS = 0x84
+MULAW_CLIP = 32635
+
+# Taps of the anti-aliasing filter used when downsampling
+LOWPASS_TAPS = 31
+
+# Binary audio frame: call slot, flags, version and sequence number, little endian, followed by the audio
+AUDIO_FRAME_HEADER = struct.Struct('<HBBI')
+AUDIO_FRAME_VERSION = 1
+FRAME_FINAL = 0x01
+FRAME_GREETING = 0x02
+FRAME_FIRST = 0x04
+
+
+def _build_mulaw_tables():
+    """Encode table for every int16 value and decode table for every mu-law byte."""
+    samples = np.arange(-32768, 32768, dtype=np.int32)
+    sign = (samples < 0).astype(np.int32) << 7
+    magnitude = np.minimum(np.abs(samples), MULAW_CLIP) + MULAW_BIAS
+    exponent = np.floor(np.log2(magnitude)).astype(np.int32) - 7
+    mantissa = (magnitude >> (exponent + 3)) & 0x0F
+    encoded = (~(sign | (exponent << 4) | mantissa) & 0xFF).astype(np.uint8)
+    # Indexed by the int16 sample viewed as uint16
+    encode = np.empty(65536, dtype=np.uint8)
+    encode[samples.astype(np.uint16)] = encoded
+
+    codes = ~np.arange(256, dtype=np.int32) & 0xFF
+    exponent = (codes >> 4) & 0x07
+    mantissa = codes & 0x0F
+    magnitude = (((mantissa << 3) + MULAW_BIAS) << exponent) - MULAW_BIAS
+    decode = np.where(codes & 0x80, -magnitude, magnitude).astype(np.int16)
+    return encode, decode
+
+
+MULAW_ENCODE_TABLE, MULAW_DECODE_TABLE = _build_mulaw_tables()
+
+
+def parse_audio_format(data, default=TTS_AUDIO_FORMAT):
+    """AudioFormat asked for by a client, default when missing or not supported."""
+    if not data:
+        return default
+    try:
+        encoding = data.get('encoding', default.encoding)
+        sample_rate = int(data.get('sample_rate', default.sample_rate))
+        frame_ms = data.get('frame_ms', default.frame_ms)
+        frame_ms = int(frame_ms) if frame_ms is not None else None
+    except (AttributeError, TypeError, ValueError):
+        logging.warning(f"🔊 [AUDIO] Invalid audio format {data!r}, using {default}")
+        return default
+    if encoding not in SAMPLE_WIDTHS or sample_rate not in SAMPLE_RATES or (frame_ms is not None and frame_ms not in FRAME_DURATIONS_MS):
+        logging.warning(f"🔊 [AUDIO] Unsupported audio format {data!r}, using {default}")
+        return default
+    return AudioFormat(encoding, sample_rate, frame_ms)
+
+
+def audio_format_dict(audio_format):
+    """AudioFormat as sent to the clients."""
+    return audio_format._asdict()
+
+
+def audio_duration(data, audio_format):
+    """Seconds of audio in data."""
+    return len(data) / SAMPLE_WIDTHS[audio_format.encoding] / audio_format.sample_rate
+
+
+def float_to_int16(samples):
+    """Convert float samples in [-1, 1] to int16, clipping what is out of range."""
+    return (np.clip(samples, -1.0, 1.0) * 32767.0).astype(np.int16)
+
+
+def int16_to_mulaw(samples):
+    """Encode int16 samples to mu-law bytes."""
+    return MULAW_ENCODE_TABLE[samples.view(np.uint16)]
+
+
+def mulaw_to_int16(data):
+    """Decode mu-law bytes to int16 samples."""
+    return MULAW_DECODE_TABLE[np.frombuffer(data, dtype=np.uint8)]
+
+
+def pack_audio_frame(slot, sequence, flags, data=b''):
+    """Binary audio frame with its fixed header."""
+    return AUDIO_FRAME_HEADER.pack(slot, flags, AUDIO_FRAME_VERSION, sequence & 0xFFFFFFFF) + data
+
+
+def unpack_audio_frame(frame):
+    """Split a binary audio frame in (slot, sequence, flags, audio), the audio is a memoryview of frame."""
+    if len(frame) < AUDIO_FRAME_HEADER.size:
+        raise ValueError(f"Audio frame of {len(frame)} bytes is shorter than its header")
+    slot, flags, version, sequence = AUDIO_FRAME_HEADER.unpack_from(frame)
+    if version != AUDIO_FRAME_VERSION:
+        raise ValueError(f"Unsupported audio frame version {version}")
+    return slot, sequence, flags, memoryview(frame)[AUDIO_FRAME_HEADER.size:]
+
+
+def lowpass_filter(cutoff, taps=LOWPASS_TAPS):
+    """Windowed sinc low-pass filter, cutoff as a fraction of the sample rate."""
+    n = np.arange(taps) - (taps - 1) / 2
+    h = 2 * cutoff * np.sinc(2 * cutoff * n) * np.hamming(taps)
+    return (h / h.sum()).astype(np.float32)
+
+
+class Resampler:
+    """Streaming linear interpolation resampler.
+
+    The fractional read position and the tail of the previous chunk are
+    carried over, so chunks resampled one at a time join without clicks.
+    Downsampling goes through a low-pass filter first to limit aliasing.
+    """
+
+    def __init__(self, src_rate, dst_rate):
+        self.step = src_rate / dst_rate
+        self.position = 0.0
+        self.history = np.zeros(0, dtype=np.float32)
+        self.filter = None
+        if dst_rate < src_rate:
+            # Keep a margin under the new Nyquist frequency
+            self.filter = lowpass_filter(0.45 * dst_rate / src_rate)
+            self.filter_state = np.zeros(len(self.filter) - 1, dtype=np.float32)
+
+    def process(self, samples):
+        """Resample the next float32 chunk."""
+        if self.filter is not None:
+            padded = np.concatenate((self.filter_state, samples))
+            self.filter_state = padded[len(padded) - len(self.filter_state):]
+            samples = np.convolve(padded, self.filter, mode='valid').astype(np.float32)
+        buffer = np.concatenate((self.history, samples)) if len(self.history) else samples
+        # Output samples whose two neighbours are both in the buffer
+        available = len(buffer) - 1 - self.position
+        count = int(np.ceil(available / self.step)) if available > 0 else 0
+        if count <= 0:
+            self.history = buffer
+            return np.zeros(0, dtype=np.float32)
+        positions = self.position + self.step * np.arange(count)
+        index = positions.astype(np.int64)
+        fraction = (positions - index).astype(np.float32)
+        output = buffer[index] + (buffer[index + 1] - buffer[index]) * fraction
+        next_position = self.position + self.step * count
+        # The next position can be past the end of the buffer when downsampling
+        consumed = min(int(next_position), len(buffer))
+        self.history = buffer[consumed:]
+        self.position = next_position - consumed
+        return output
+
+
+class AudioTranscoder:
+    """Convert the pcm_f32le TTS audio of a call to the format its client negotiated.
+
+    Resamples, encodes to int16 or mu-law and re-chunks to frames of
+    frame_ms. process and flush return the list of frames ready to send.
+    """
+
+    def __init__(self, audio_format, source_format=TTS_AUDIO_FORMAT):
+        self.audio_format = audio_format
+        self.source_format = source_format
+        self.passthrough = audio_format == source_format
+        self.resampler = None
+        if audio_format.sample_rate != source_format.sample_rate:
+            self.resampler = Resampler(source_format.sample_rate, audio_format.sample_rate)
+        self.frame_bytes = None
+        if audio_format.frame_ms:
+            self.frame_bytes = audio_format.sample_rate * audio_format.frame_ms // 1000 * SAMPLE_WIDTHS[audio_format.encoding]
+        self.remainder = b''
+        self.odd_bytes = b''
+
+    def process(self, chunk):
+        """Transcode a TTS chunk, returns the complete frames it produced."""
+        if self.passthrough:
+            return [chunk] if chunk else []
+        data = self.odd_bytes + chunk
+        # A chunk can end in the middle of a float sample
+        usable = len(data) - len(data) % 4
+        self.odd_bytes = data[usable:]
+        samples = np.frombuffer(data[:usable], dtype=np.float32)
+        return self._frames(self._encode(samples))
+
+    def flush(self):
+        """Return the audio still buffered, padded with silence to a whole frame."""
+        if self.passthrough or not self.remainder:
+            self.remainder = b''
+            return []
+        frame = self.remainder
+        self.remainder = b''
+        if self.frame_bytes and len(frame) < self.frame_bytes:
+            frame += self._silence(self.frame_bytes - len(frame))
+        return [frame]
+
+    def duration(self, frame):
+        """Seconds of audio in a frame returned by the transcoder."""
+        return audio_duration(frame, self.audio_format)
+
+    def _encode(self, samples):
+        if self.resampler:
+            samples = self.resampler.process(samples)
+        encoding = self.audio_format.encoding
+        if encoding == 'pcm_f32le':
+            return samples.astype('<f4').tobytes()
+        samples = float_to_int16(samples)
+        if encoding == 'mulaw':
+            return int16_to_mulaw(samples).tobytes()
+        return samples.astype('<i2').tobytes()
+
+    def _silence(self, size):
+        # 0xFF is the mu-law code for zero
+        return (b'\xff' if self.audio_format.encoding == 'mulaw' else b'\x00') * size
+
+    def _frames(self, data):
+        if not self.frame_bytes:
+            return [data] if data else []
+        data = self.remainder + data
+        end = len(data) - len(data) % self.frame_bytes
+        self.remainder = data[end:]
+        return [data[start:start + self.frame_bytes] for start in range(0, end, self.frame_bytes)]
+
+
+def benchmark_framing(frame_bytes=3200, count=20000):
+    """Time the Socket.IO encoding of an audio_chunk dict against a binary frame, and decoding of an inbound frame."""
+    import time
+    from socketio.packet import EVENT, Packet
+
+    frame = bytes(frame_bytes)
+    results = {}
+
+    start = time.perf_counter()
+    for sequence in range(count):
+        payload = {
+            'call_id': '42',
+            'audio': {'data': frame, 'format': 'raw', 'encoding': 'pcm_s16le', 'sample_rate': 16000},
+            'is_greeting': False,
+            'final': False
+        }
+        encoded = Packet(EVENT, data=['audio_chunk', payload]).encode()
+    results['dict encode us'] = (time.perf_counter() - start) / count * 1e6
+    results['dict overhead bytes'] = len(encoded[0]) + sum(len(part) for part in encoded[1:]) - frame_bytes
+
+    start = time.perf_counter()
+    for sequence in range(count):
+        encoded = Packet(EVENT, data=['audio_chunk', pack_audio_frame(1, sequence, 0, frame)]).encode()
+    results['binary encode us'] = (time.perf_counter() - start) / count * 1e6
+    results['binary overhead bytes'] = len(encoded[0]) + sum(len(part) for part in encoded[1:]) - frame_bytes
+
+    # Inbound: the dict path hands a list of ints converted to int16 bytes, the binary one a view of the frame
+    samples = list(range(frame_bytes // 2))
+    start = time.perf_counter()
+    for _ in range(count // 10):
+        np.array(samples, dtype=np.int16).tobytes()
+    results['dict decode us'] = (time.perf_counter() - start) / (count // 10) * 1e6
+
+    packed = pack_audio_frame(1, 0, 0, frame)
+    start = time.perf_counter()
+    for _ in range(count):
+        unpack_audio_frame(packed)
+    results['binary decode us'] = (time.perf_counter() - start) / count * 1e6
+    return results
+
+
+if __name__ == '__main__':
+    # Rough throughput check: python -m libs.assistant.audio_codec
+    import time
+
+    seconds = 60
+    rate = TTS_AUDIO_FORMAT.sample_rate
+    t = np.arange(seconds * rate) / rate
+    tone = (0.5 * np.sin(2 * np.pi * 440 * t)).astype(np.float32).tobytes()
+    # Cartesia sends chunks of about 0.1 seconds
+    chunk_size = 8820
+    chunks = [tone[i:i + chunk_size] for i in range(0, len(tone), chunk_size)]
+    for audio_format in (AudioFormat('pcm_s16le', 16000, 100), TELEPHONY_AUDIO_FORMAT):
+        transcoder = AudioTranscoder(audio_format)
+        start = time.perf_counter()
+        frames = [frame for chunk in chunks for frame in transcoder.process(chunk)] + transcoder.flush()
+        elapsed = time.perf_counter() - start
+        size = sum(len(frame) for frame in frames)
+        print(f"{audio_format}: {len(frames)} frames, {size / seconds / 1000:.1f} KB/s "
+              f"(source {len(tone) / seconds / 1000:.1f} KB/s), {elapsed * 1000 / seconds:.2f} ms per second of audio")
+
+    for name, value in benchmark_framing().items():
+        print(f"{name}: {value:.2f}")
@@ -0,0 +1,194 @@
+import base64
+import json
+import logging
+import os
+import time
+import uuid
+
+import eventlet
+from eventlet.queue import Queue, Empty
+from eventlet.semaphore import Semaphore
+from websockets.sync.client import connect
+
+from app import metrics
+
+CARTESIA_WS_URL = "wss://api.cartesia.ai/tts/websocket"
+CARTESIA_VERSION = "2024-06-10"
+
+# Seconds to wait for the next message of an utterance before giving up
+RESPONSE_TIMEOUT = 15
+# Seconds between two pings of the websocket, and how long to wait for the pong
+HEALTH_CHECK_INTERVAL = 20
+HEALTH_CHECK_TIMEOUT = 5
+
+
+class CartesiaContext:
+    """One utterance on the shared websocket, identified by its context_id."""
+
+    def __init__(self, connection, context_id, request):
+        self.connection = connection
+        self.context_id = context_id
+        self.request = request
+        self.queue = Queue()
+        # Websocket the context was sent on, None until the first send
+        self.websocket = None
+        self.done = False
+
+    @property
+    def sent(self):
+        return self.websocket is not None
+
+    def send(self, transcript, more=False):
+        """Send text for this context, more=True keeps the context open for more text."""
+        body = dict(self.request, transcript=transcript, context_id=self.context_id)
+        body['continue'] = more
+        # A fresh connection is only safe before the server has seen the context
+        self.websocket = self.connection.send(body, reconnect=not self.sent)
+
+    def __iter__(self):
+        """Yield the audio chunks of the context until Cartesia reports it done."""
+        while not self.done:
+            try:
+                response = self.queue.get(timeout=RESPONSE_TIMEOUT)
+            except Empty:
+                raise RuntimeError(f"Timed out waiting for Cartesia audio of context {self.context_id}")
+            
+            if 'error' in response:
+                self.done = True
+                raise RuntimeError(f"Error generating audio: {response['error']}")
+            if response.get('done'):
+                self.done = True
+                break
+            if response.get('type') == 'chunk' and response.get('data'):
+                yield base64.b64decode(response['data'])
+
+    def cancel(self):
+        """Stop the generation of this context on the Cartesia side."""
+        if not self.done and self.sent:
+            self.connection.cancel(self.context_id)
+        self.done = True
+
+    def close(self):
+        self.cancel()
+        self.connection.contexts.pop(self.context_id, None)
+
+
+class CartesiaConnection:
+    """Long lived Cartesia websocket shared by all the TTS instances of this worker.
+
+    Utterances are multiplexed on it by context_id: a reader greenlet routes
+    every message to the queue of its context. A health check greenlet pings
+    the websocket and reconnects it when it stops answering.
+    """
+
+    def __init__(self, api_key=None, url=CARTESIA_WS_URL, version=CARTESIA_VERSION):
+        self.api_key = api_key or os.environ.get("CARTESIA_API_KEY")
+        self.url = url
+        self.version = version
+        self.websocket = None
+        self.contexts = {}
+        self.lock = Semaphore()
+        self.health_check = None
+
+    def is_connected(self):
+        return self.websocket is not None and self.websocket.socket.fileno() != -1
+
+    def connect(self):
+        """Open the websocket unless it is already open."""
+        with self.lock:
+            if self.is_connected():
+                return
+            
+            start_time = time.time()
+            websocket = connect(f"{self.url}?api_key={self.api_key}&cartesia_version={self.version}")
+            self.websocket = websocket
+            eventlet.spawn(self._read_loop, websocket)
+            metrics.increment('cartesia.connects')
+            logging.info(f"Connected to Cartesia websocket in {time.time() - start_time:.2f}s")
+            
+            if self.health_check is None:
+                self.health_check = eventlet.spawn(self._health_loop)
+
+    def close(self):
+        with self.lock:
+            websocket, self.websocket = self.websocket, None
+        if websocket:
+            websocket.close()
+
+    def context(self, model_id, voice_id, output_format, language=None):
+        """Open a context for one utterance, its audio is read by iterating it."""
+        context_id = str(uuid.uuid4())
+        request = {
+            "model_id": model_id,
+            "voice": {"id": voice_id},
+            "output_format": dict(output_format),
+        }
+        if language:
+            request["language"] = language
+        
+        context = CartesiaContext(self, context_id, request)
+        self.contexts[context_id] = context
+        return context
+
+    def send(self, body, reconnect=True):
+        """Send a message, retrying once on a fresh websocket when allowed, returns the websocket used."""
+        try:
+            self.connect()
+            websocket = self.websocket
+            websocket.send(json.dumps(body))
+            return websocket
+        except Exception as e:
+            if not reconnect:
+                raise RuntimeError(f"Cartesia websocket lost: {str(e)}")
+            logging.warning(f"Cartesia websocket send failed, reconnecting: {str(e)}")
+            metrics.increment('cartesia.reconnects')
+            self.close()
+            self.connect()
+            websocket = self.websocket
+            websocket.send(json.dumps(body))
+            return websocket
+
+    def cancel(self, context_id):
+        try:
+            if self.is_connected():
+                self.websocket.send(json.dumps({"context_id": context_id, "cancel": True}))
+        except Exception as e:
+            logging.warning(f"Error cancelling Cartesia context {context_id}: {str(e)}")
+
+    def _read_loop(self, websocket):
+        """Route the messages of a websocket to their context until it closes."""
+        try:
+            for message in websocket:
+                response = json.loads(message)
+                context = self.contexts.get(response.get('context_id'))
+                if context:
+                    context.queue.put(response)
+        except Exception as e:
+            logging.warning(f"Cartesia websocket closed: {str(e)}")
+        finally:
+            if self.websocket is websocket:
+                self.websocket = None
+            # Contexts still waiting on this websocket will never get their audio
+            for context in list(self.contexts.values()):
+                if context.websocket is websocket and not context.done:
+                    context.queue.put({'error': 'Cartesia websocket closed'})
+
+    def _health_loop(self):
+        """Ping the websocket and reconnect it when the pong does not come back."""
+        while True:
+            eventlet.sleep(HEALTH_CHECK_INTERVAL)
+            try:
+                if self.is_connected():
+                    pong = self.websocket.ping()
+                    if pong.wait(HEALTH_CHECK_TIMEOUT):
+                        continue
+                    logging.warning("Cartesia websocket did not answer the ping, reconnecting")
+                    self.close()
+                metrics.increment('cartesia.reconnects')
+                self.connect()
+            except Exception as e:
+                metrics.increment('cartesia.connection_errors')
+                logging.error(f"Cartesia health check failed: {str(e)}")
+
+
+cartesia_connection = CartesiaConnection()
@@ -0,0 +1,143 @@
+from collections import deque
+import logging
+import weakref
+
+import eventlet
+from flask import current_app
+
+from app import metrics
+from app.extensions import db
+from app.assistants.models import Assistant
+from app.base_knowledge.models import BaseKnowledge, assistant_base_knowledge
+from libs.assistant.assistant_llm import AssistantLLM
+from libs.assistant.text_to_speech import TTS
+
+
+class ComponentPool:
+    """Ready AssistantLLM and TTS instances per assistant, built ahead of the calls.
+
+    Every instance is tagged with a fingerprint of the assistant and of its
+    knowledge bases. Instances built from an older fingerprint are dropped
+    on acquire, so index rebuilds done by the Celery worker are picked up
+    even though they never go through invalidate.
+    """
+
+    def __init__(self, size=2):
+        self.size = size
+        # assistant_id -> deque of (fingerprint, assistant_llm, tts)
+        self.pools = {}
+        # assistant_id -> fingerprint of the last refill
+        self.fingerprints = {}
+        # assistant_llm -> fingerprint, for the instances in use by a call
+        self.leased = weakref.WeakKeyDictionary()
+        self.refilling = set()
+
+    def fingerprint(self, assistant_id):
+        """Version of the assistant settings and knowledge bases, None if the assistant is gone."""
+        assistant = Assistant.query.get(assistant_id)
+        if not assistant:
+            return None
+        
+        knowledge = (
+            db.session.query(BaseKnowledge.id, BaseKnowledge.updated_at, BaseKnowledge.last_loaded)
+            .join(assistant_base_knowledge)
+            .filter(assistant_base_knowledge.c.assistant_id == assistant_id)
+            .order_by(BaseKnowledge.id)
+            .all()
+        )
+        return (assistant.updated_at, tuple(tuple(row) for row in knowledge))
+
+    def acquire(self, assistant_id):
+        """Return (assistant_llm, tts) for a new call, from the pool when possible."""
+        app = current_app._get_current_object()
+        fingerprint = self.fingerprint(assistant_id)
+        pool = self.pools.setdefault(assistant_id, deque())
+        
+        entry = None
+        while pool:
+            candidate = pool.popleft()
+            if candidate[0] == fingerprint:
+                entry = candidate
+                break
+            metrics.increment('component_pool.stale')
+        
+        if entry:
+            metrics.increment('component_pool.hits')
+            _, assistant_llm, tts = entry
+            # Cheap, and protects against a late write from the previous call
+            assistant_llm.clear_memory()
+        else:
+            metrics.increment('component_pool.misses')
+            logging.warning(f"🤖 [LLM] No warm components for assistant {assistant_id}, building them on the request path")
+            assistant_llm, tts = AssistantLLM(assistant_id), TTS(assistant_id)
+        
+        self.leased[assistant_llm] = fingerprint
+        self.schedule_refill(app, assistant_id)
+        return assistant_llm, tts
+
+    def release(self, assistant_id, assistant_llm, tts):
+        """Take back the components of an ended call if they are still current."""
+        fingerprint = self.leased.pop(assistant_llm, None)
+        pool = self.pools.get(assistant_id)
+        if pool is None or fingerprint is None or fingerprint != self.fingerprints.get(assistant_id):
+            return
+        if len(pool) >= self.size:
+            return
+        
+        assistant_llm.clear_memory()
+        pool.append((fingerprint, assistant_llm, tts))
+        metrics.increment('component_pool.recycled')
+
+    def invalidate(self, assistant_id):
+        """Drop the warm components of an assistant and rebuild them in the background."""
+        was_pooled = self.pools.pop(assistant_id, None) is not None
+        self.fingerprints.pop(assistant_id, None)
+        logging.info(f"🤖 [LLM] Invalidated warm components of assistant {assistant_id}")
+        
+        if was_pooled:
+            self.schedule_refill(current_app._get_current_object(), assistant_id)
+
+    def invalidate_knowledge(self, base_knowledge):
+        """Invalidate every assistant using a knowledge base."""
+        for assistant in base_knowledge.assistants:
+            self.invalidate(assistant.id)
+
+    def warm(self, app):
+        """Fill the pools of every assistant reachable through a phone number."""
+        with app.app_context():
+            assistant_ids = [row.id for row in db.session.query(Assistant.id).filter(Assistant.phone_number_id.isnot(None))]
+        
+        for assistant_id in assistant_ids:
+            self.schedule_refill(app, assistant_id)
+
+    def schedule_refill(self, app, assistant_id):
+        if assistant_id in self.refilling:
+            return
+        self.refilling.add(assistant_id)
+        eventlet.spawn(self.refill, app, assistant_id)
+
+    def refill(self, app, assistant_id):
+        """Build components until the pool of the assistant is full."""
+        try:
+            with app.app_context():
+                size = app.config.get('CALL_COMPONENT_POOL_SIZE', self.size)
+                fingerprint = self.fingerprint(assistant_id)
+                if fingerprint is None:
+                    self.pools.pop(assistant_id, None)
+                    self.fingerprints.pop(assistant_id, None)
+                    return
+                
+                self.fingerprints[assistant_id] = fingerprint
+                pool = self.pools.setdefault(assistant_id, deque())
+                while len(pool) < size:
+                    pool.append((fingerprint, AssistantLLM(assistant_id), TTS(assistant_id)))
+                    logging.info(f"🤖 [LLM] Warmed components for assistant {assistant_id} ({len(pool)}/{size})")
+                    # Let calls run between two builds
+                    eventlet.sleep(0)
+        except Exception as e:
+            logging.error(f"❌ [ERROR] Error warming components for assistant {assistant_id}: {str(e)}")
+        finally:
+            self.refilling.discard(assistant_id)
+
+
+component_pool = ComponentPool()
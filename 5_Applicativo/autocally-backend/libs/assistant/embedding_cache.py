@@ -0,0 +1,103 @@
+from collections import OrderedDict
+import hashlib
+import logging
+import os
+import re
+import time
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from app import metrics
+from app.config import Config
+
+# Query embeddings kept in process, about 6 KiB each with the 1536 dimensions of the OpenAI models
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", 2048))
+# Shared tier in the Redis of Config, so every worker benefits from the questions already embedded
+EMBEDDING_CACHE_REDIS = os.getenv("EMBEDDING_CACHE_REDIS", "false").lower() == "true"
+EMBEDDING_CACHE_TTL = int(os.getenv("EMBEDDING_CACHE_TTL", 7 * 24 * 3600))
+# Seconds the Redis tier is skipped after an error, a missing Redis must not slow down every turn
+REDIS_RETRY_SECONDS = 30
+
+
+def normalize_query(text):
+    """Questions differing only by case, spacing or final punctuation share their embedding."""
+    return re.sub(r'\s+', ' ', text).strip().rstrip('?!.').strip().lower()
+
+
+class CachedQueryEmbeddings(Embeddings):
+    """Embedding function caching the query embeddings of the wrapped one.
+
+    Vectors are stored as float32 bytes, in an LRU in process and optionally
+    in Redis, under a key made of the embedding model and the hash of the
+    normalized query. Document embeddings are not cached, they are only
+    computed when an index is built.
+    """
+
+    def __init__(self, embeddings, size=EMBEDDING_CACHE_SIZE, use_redis=EMBEDDING_CACHE_REDIS):
+        self.embeddings = embeddings
+        self.size = size
+        self.model = f"{getattr(embeddings, 'model', type(embeddings).__name__)}:{getattr(embeddings, 'dimensions', None) or ''}"
+        self.entries = OrderedDict()
+        self.redis = None
+        self.redis_retry_at = 0.0
+        if use_redis:
+            import redis
+
+            self.redis = redis.Redis(
+                host=Config.REDIS_HOST, port=Config.REDIS_PORT, db=Config.REDIS_DB,
+                socket_timeout=0.1, socket_connect_timeout=0.1
+            )
+
+    def key(self, text):
+        return f"embedding:{self.model}:{hashlib.sha1(normalize_query(text).encode('utf-8')).hexdigest()}"
+
+    def embed_documents(self, texts):
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text):
+        key = self.key(text)
+        data = self.entries.get(key)
+        if data is not None:
+            self.entries.move_to_end(key)
+            metrics.increment('embedding_cache.hits')
+        else:
+            data = self.redis_get(key)
+            if data is not None:
+                metrics.increment('embedding_cache.redis_hits')
+            else:
+                metrics.increment('embedding_cache.misses')
+                data = np.asarray(self.embeddings.embed_query(text), dtype=np.float32).tobytes()
+                self.redis_set(key, data)
+            self.store(key, data)
+        return np.frombuffer(data, dtype=np.float32).tolist()
+
+    def store(self, key, data):
+        self.entries[key] = data
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def redis_get(self, key):
+        if not self.redis_available():
+            return None
+        try:
+            return self.redis.get(key)
+        except Exception as e:
+            self.redis_failed(e)
+            return None
+
+    def redis_set(self, key, data):
+        if not self.redis_available():
+            return
+        try:
+            self.redis.set(key, data, ex=EMBEDDING_CACHE_TTL)
+        except Exception as e:
+            self.redis_failed(e)
+
+    def redis_available(self):
+        return self.redis is not None and time.monotonic() >= self.redis_retry_at
+
+    def redis_failed(self, error):
+        logging.warning(f"Embedding cache Redis unavailable: {str(error)}")
+        metrics.increment('embedding_cache.redis_errors')
+        self.redis_retry_at = time.monotonic() + REDIS_RETRY_SECONDS
@@ -0,0 +1,164 @@
+import hashlib
+import logging
+import os
+import re
+import time
+import weakref
+
+from eventlet import tpool
+from eventlet.greenpool import GreenPool
+from eventlet.semaphore import Semaphore
+
+from app import metrics
+
+# Chunks fetched from each knowledge base before merging
+RAG_PER_BASE_K = int(os.getenv("RAG_PER_BASE_K", 6))
+# Chunks kept after merging, across all the knowledge bases
+RAG_TOP_K = int(os.getenv("RAG_TOP_K", 4))
+# Approximate tokens of knowledge put in front of the LLM per turn
+RAG_TOKEN_BUDGET = int(os.getenv("RAG_TOKEN_BUDGET", 1200))
+# Reciprocal rank fusion constant, higher values flatten the weight of the first ranks
+RRF_K = 60
+# Rough size of a token of Italian or English text, enough for a budget
+CHARS_PER_TOKEN = 4
+
+
+# store -> Semaphore, one search at a time per store
+store_locks = weakref.WeakKeyDictionary()
+
+
+def content_key(text):
+    return hashlib.sha1(re.sub(r'\s+', ' ', text).strip().lower().encode('utf-8')).hexdigest()
+
+
+def store_lock(store):
+    """Lock of a store, taken before searching it in a tpool thread.
+
+    The locks of Chroma are green under eventlet and must never have to
+    wait in an OS thread, so two searches of the same store never overlap.
+    """
+    lock = store_locks.get(store)
+    if lock is None:
+        lock = store_locks[store] = Semaphore()
+    return lock
+
+
+class FederatedRetriever:
+    """Searches all the knowledge bases of an assistant and merges their hits.
+
+    The query is embedded once and every store is searched in parallel in
+    the OS threads of eventlet.tpool, since hnswlib and SQLite release the
+    GIL, so the latency is that of the slowest store and not their sum.
+    Hits are ranked by reciprocal rank fusion, since the distances of
+    different collections are not comparable, and chunks found in several
+    knowledge bases are kept once with their scores added. The best top_k
+    that fit in token_budget are returned.
+    """
+
+    def __init__(self, stores, embedding_function, per_base_k=RAG_PER_BASE_K, top_k=RAG_TOP_K, token_budget=RAG_TOKEN_BUDGET):
+        # (knowledge base name, store)
+        self.stores = stores
+        self.embedding_function = embedding_function
+        self.per_base_k = per_base_k
+        self.top_k = top_k
+        self.token_budget = token_budget
+
+    def search(self, query):
+        """Merged hits for query, as (knowledge base name, document, score) from the best."""
+        if not self.stores:
+            return []
+
+        start_time = time.time()
+        embedding = self.embedding_function.embed_query(query)
+
+        def search_store(entry):
+            name, store = entry
+            try:
+                with store_lock(store):
+                    return name, tpool.execute(store.similarity_search_by_vector, embedding, k=self.per_base_k)
+            except Exception as e:
+                logging.error(f"❌ [ERROR] Error searching knowledge base {name}: {str(e)}")
+                return name, []
+
+        merged = {}
+        for name, documents in GreenPool(len(self.stores)).imap(search_store, self.stores):
+            for rank, document in enumerate(documents):
+                key = content_key(document.page_content)
+                score = 1.0 / (RRF_K + rank + 1)
+                if key in merged:
+                    merged[key][2] += score
+                    metrics.increment('rag.duplicate_hits')
+                else:
+                    merged[key] = [name, document, score]
+
+        hits = []
+        tokens = 0
+        for name, document, score in sorted(merged.values(), key=lambda hit: hit[2], reverse=True):
+            if len(hits) >= self.top_k:
+                break
+            size = len(document.page_content) // CHARS_PER_TOKEN + 1
+            # The best hit is always kept, even when it alone is over the budget
+            if hits and tokens + size > self.token_budget:
+                break
+            hits.append((name, document, score))
+            tokens += size
+
+        logging.info(f"🤖 [LLM] Retrieved {len(hits)}/{len(merged)} chunks from {len(self.stores)} knowledge bases "
+                     f"(~{tokens} tokens) in {time.time() - start_time:.3f}s")
+        return hits
+
+    def retrieve(self, query):
+        """Merged hits for query as text for the prompt, grouped by knowledge base."""
+        sections = {}
+        for name, document, _ in self.search(query):
+            sections.setdefault(name, []).append(document.page_content)
+        if not sections:
+            return "No relevant information found."
+        return "\n\n".join(f"### {name}\n" + "\n\n".join(chunks) for name, chunks in sections.items())
+
+
+if __name__ == "__main__":
+    # Latency of a federated search over 1 to N indexed knowledge bases, against searching them one by one:
+    # python -m libs.assistant.federated_retriever <chroma_db> [<chroma_db> ...]
+    import statistics
+    import sys
+    import numpy as np
+    from langchain_chroma import Chroma
+    from libs.assistant.vector_store_registry import open_client
+
+    class QueryVectors:
+        """Random query vectors, the embeddings of the stores are not needed to time the searches."""
+
+        def __init__(self, dimensions):
+            self.random = np.random.default_rng(0)
+            self.dimensions = dimensions
+
+        def embed_query(self, text):
+            return self.random.standard_normal(self.dimensions).astype(np.float32).tolist()
+
+    stores = [(path, Chroma(client=open_client(path)[1])) for path in sys.argv[1:]]
+    dimensions = len(stores[0][1].get(limit=1, include=['embeddings'])['embeddings'][0])
+    queries = QueryVectors(dimensions)
+    logging.disable(logging.INFO)
+
+    def timed(search, runs=40):
+        timings = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            search()
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        return f"mean {statistics.mean(timings):.1f}ms p50 {timings[len(timings) // 2]:.1f}ms p95 {timings[int(len(timings) * 0.95)]:.1f}ms"
+
+    def search_sequentially(count):
+        embedding = queries.embed_query('query')
+        for _, store in stores[:count]:
+            store.similarity_search_by_vector(embedding, k=RAG_PER_BASE_K)
+
+    print(f"{len(stores)} knowledge bases, {os.cpu_count()} CPUs")
+    for count in range(1, len(stores) + 1):
+        retriever = FederatedRetriever(stores[:count], queries)
+        # Loads the HNSW indexes before timing
+        retriever.search('warm up')
+        print(f"{count} knowledge bases, parallel:   {timed(lambda: retriever.search('query'))}")
+        print(f"{count} knowledge bases, sequential: {timed(lambda: search_sequentially(count))}")
@@ -1,7 +1,7 @@
 import os
 import logging
 import asyncio
-import base64
+import binascii
 from deepgram import DeepgramClient, DeepgramClientOptions, LiveOptions, LiveTranscriptionEvents
 from dotenv import load_dotenv
 import eventlet
@@ -11,10 +11,32 @@ from flask import current_app
 import numpy as np
 import time
 import wave
+from collections import deque
+from app import metrics
+from libs.assistant.audio_codec import mulaw_to_int16
+from libs.assistant.stt_dispatcher import STT_QUEUE_MAX_SECONDS, stt_dispatcher
+from libs.assistant.vad import create_gate
+from libs.assistant.utterance_assembler import STT_ENDPOINTING_MS, STT_UTTERANCE_END_MS, UtteranceAssembler
 
 load_dotenv()
 nest_asyncio.apply()
 
+# The audio received by a stream is kept for the WAV written to audio_logs, up to a bound
+STT_RECORD_AUDIO = os.getenv("STT_RECORD_AUDIO", "true").lower() == "true"
+STT_RECORD_MAX_SECONDS = int(os.getenv("STT_RECORD_MAX_SECONDS", 300))
+# Bytes per sample of the encodings sent to Deepgram
+ENCODING_SAMPLE_WIDTHS = {"linear16": 2, "mulaw": 1}
+# Reconnection of a stream closed by Deepgram, with exponential backoff between attempts
+STT_RECONNECT_MAX_ATTEMPTS = int(os.getenv("STT_RECONNECT_MAX_ATTEMPTS", 6))
+STT_RECONNECT_BASE_DELAY = float(os.getenv("STT_RECONNECT_BASE_DELAY", 0.5))
+STT_RECONNECT_MAX_DELAY = float(os.getenv("STT_RECONNECT_MAX_DELAY", 8.0))
+# Seconds of sent audio replayed after a reconnect, the words cut by the drop are transcribed again
+STT_REPLAY_SECONDS = float(os.getenv("STT_REPLAY_SECONDS", 3.0))
+# Deepgram closes streams that get no data for 10 seconds
+STT_KEEPALIVE_INTERVAL = float(os.getenv("STT_KEEPALIVE_INTERVAL", 4.0))
+# Transcripts ending before the last final one, plus this tolerance, are replays
+STT_DUPLICATE_TOLERANCE = 0.05
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
@@ -27,27 +49,80 @@ deepgram_file_handler.setFormatter(deepgram_formatter)
 deepgram_logger.addHandler(deepgram_file_handler)
 deepgram_logger.propagate = False  # To not see in the console
 
+def audio_bytes(audio_chunk):
+    """Bytes-like view of an inbound audio chunk, copied only when the samples have to be converted."""
+    if isinstance(audio_chunk, dict) and 'audio' in audio_chunk:
+        audio_chunk = audio_chunk['audio']
+    if isinstance(audio_chunk, (bytes, bytearray)):
+        return audio_chunk
+    if isinstance(audio_chunk, memoryview):
+        return audio_chunk if audio_chunk.format == 'B' else audio_chunk.cast('B')
+    if isinstance(audio_chunk, str):
+        # Single C level decode, no intermediate objects
+        return binascii.a2b_base64(audio_chunk)
+    if isinstance(audio_chunk, np.ndarray):
+        if audio_chunk.dtype != np.int16:
+            audio_chunk = audio_chunk.astype(np.int16)
+        return memoryview(np.ascontiguousarray(audio_chunk)).cast('B')
+    if isinstance(audio_chunk, (list, tuple)):
+        return memoryview(np.asarray(audio_chunk, dtype=np.int16)).cast('B')
+    # Anything else exposing the buffer protocol
+    return memoryview(audio_chunk).cast('B')
+
+
 class SpeechToText:
-    def __init__(self, assistant_id):
+    def __init__(self, assistant_id, call_id=None, on_transcript=None, on_speech_started=None, encoding="linear16", sample_rate=16000):
         logger.info(f"Initializing SpeechToText for assistant {assistant_id}")
         deepgram_logger.info(f"=== INITIALIZING SPEECH TO TEXT ===")
-        deepgram_logger.info(f"Assistant ID: {assistant_id}")
+        deepgram_logger.info(f"Assistant ID: {assistant_id}, Call ID: {call_id}")
         
         self.assistant_id = assistant_id
+        # Call this stream belongs to, transcripts are dispatched to it directly
+        self.call_id = call_id
+        # Optional callback(call_id, transcript, is_final), replaces the socket broadcast
+        self.on_transcript = on_transcript
+        # Optional callback(call_id) for Deepgram VAD SpeechStarted events, used for barge-in
+        self.on_speech_started = on_speech_started
+        # Audio sent by the client, Twilio calls stream mulaw at 8000 Hz as is
+        self.encoding = encoding
+        self.sample_rate = sample_rate
         self.dg_client = None
         self.dg_connection = None
-        self.transcript_parts = []
+        # Joins the final results of a user turn, only whole turns reach on_transcript as final
+        self.assembler = UtteranceAssembler(self.emit_transcript)
         self.is_streaming = False
-        self.loop = None
-        self.audio_chunks = []
-        self.audio_buffer = []
+        self.bytes_per_second = sample_rate * ENCODING_SAMPLE_WIDTHS.get(encoding, 2)
+        # Audio received before the connection is open, the oldest is dropped past the bound
+        self.audio_buffer = deque()
+        self.buffered_bytes = 0
+        self.max_buffered_bytes = int(STT_QUEUE_MAX_SECONDS * self.bytes_per_second)
+        # Bounded recording of the received audio, appended in place without keeping the chunks
+        self.record_audio = STT_RECORD_AUDIO
+        self.max_recording_bytes = STT_RECORD_MAX_SECONDS * self.bytes_per_second
+        self.recording = bytearray()
+        # Position in seconds of the audio sent so far and of the start of the current connection,
+        # Deepgram timestamps restart at zero on every connection
+        self.audio_time = 0.0
+        self.stream_offset = 0.0
+        # End of the last final transcript, on the audio_time scale
+        self.final_until = 0.0
+        # (audio_time, chunk) of the last STT_REPLAY_SECONDS sent, and the chunks to send again after a reconnect
+        self.replay = deque()
+        self.pending_replay = []
+        self.last_sent = time.monotonic()
+        self.stopping = False
+        self.reconnecting = False
+        self.keepalive_runner = None
+        self.reconnects = 0
+        self.gap_seconds = 0.0
+        # Local VAD, silence of the caller is not streamed to Deepgram
+        self.vad_gate = create_gate(encoding, sample_rate, self.bytes_per_second)
         
         if not self.check_api_key():
             raise ValueError("Invalid or missing Deepgram API key")
         
-        # Configure Deepgram client options
-        options_dict = {"keepalive": "true", "vad_events": "true"}
-        config = DeepgramClientOptions(options=options_dict)
+        # Configure Deepgram client options, KeepAlive is sent by keep_alive_loop only during silence
+        config = DeepgramClientOptions()
         self.dg_client = DeepgramClient(os.getenv("DEEPGRAM_API_KEY"), config)
         logger.info("Deepgram async client initialized successfully")
 
@@ -65,14 +140,65 @@ class SpeechToText:
         deepgram_logger.info(f"=== DEEPGRAM CONNECTION OPENED ===")
         deepgram_logger.info(f"Assistant ID: {self.assistant_id}")
         self.is_streaming = True
-        if self.audio_buffer:
-            loop = asyncio.get_event_loop()
-            asyncio.run_coroutine_threadsafe(self.process_buffered_chunks(), loop)
+        self.last_sent = time.monotonic()
+        if self.audio_buffer or self.pending_replay:
+            # Sent by the dispatcher, in order with the chunks queued after them
+            stt_dispatcher.flush(self)
 
-    def handle_close(self, event, client):
-        logger.info(f"Connection closed: {event}")
+    def handle_close(self, *args, **kwargs):
+        logger.info(f"Connection closed for call {self.call_id}")
         deepgram_logger.info(f"=== DEEPGRAM CONNECTION CLOSED ===")
         self.is_streaming = False
+        if not self.stopping and not self.reconnecting:
+            # Closed by Deepgram or the network, audio is buffered until the stream is back
+            self.reconnecting = True
+            eventlet.spawn(self.reconnect)
+
+    def reconnect(self):
+        """Open a new connection with exponential backoff and replay the audio sent just before the drop."""
+        disconnected_at = time.monotonic()
+        delay = STT_RECONNECT_BASE_DELAY
+        self.prepare_replay()
+        try:
+            for attempt in range(1, STT_RECONNECT_MAX_ATTEMPTS + 1):
+                if self.stopping:
+                    return
+                logger.warning(f"🎤 [STT] Reconnecting Deepgram stream of call {self.call_id}, attempt {attempt}")
+                if self.open_connection():
+                    gap = time.monotonic() - disconnected_at
+                    self.reconnects += 1
+                    self.gap_seconds += gap
+                    metrics.increment('stt.reconnects')
+                    metrics.increment('stt.gap_seconds', gap)
+                    logger.warning(f"🎤 [STT] Deepgram stream of call {self.call_id} reconnected after {gap:.2f}s, replaying {len(self.pending_replay)} chunks")
+                    return
+                eventlet.sleep(delay)
+                delay = min(delay * 2, STT_RECONNECT_MAX_DELAY)
+            logger.error(f"❌ [STT] Could not reconnect the Deepgram stream of call {self.call_id}")
+            metrics.increment('stt.reconnect_failures')
+        finally:
+            self.reconnecting = False
+
+    def prepare_replay(self):
+        """Queue the recently sent audio to be sent again, the new connection starts at its position."""
+        if self.replay:
+            self.audio_time = self.replay[0][0]
+        self.pending_replay = [chunk for _, chunk in self.replay]
+        self.replay.clear()
+        self.stream_offset = self.audio_time
+
+    def keep_alive_loop(self):
+        """Send KeepAlive while no audio is being sent, so silence or audio held back by the VAD does not close the stream."""
+        try:
+            while not self.stopping:
+                eventlet.sleep(STT_KEEPALIVE_INTERVAL / 2)
+                if self.is_streaming and self.dg_connection and time.monotonic() - self.last_sent >= STT_KEEPALIVE_INTERVAL:
+                    self.dg_connection.keep_alive()
+                    self.last_sent = time.monotonic()
+        except Exception as e:
+            logger.error(f"Error in keep alive loop: {str(e)}")
+        finally:
+            self.keepalive_runner = None
 
     def handle_transcript(self, client, result=None):
         deepgram_logger.info(f"=== DEEPGRAM TRANSCRIPT RECEIVED ===")
@@ -81,30 +207,83 @@ class SpeechToText:
             sentence = result.channel.alternatives[0].transcript
             is_final = getattr(result, 'is_final', False)
             if sentence:
-                self.transcript_parts.append(sentence)
-                deepgram_logger.info(f"About to emit transcript event: text='{sentence}', final={is_final}")
-                
-                from app.assistants.socket_events import socketio
-                
-                socketio.emit('stt_transcript', {
-                    'transcript': sentence,
-                    'assistant_id': self.assistant_id,
-                    'final': is_final
-                })
-                
-                if is_final:
-                    self.transcript_parts = []
-                    deepgram_logger.info("Reset transcript parts after final message")
-                
-                deepgram_logger.info(f"Emitted transcript event: '{sentence}', Final: {is_final}")
+                fresh = self.fresh_transcript(result, is_final)
+                if not fresh:
+                    deepgram_logger.info(f"Skipping replayed transcript: '{sentence}'")
+                    metrics.increment('stt.duplicate_transcripts')
+                    return
+                if fresh != sentence:
+                    deepgram_logger.info(f"Trimmed replayed words: '{sentence}' -> '{fresh}'")
+                    metrics.increment('stt.trimmed_transcripts')
+                    sentence = fresh
+            deepgram_logger.info(f"Transcript result: text='{sentence}', final={is_final}")
+            self.assembler.add_result(sentence, is_final, getattr(result, 'speech_final', False))
+
+    def handle_utterance_end(self, client, utterance_end=None, **kwargs):
+        deepgram_logger.info("=== DEEPGRAM UTTERANCE END ===")
+        self.assembler.utterance_end()
+
+    def emit_transcript(self, transcript, is_final):
+        """Send the user turn so far, or the whole turn when is_final."""
+        if self.on_transcript:
+            # Server side dispatch straight to the owning call
+            eventlet.spawn(self.on_transcript, self.call_id, transcript, is_final)
+        else:
+            from app.extensions import socketio
+            
+            socketio.emit('stt_transcript', {
+                'transcript': transcript,
+                'assistant_id': self.assistant_id,
+                'call_id': self.call_id,
+                'final': is_final
+            })
+        
+        deepgram_logger.info(f"Emitted transcript event: '{transcript}', Final: {is_final}")
+
+    def fresh_transcript(self, result, is_final):
+        """Transcript of result without the words already transcribed before a reconnect, by their timestamps.
 
-    def handle_error(self, error, client):
+        Only the words starting after the end of the last final are kept, so a
+        result crossing that boundary loses its replayed words only. Results
+        without word timings are kept or dropped whole.
+        """
+        alternative = result.channel.alternatives[0]
+        words = getattr(alternative, 'words', None)
+        if not words:
+            start = getattr(result, 'start', None)
+            if start is None:
+                return alternative.transcript
+            end = self.stream_offset + start + (getattr(result, 'duration', 0) or 0)
+            if end <= self.final_until + STT_DUPLICATE_TOLERANCE:
+                return ''
+            if is_final:
+                self.final_until = end
+            return alternative.transcript
+        
+        fresh = [word for word in words if self.stream_offset + word.start >= self.final_until - STT_DUPLICATE_TOLERANCE]
+        if is_final and fresh:
+            self.final_until = self.stream_offset + fresh[-1].end
+        if len(fresh) == len(words):
+            return alternative.transcript
+        return ' '.join(getattr(word, 'punctuated_word', None) or word.word for word in fresh)
+
+    def handle_speech_started(self, client, speech_started=None, **kwargs):
+        deepgram_logger.info("=== DEEPGRAM SPEECH STARTED ===")
+        if self.on_speech_started:
+            eventlet.spawn(self.on_speech_started, self.call_id)
+
+    def handle_error(self, client, error=None, **kwargs):
         logger.error(f"Deepgram error: {error}")
         deepgram_logger.error(f"=== DEEPGRAM ERROR === Error details: {error}")
 
     async def process_buffered_chunks(self):
+        # Audio already sent before a reconnect goes first, it is not recorded twice
+        replay, self.pending_replay = self.pending_replay, []
+        for chunk in replay:
+            self.send_audio(chunk)
         while self.audio_buffer:
-            chunk = self.audio_buffer.pop(0)
+            chunk = self.audio_buffer.popleft()
+            self.buffered_bytes -= len(chunk)
             await self.process_chunk(chunk)
             logger.info("Processed buffered chunk")
 
@@ -119,8 +298,11 @@ class SpeechToText:
                 language="it", 
                 smart_format=True, 
                 interim_results=True, 
-                encoding="linear16", 
-                sample_rate=16000, 
+                vad_events=True,
+                endpointing=STT_ENDPOINTING_MS,
+                utterance_end_ms=str(STT_UTTERANCE_END_MS),
+                encoding=self.encoding, 
+                sample_rate=self.sample_rate, 
                 channels=1
             )
             
@@ -132,6 +314,8 @@ class SpeechToText:
             self.dg_connection.on(LiveTranscriptionEvents.Open, self.handle_open)
             self.dg_connection.on(LiveTranscriptionEvents.Close, self.handle_close)
             self.dg_connection.on(LiveTranscriptionEvents.Transcript, self.handle_transcript)
+            self.dg_connection.on(LiveTranscriptionEvents.SpeechStarted, self.handle_speech_started)
+            self.dg_connection.on(LiveTranscriptionEvents.UtteranceEnd, self.handle_utterance_end)
             self.dg_connection.on(LiveTranscriptionEvents.Error, self.handle_error)
             deepgram_logger.info("Event handlers registered")
             
@@ -167,30 +351,39 @@ class SpeechToText:
             deepgram_logger.warning("Stream already started")
             return True
         
+        # Reset all state
+        self.recording = bytearray()
+        self.audio_buffer = deque()
+        self.buffered_bytes = 0
+        self.audio_time = 0.0
+        self.stream_offset = 0.0
+        self.final_until = 0.0
+        self.replay.clear()
+        self.pending_replay = []
+        self.stopping = False
+        self.vad_gate = create_gate(self.encoding, self.sample_rate, self.bytes_per_second)
+        return self.open_connection()
+
+    def open_connection(self):
+        """Open a Deepgram connection, the buffered audio is kept."""
         try:
-            # Reset all state
-            self.audio_chunks = []
-            self.audio_buffer = []
             self.dg_connection = None
             
-            # Create or get the event loop
+            # Starts and reconnects run in greenlets of their own, each closes the loop it created
+            loop = asyncio.new_event_loop()
             try:
-                self.loop = asyncio.get_event_loop()
-                if self.loop.is_closed():
-                    self.loop = asyncio.new_event_loop()
-                    asyncio.set_event_loop(self.loop)
-            except RuntimeError:
-                self.loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(self.loop)
-            
-            # Run the async connection initialization
-            connection_success = self.loop.run_until_complete(self._initialize_connection())
+                connection_success = loop.run_until_complete(self._initialize_connection())
+            finally:
+                loop.close()
             
             if not connection_success:
                 logger.error("Failed to initialize Deepgram connection")
                 deepgram_logger.error("Failed to start stream - connection initialization failed")
                 return False
             
+            if self.keepalive_runner is None:
+                self.keepalive_runner = eventlet.spawn(self.keep_alive_loop)
+            
             logger.info("Stream initialized successfully")
             deepgram_logger.info("Stream initialized successfully")
             return True
@@ -204,37 +397,52 @@ class SpeechToText:
         logger.info("Processing chunk")
         if not self.is_streaming:
             logger.info("STT stream not started, buffering audio chunk")
-            self.audio_buffer.append(audio_chunk)
+            self.buffer_chunk(audio_bytes(audio_chunk))
             return
         
+        # Audio received while the connection was opening goes first
+        if self.audio_buffer or self.pending_replay:
+            await self.process_buffered_chunks()
+        
         try:
-            if isinstance(audio_chunk, dict) and 'audio' in audio_chunk:
-                audio_data = audio_chunk['audio']
-            elif isinstance(audio_chunk, str):
-                audio_data = base64.b64decode(audio_chunk)
-            elif isinstance(audio_chunk, (bytes, bytearray)):
-                audio_data = audio_chunk
-            elif hasattr(audio_chunk, 'tolist') and callable(audio_chunk.tolist):
-                audio_data = np.array(audio_chunk.tolist(), dtype=np.int16).tobytes()
-            else:
-                audio_data = bytes(audio_chunk)
+            audio_data = audio_bytes(audio_chunk)
             
             deepgram_logger.info(f"Audio chunk length: {len(audio_data)} bytes")
-            self.audio_chunks.append(audio_data)
+            self.record(audio_data)
             
             if len(audio_data) > 0:
-                # Send audio data synchronously
-                self.dg_connection.send(audio_data)
-                deepgram_logger.info(f"Sent {len(audio_data)} bytes to Deepgram")
+                chunks = self.vad_gate.process(audio_data) if self.vad_gate else (audio_data,)
+                for chunk in chunks:
+                    self.send_audio(chunk)
+                metrics.increment('stt.received_bytes', len(audio_data))
+                if chunks:
+                    sent = sum(len(chunk) for chunk in chunks)
+                    metrics.increment('stt.sent_bytes', sent)
+                    deepgram_logger.info(f"Sent {sent} bytes to Deepgram")
         except Exception as e:
             error_msg = f"Error processing chunk: {str(e)}"
             logger.error(error_msg, exc_info=True)
             deepgram_logger.error(error_msg)
             raise
 
+    def send_audio(self, audio_data):
+        """Send audio synchronously and keep it for a replay after a reconnect."""
+        self.dg_connection.send(audio_data)
+        self.last_sent = time.monotonic()
+        self.replay.append((self.audio_time, audio_data))
+        self.audio_time += len(audio_data) / self.bytes_per_second
+        while self.replay and self.replay[0][0] < self.audio_time - STT_REPLAY_SECONDS:
+            self.replay.popleft()
+
     async def stop_stream(self):
+        # Also ends a reconnection in progress
+        self.stopping = True
         if not self.is_streaming:
             logger.warning("Stream already stopped")
+            if self.recording:
+                # Stopped while reconnecting, the audio received so far is still logged
+                self.save_audio_file()
+                self.recording = bytearray()
             return
         
         try:
@@ -245,18 +453,42 @@ class SpeechToText:
                 self.dg_connection.finish()
                 logger.info("Deepgram connection finished")
                 self.dg_connection = None
+            # The last words of the caller still make a turn
+            self.assembler.flush()
             
             self.is_streaming = False
-            self.audio_chunks = []
-            self.audio_buffer = []
+            self.recording = bytearray()
+            self.audio_buffer = deque()
+            self.buffered_bytes = 0
             logger.info("Stream stopped successfully")
         except Exception as e:
             logger.error(f"Error stopping stream: {str(e)}", exc_info=True)
             self.is_streaming = False
             raise
 
+    def buffer_chunk(self, audio_data):
+        """Keep audio until the connection is open, dropping the oldest past max_buffered_bytes."""
+        self.audio_buffer.append(audio_data)
+        self.buffered_bytes += len(audio_data)
+        while self.buffered_bytes > self.max_buffered_bytes and len(self.audio_buffer) > 1:
+            dropped = self.audio_buffer.popleft()
+            self.buffered_bytes -= len(dropped)
+            metrics.increment('stt.dropped_chunks')
+            metrics.increment('stt.dropped_bytes', len(dropped))
+
+    def record(self, audio_data):
+        """Append received audio to the recording until it reaches max_recording_bytes."""
+        if not self.record_audio:
+            return
+        room = self.max_recording_bytes - len(self.recording)
+        if room <= 0:
+            return
+        self.recording += audio_data[:room]
+        if len(audio_data) >= room:
+            logger.info(f"Recording of call {self.call_id} reached {STT_RECORD_MAX_SECONDS}s, later audio is not saved")
+
     def save_audio_file(self, directory='audio_logs'):
-        if not self.audio_chunks:
+        if not self.recording:
             logger.warning("No audio chunks to save")
             return
         
@@ -266,10 +498,14 @@ class SpeechToText:
         timestamp = time.strftime("%Y%m%d-%H%M%S")
         filename = f"{directory}/audio_{self.assistant_id}_{timestamp}.wav"
         
+        audio = self.recording
+        if self.encoding == "mulaw":
+            audio = mulaw_to_int16(audio).tobytes()
+        
         with wave.open(filename, 'wb') as wf:
             wf.setnchannels(1)
             wf.setsampwidth(2)
-            wf.setframerate(16000)
-            wf.writeframes(b''.join(self.audio_chunks))
+            wf.setframerate(self.sample_rate)
+            wf.writeframes(audio)
         
         logger.info(f"Saved audio file to {filename}")
\ No newline at end of file
@@ -0,0 +1,222 @@
+from collections import deque
+import asyncio
+import logging
+import os
+import time
+
+import eventlet
+from eventlet.event import Event
+
+from app import metrics
+
+# Queue markers, anything else in a queue is an audio chunk
+FLUSH = object()
+STOP = object()
+
+# Bounds of the inbound queue of a stream, the oldest audio is dropped past them
+STT_QUEUE_MAX_SECONDS = float(os.getenv("STT_QUEUE_MAX_SECONDS", 5.0))
+STT_QUEUE_MAX_LATENCY = float(os.getenv("STT_QUEUE_MAX_LATENCY", 2.0))
+
+
+class InboundAudioQueue:
+    """Ring buffer of the audio of one stream waiting to be sent to Deepgram.
+
+    Chunks are numbered as they arrive. When more than max_bytes are queued,
+    or a chunk has waited longer than max_latency, the oldest chunks are
+    dropped and counted, so a stalled provider costs a bounded amount of
+    memory and the caller is never answered from stale audio. Markers are
+    never dropped.
+    """
+
+    __slots__ = (
+        'items',
+        'queued_bytes',
+        'max_bytes',
+        'max_latency',
+        'next_sequence',
+        'sent_sequence',
+        'scheduled',
+        'dropped_chunks',
+        'dropped_bytes',
+    )
+
+    def __init__(self, max_bytes, max_latency):
+        # (sequence, enqueue time, chunk) for audio, (None, None, marker) for markers
+        self.items = deque()
+        self.queued_bytes = 0
+        self.max_bytes = max_bytes
+        self.max_latency = max_latency
+        self.next_sequence = 0
+        # Sequence of the last chunk handed to the stream
+        self.sent_sequence = None
+        self.scheduled = False
+        self.dropped_chunks = 0
+        self.dropped_bytes = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def push(self, chunk):
+        self.items.append((self.next_sequence, time.monotonic(), chunk))
+        self.next_sequence += 1
+        self.queued_bytes += len(chunk)
+        while self.queued_bytes > self.max_bytes and self._drop_oldest():
+            pass
+
+    def push_marker(self, marker):
+        self.items.append((None, None, marker))
+
+    def pop(self):
+        """Next item to process, audio older than max_latency is dropped on the way."""
+        now = time.monotonic()
+        while self.items:
+            sequence, enqueued_at, item = self.items.popleft()
+            if sequence is None:
+                return item
+            self.queued_bytes -= len(item)
+            if now - enqueued_at > self.max_latency:
+                self._count_drop(item)
+                continue
+            self.sent_sequence = sequence
+            return item
+        return None
+
+    def stats(self):
+        return {
+            'queued_chunks': len(self.items),
+            'queued_bytes': self.queued_bytes,
+            'sent_sequence': self.sent_sequence,
+            'dropped_chunks': self.dropped_chunks,
+            'dropped_bytes': self.dropped_bytes,
+        }
+
+    def _drop_oldest(self):
+        for index, (sequence, _, item) in enumerate(self.items):
+            if sequence is not None:
+                del self.items[index]
+                self.queued_bytes -= len(item)
+                self._count_drop(item)
+                return True
+        return False
+
+    def _count_drop(self, chunk):
+        self.dropped_chunks += 1
+        self.dropped_bytes += len(chunk)
+        metrics.increment('stt.dropped_chunks')
+        metrics.increment('stt.dropped_bytes', len(chunk))
+
+
+class STTDispatcher:
+    """Feeds every SpeechToText stream of the worker from one greenlet and one asyncio loop.
+
+    Producers queue audio per stream and return immediately. The drainer
+    sends the queued chunks of each stream in order, so the audio reaches
+    Deepgram in the order it was received, with no greenlet or event loop
+    created per chunk.
+    """
+
+    def __init__(self, max_seconds=STT_QUEUE_MAX_SECONDS, max_latency=STT_QUEUE_MAX_LATENCY):
+        self.max_seconds = max_seconds
+        self.max_latency = max_latency
+        self.loop = None
+        # Inbound queue of each stream, keyed by the SpeechToText instance
+        self.queues = {}
+        # Streams with pending items, in the order they became ready
+        self.ready = deque()
+        self.wakeup = Event()
+        self.runner = None
+
+        metrics.register_gauge('stt.streams', self.stats)
+
+    def submit(self, speech_to_text, chunk):
+        """Queue an audio chunk of a stream."""
+        self._queue(speech_to_text).push(chunk)
+        self._schedule(speech_to_text)
+
+    def flush(self, speech_to_text):
+        """Send the chunks a stream buffered before its connection was open."""
+        self._queue(speech_to_text).push_marker(FLUSH)
+        self._schedule(speech_to_text)
+
+    def stop(self, speech_to_text):
+        """Stop a stream after its queued chunks, returns an Event sent once it is stopped."""
+        done = Event()
+        self._queue(speech_to_text).push_marker((STOP, done))
+        self._schedule(speech_to_text)
+        return done
+
+    def stats(self):
+        return {
+            str(speech_to_text.call_id or speech_to_text.assistant_id): dict(
+                queue.stats(),
+                reconnects=getattr(speech_to_text, 'reconnects', 0),
+                gap_seconds=round(getattr(speech_to_text, 'gap_seconds', 0.0), 3),
+                vad_suppressed_bytes=getattr(getattr(speech_to_text, 'vad_gate', None), 'suppressed_bytes', 0)
+            )
+            for speech_to_text, queue in list(self.queues.items())
+        }
+
+    def _queue(self, speech_to_text):
+        queue = self.queues.get(speech_to_text)
+        if queue is None:
+            max_bytes = int(self.max_seconds * getattr(speech_to_text, 'bytes_per_second', 32000))
+            queue = self.queues[speech_to_text] = InboundAudioQueue(max_bytes, self.max_latency)
+        return queue
+
+    def _schedule(self, speech_to_text):
+        queue = self.queues[speech_to_text]
+        if not queue.scheduled:
+            queue.scheduled = True
+            self.ready.append(speech_to_text)
+
+        if self.runner is None:
+            self.runner = eventlet.spawn(self._run)
+        if not self.wakeup.ready():
+            self.wakeup.send()
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        while True:
+            try:
+                asyncio.set_event_loop(self.loop)
+                self.loop.run_until_complete(self._drain())
+                if not self.ready:
+                    self.wakeup.wait()
+                    self.wakeup = Event()
+            except Exception as e:
+                logging.error(f"❌ [STT] Error in STT dispatcher: {str(e)}")
+                eventlet.sleep(0.01)
+
+    async def _drain(self):
+        while self.ready:
+            speech_to_text = self.ready.popleft()
+            queue = self.queues.get(speech_to_text)
+            if queue is None:
+                continue
+            while queue:
+                item = queue.pop()
+                if item is not None:
+                    await self._process(speech_to_text, item)
+            queue.scheduled = False
+            # Let the producers and the socket greenlets run between streams
+            eventlet.sleep(0)
+
+    async def _process(self, speech_to_text, item):
+        try:
+            if item is FLUSH:
+                await speech_to_text.process_buffered_chunks()
+            elif isinstance(item, tuple) and item[0] is STOP:
+                try:
+                    await speech_to_text.stop_stream()
+                finally:
+                    # Audio queued after the stop belongs to a later stream and starts a new queue
+                    if not self.queues.get(speech_to_text):
+                        self.queues.pop(speech_to_text, None)
+                    item[1].send()
+            else:
+                await speech_to_text.process_chunk(item)
+        except Exception as e:
+            logging.error(f"❌ [STT] Error processing audio of stream {speech_to_text.call_id or speech_to_text.assistant_id}: {str(e)}")
+
+
+stt_dispatcher = STTDispatcher()
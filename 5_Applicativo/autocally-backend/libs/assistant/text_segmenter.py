@@ -0,0 +1,72 @@
+import re
+
+# End of a sentence: punctuation followed by whitespace
+SENTENCE_END = re.compile(r'[.!?;:…]+["\')\]]*\s')
+# End of a clause, only used once the buffer is long enough to be worth speaking
+CLAUSE_END = re.compile(r'[,—–]\s')
+# Tool calls that the model sometimes writes as text, see AssistantLLM.clean_response
+FUNCTION_CALL = re.compile(r'<function=.*?</function>', re.S)
+
+MIN_SEGMENT_CHARS = 12
+MIN_CLAUSE_CHARS = 40
+
+
+class TextSegmenter:
+    """Cut streamed LLM tokens into sentences or clauses that can be spoken on their own."""
+
+    def __init__(self, min_segment_chars=MIN_SEGMENT_CHARS, min_clause_chars=MIN_CLAUSE_CHARS):
+        self.min_segment_chars = min_segment_chars
+        self.min_clause_chars = min_clause_chars
+        self.buffer = ''
+
+    def feed(self, token):
+        """Add a token and return the segments it completed."""
+        self.buffer += token
+        segments = []
+        while True:
+            segment = self._next_segment()
+            if segment is None:
+                return segments
+            if segment:
+                segments.append(segment)
+
+    def flush(self):
+        """Return what is left once the LLM is done, None if nothing is left."""
+        segment = self._clean(self.buffer)
+        self.buffer = ''
+        return segment or None
+
+    def _next_segment(self):
+        # Hold the text back while a function call is still being written
+        if '<function' in self.buffer and '</function>' not in self.buffer:
+            return None
+        self.buffer = FUNCTION_CALL.sub('', self.buffer)
+        
+        end = self._boundary(SENTENCE_END, self.min_segment_chars)
+        if end is None:
+            end = self._boundary(CLAUSE_END, self.min_clause_chars)
+        if end is None:
+            return None
+        
+        segment, self.buffer = self.buffer[:end], self.buffer[end:]
+        return self._clean(segment)
+
+    def _boundary(self, pattern, min_chars):
+        for match in pattern.finditer(self.buffer):
+            if match.end() >= min_chars:
+                return match.end()
+        return None
+
+    def _clean(self, text):
+        return FUNCTION_CALL.sub('', text).strip()
+
+
+def segment_text(tokens):
+    """Yield the segments of a stream of tokens."""
+    segmenter = TextSegmenter()
+    for token in tokens:
+        yield from segmenter.feed(token)
+    
+    last = segmenter.flush()
+    if last:
+        yield last
@@ -1,18 +1,58 @@
-from cartesia import Cartesia
 #from cartesia.tts import TtsRequestEmbeddingSpecifierParams, OutputFormat_RawParams
 
-import os
 from app.extensions import db
 from app.assistants.models import Assistant
+from libs.assistant.audio_cache import audio_cache_key, greeting_cache, phrase_cache
+from libs.assistant.cartesia_connection import cartesia_connection
 from dotenv import load_dotenv
+import eventlet
+from eventlet.queue import Queue
 import logging
 
 load_dotenv()
 
+DEFAULT_VOICE_ID = "79693aee-1207-4771-a01e-20c393c89e6f"
+DEFAULT_GREETING = "Ciao sono il tuo assistente virtuale, come posso aiutarti oggi?"
+
+MODEL_ID = "sonic-english"
+LANGUAGE = "it"
+OUTPUT_FORMAT = {
+    "container": "raw",
+    "encoding": "pcm_f32le",
+    "sample_rate": 22050
+}
+
+
+def greeting_text(assistant):
+    """Greeting spoken at the start of the calls of an assistant."""
+    return assistant.greeting_message or DEFAULT_GREETING
+
+
+def greeting_cache_key(text, voice_id):
+    return audio_cache_key(text, voice_id or DEFAULT_VOICE_ID, MODEL_ID, OUTPUT_FORMAT)
+
+
+def warm_greeting_audio(app, assistant_id):
+    """Synthesize the greeting of an assistant into the greeting cache."""
+    try:
+        with app.app_context():
+            assistant = Assistant.query.get(assistant_id)
+            if not assistant:
+                return
+            tts = TTS(assistant_id)
+            for _ in tts.get_cached_audio_stream(greeting_text(assistant), greeting_cache):
+                pass
+            logging.info(f"Warmed greeting audio for assistant {assistant_id}")
+    except Exception as e:
+        logging.error(f"Error warming greeting audio for assistant {assistant_id}: {str(e)}")
+
+
 class TTS:
     def __init__(self, assistant_id):
         self.assistant_id = assistant_id
         self.voice_id = None
+        self.model_id = MODEL_ID
+        self.output_format = OUTPUT_FORMAT
         self.ws = None
         self.is_connected = False
         
@@ -30,59 +70,130 @@ class TTS:
             raise ValueError("Assistant not found")
 
         if not self.voice_id:
-            self.voice_id = "79693aee-1207-4771-a01e-20c393c89e6f"
+            self.voice_id = DEFAULT_VOICE_ID
             #self.voice_id = "e00d0e4c-a5c8-443f-a8a3-473eb9a62355"
             logging.info("Using default voice_id")
 
-        logging.debug("Initializing Cartesia client")
-        self.cartesia_client = Cartesia(api_key=os.environ.get("CARTESIA_API_KEY"))
+        # Shared by every TTS of the worker, utterances are multiplexed by context_id
+        self.connection = cartesia_connection
+
+    def get_cached_audio_stream(self, text, cache):
+        """Stream the audio of text from cache, synthesizing and storing it on a miss."""
+        key = audio_cache_key(text, self.voice_id, self.model_id, self.output_format)
+        chunks = cache.get(key)
+        if chunks is not None:
+            logging.info(f"Audio cache hit for text: {text}")
+            yield from chunks
+            return
+        
+        chunks = []
+        for chunk in self.synthesize(text):
+            chunks.append(chunk)
+            yield chunk
+        
+        # Only reached when the whole text was synthesized
+        cache.put(key, chunks)
 
     def get_audio_stream(self, text):
+        """Stream the audio of text, repeated phrases are replayed from the phrase cache."""
+        yield from self.get_cached_audio_stream(text, phrase_cache)
+
+    def synthesize(self, text):
+        """Stream the audio of text from Cartesia."""
+        logging.info(f"Generating audio stream for text: {text}")
+        context = self.connection.context(
+            model_id=self.model_id,
+            voice_id=self.voice_id,
+            output_format=self.output_format,
+            language=LANGUAGE
+        )
+        
         try:
-            voice = self.cartesia_client.voices.get(id=self.voice_id)
-
-            logging.info(f"Generating audio stream for text: {text}")
-            model_id = "sonic-english"
-            output_format = {
-                "container": "raw",
-                "encoding": "pcm_f32le",
-                "sample_rate": 22050
-            }
-
-            logging.debug("Creating Cartesia websocket connection")
-
-            ws = self.cartesia_client.tts.websocket()
-
+            context.send(text)
+            for buffer in context:
+                logging.debug(f"[TTS]Received audio chunk of size: {len(buffer)}")
+                if buffer:
+                    yield buffer
+        except Exception as e:
+            logging.error(f"Error in synthesize: {str(e)}")
+            raise
+        finally:
+            # Cancels the generation on Cartesia if the caller stopped early
+            context.close()
+
+    def synthesize_stream(self, segments):
+        """Stream the audio of text that arrives in segments.
+
+        Every segment is sent on the same Cartesia context as soon as it is
+        available, so the prosody stays continuous across segments while the
+        audio of the first one is already playing. Text that is complete with
+        its first segment, like a fallback or a cached answer, is spoken as a
+        whole through the phrase cache instead.
+        """
+        available = Queue()
+        
+        def collect_segments():
             try:
-                audio_chunks = []  # Store chunks for local playback
-                
-                for output in ws.send(
-                    model_id=model_id,
-                    transcript=text,
-                    voice_id=self.voice_id,
-                    stream=True,
-                    language="it",
-                    output_format=output_format
-                ):
-                    logging.debug(f"[TTS]Received output: {output.keys()}")
-                    if 'audio' in output.keys():
-                        buffer = output['audio']
-                        logging.debug(f"[TTS]Received audio chunk of size: {len(buffer)}")
-                        audio_chunks.append(buffer)  # Store chunk
-                        if buffer:
-                            yield buffer
-
-                #self._play_audio_locally(audio_chunks, output_format['sample_rate'])
-
-            except Exception as inner_e:
-                logging.error(f"Inner error during TTS generation: {str(inner_e)}")
-                raise
-            finally:
-                ws.close()
-
+                for segment in segments:
+                    available.put(('segment', segment))
+                available.put(('end', None))
+            except Exception as e:
+                available.put(('error', e))
+        
+        collector = eventlet.spawn(collect_segments)
+        try:
+            # The collector only stops to wait for the LLM, so text given at once is all queued by now
+            ready = [available.get()]
+            while not available.empty():
+                ready.append(available.get())
+            
+            if ready[-1][0] == 'end':
+                text = ' '.join(segment for _, segment in ready[:-1])
+                if text:
+                    yield from self.get_audio_stream(text)
+                return
+            
+            yield from self._synthesize_segments(ready, available)
+        finally:
+            collector.kill()
+
+    def _synthesize_segments(self, ready, available):
+        """Stream the audio of the segments on one Cartesia context, ready ones first."""
+        context = self.connection.context(
+            model_id=self.model_id,
+            voice_id=self.voice_id,
+            output_format=self.output_format,
+            language=LANGUAGE
+        )
+        
+        def feed_segments():
+            try:
+                while True:
+                    kind, value = ready.pop(0) if ready else available.get()
+                    if kind == 'error':
+                        raise value
+                    if kind == 'end':
+                        break
+                    logging.info(f"Generating audio stream for segment: {value}")
+                    context.send(value + ' ', more=True)
+                if context.sent:
+                    context.send('', more=False)
+                else:
+                    context.queue.put({'done': True})
+            except Exception as e:
+                context.queue.put({'error': str(e)})
+        
+        feeder = eventlet.spawn(feed_segments)
+        try:
+            for buffer in context:
+                if buffer:
+                    yield buffer
         except Exception as e:
-            logging.error(f"Error in get_audio_stream: {str(e)}")
+            logging.error(f"Error in synthesize_stream: {str(e)}")
             raise
+        finally:
+            feeder.kill()
+            context.close()
 
     def _play_audio_locally(self, audio_chunks, sample_rate):
         """Play audio chunks locally for testing purposes."""
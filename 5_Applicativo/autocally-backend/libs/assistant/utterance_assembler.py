@@ -0,0 +1,94 @@
+import logging
+import os
+import time
+
+import eventlet
+
+from app import metrics
+
+# Deepgram endpointing, milliseconds of silence after which a final result is marked speech_final
+STT_ENDPOINTING_MS = int(os.getenv("STT_ENDPOINTING_MS", 300))
+# Milliseconds without words after which Deepgram sends UtteranceEnd, it also works with background noise
+STT_UTTERANCE_END_MS = int(os.getenv("STT_UTTERANCE_END_MS", 1000))
+# Seconds after the last final result after which the turn ends even without speech_final or UtteranceEnd
+STT_UTTERANCE_SILENCE_TIMEOUT = float(os.getenv("STT_UTTERANCE_SILENCE_TIMEOUT", 1.5))
+# Minimum seconds between two interim transcripts of the same turn
+STT_INTERIM_INTERVAL = float(os.getenv("STT_INTERIM_INTERVAL", 0.25))
+
+
+class UtteranceAssembler:
+    """Merges the final results of Deepgram into one user turn.
+
+    Deepgram splits a sentence into several final results. They are joined
+    until the turn ends, on a speech_final result, an UtteranceEnd event or
+    silence_timeout seconds after the last final, and emit(text, True) is
+    called once with the whole turn. Meanwhile emit(text, False) shows the
+    turn so far, at most once every interim_interval seconds.
+    """
+
+    def __init__(self, emit, silence_timeout=STT_UTTERANCE_SILENCE_TIMEOUT, interim_interval=STT_INTERIM_INTERVAL):
+        self.emit = emit
+        self.silence_timeout = silence_timeout
+        self.interim_interval = interim_interval
+        # Final results of the current turn
+        self.finals = []
+        self.last_interim_at = 0.0
+        self.last_interim = None
+        self.timer = None
+
+    def text(self, interim=''):
+        return ' '.join(part for part in self.finals + [interim] if part)
+
+    def add_result(self, sentence, is_final, speech_final=False):
+        if not sentence:
+            if speech_final:
+                self.end_turn('speech_final')
+            return
+
+        if is_final:
+            self.finals.append(sentence)
+            if speech_final:
+                self.end_turn('speech_final')
+                return
+        self.send_interim(self.text() if is_final else self.text(sentence))
+        # The caller is still talking, the silence timeout restarts from the last result
+        self.arm_timer()
+
+    def utterance_end(self):
+        """UtteranceEnd from Deepgram, the words of the turn are over."""
+        self.end_turn('utterance_end')
+
+    def end_turn(self, reason):
+        self.cancel_timer()
+        if not self.finals:
+            return
+        text = self.text()
+        self.finals = []
+        self.last_interim = None
+        self.last_interim_at = 0.0
+        metrics.increment(f'stt.turns.{reason}')
+        logging.info(f"🎤 [STT] Turn ended by {reason}: '{text}'")
+        self.emit(text, True)
+
+    def flush(self):
+        """End the current turn, used when the stream stops."""
+        self.end_turn('flush')
+
+    def send_interim(self, text):
+        now = time.monotonic()
+        if text == self.last_interim or now - self.last_interim_at < self.interim_interval:
+            metrics.increment('stt.interims_throttled')
+            return
+        self.last_interim = text
+        self.last_interim_at = now
+        self.emit(text, False)
+
+    def arm_timer(self):
+        self.cancel_timer()
+        if self.silence_timeout:
+            self.timer = eventlet.spawn_after(self.silence_timeout, self.end_turn, 'silence_timeout')
+
+    def cancel_timer(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
@@ -0,0 +1,213 @@
+"""Voice activity detection in front of the Deepgram stream.
+
+Silence of the caller is not sent upstream: a VADGate forwards the chunks
+its detector marks as speech, with the audio just before the onset
+(pre-roll) and a hangover after the end so Deepgram still sees the
+trailing silence it needs for endpointing and UtteranceEnd. While audio is
+suppressed the stream sends KeepAlive messages instead.
+
+Detectors are callables taking int16 samples and returning whether they
+contain speech. EnergyVAD is the default, a model based detector can be
+added with register_detector and selected with STT_VAD.
+"""
+from collections import deque
+import os
+
+import numpy as np
+
+from libs.assistant.audio_codec import mulaw_to_int16
+from libs.assistant.utterance_assembler import STT_UTTERANCE_END_MS
+
+# Detector of the STT streams, 'none' sends all the audio
+STT_VAD = os.getenv("STT_VAD", "energy")
+STT_VAD_PRE_ROLL_MS = int(os.getenv("STT_VAD_PRE_ROLL_MS", 300))
+# Deepgram only sends UtteranceEnd after STT_UTTERANCE_END_MS of audio without words,
+# the hangover forwards that much silence and a margin for the last word to be decoded
+STT_VAD_HANGOVER_MARGIN_MS = 300
+STT_VAD_HANGOVER_MS = max(int(os.getenv("STT_VAD_HANGOVER_MS", 0)), STT_UTTERANCE_END_MS + STT_VAD_HANGOVER_MARGIN_MS)
+# Speech is this many dB above the noise floor, and never below STT_VAD_MIN_DBFS
+STT_VAD_THRESHOLD_DB = float(os.getenv("STT_VAD_THRESHOLD_DB", 12.0))
+STT_VAD_MIN_DBFS = float(os.getenv("STT_VAD_MIN_DBFS", -55.0))
+
+# dBFS of a full scale int16 sine is 0, of digital silence about -96
+INT16_FULL_SCALE_DB = 20 * np.log10(32768.0)
+
+
+class EnergyVAD:
+    """Frame energy and zero-crossing rate detector with an adaptive noise floor.
+
+    Each chunk is split in frames and scored in one pass. A frame is speech
+    when its energy is threshold_db above the noise floor, unless its
+    zero-crossing rate is that of hiss and its energy is not clearly above
+    the floor. The floor follows the quietest frames down at once and rises
+    slowly, so it tracks the line noise and not the speech.
+    """
+
+    # Hiss crosses zero on about half of the samples, voiced speech far less
+    MAX_SPEECH_ZCR = 0.35
+    # Rise of the noise floor per frame, about 2.5 dB/s with 20 ms frames
+    FLOOR_RISE_DB = 0.05
+    INITIAL_FLOOR_DB = -70.0
+
+    def __init__(self, sample_rate, frame_ms=20, threshold_db=STT_VAD_THRESHOLD_DB, min_dbfs=STT_VAD_MIN_DBFS):
+        self.frame_size = max(1, sample_rate * frame_ms // 1000)
+        self.threshold_db = threshold_db
+        self.min_dbfs = min_dbfs
+        self.noise_floor = self.INITIAL_FLOOR_DB
+
+    def frame_features(self, samples):
+        """Energy in dBFS and zero-crossing rate of each frame of the samples."""
+        count = len(samples) // self.frame_size
+        if count == 0:
+            frames = samples.reshape(1, -1)
+        else:
+            frames = samples[:count * self.frame_size].reshape(count, self.frame_size)
+        frames = frames.astype(np.float32)
+        energy = 10 * np.log10(np.mean(frames * frames, axis=1) + 1e-9) - INT16_FULL_SCALE_DB
+        signs = np.signbit(frames)
+        zcr = np.mean(signs[:, 1:] != signs[:, :-1], axis=1) if frames.shape[1] > 1 else np.zeros(len(frames))
+        return energy, zcr
+
+    def __call__(self, samples):
+        if len(samples) == 0:
+            return False
+        energy, zcr = self.frame_features(samples)
+        threshold = max(self.noise_floor + self.threshold_db, self.min_dbfs)
+        speech = (energy > threshold) & ((zcr < self.MAX_SPEECH_ZCR) | (energy > threshold + self.threshold_db))
+
+        quietest = float(energy.min())
+        if quietest < self.noise_floor:
+            self.noise_floor = quietest
+        else:
+            self.noise_floor = min(quietest, self.noise_floor + self.FLOOR_RISE_DB * len(energy))
+        return bool(speech.any())
+
+
+# Detector factories by name, called with the sample rate of the stream
+detectors = {'energy': EnergyVAD}
+
+
+def register_detector(name, factory):
+    """Make a detector selectable with STT_VAD, factory(sample_rate) returns the callable."""
+    detectors[name] = factory
+
+
+class VADGate:
+    """Forwards the audio of a stream around the chunks its detector marks as speech."""
+
+    def __init__(self, detector, encoding, bytes_per_second, pre_roll_ms=STT_VAD_PRE_ROLL_MS, hangover_ms=STT_VAD_HANGOVER_MS):
+        self.detector = detector
+        self.encoding = encoding
+        # Chunks before the onset, sent with the first speech chunk
+        self.pre_roll = deque()
+        self.pre_roll_bytes = 0
+        self.max_pre_roll_bytes = int(bytes_per_second * pre_roll_ms / 1000)
+        self.hangover_bytes = int(bytes_per_second * hangover_ms / 1000)
+        # Bytes still forwarded after the last speech chunk
+        self.remaining = 0
+        self.sent_bytes = 0
+        self.suppressed_bytes = 0
+
+    def samples(self, audio):
+        if self.encoding == 'mulaw':
+            return mulaw_to_int16(audio)
+        return np.frombuffer(audio, dtype='<i2', count=len(audio) // 2)
+
+    def process(self, audio):
+        """Chunks to send for an inbound chunk, empty while it is suppressed."""
+        if self.detector(self.samples(audio)):
+            chunks = list(self.pre_roll)
+            chunks.append(audio)
+            self.pre_roll.clear()
+            self.pre_roll_bytes = 0
+            self.remaining = self.hangover_bytes
+        elif self.remaining > 0:
+            self.remaining -= len(audio)
+            chunks = [audio]
+        else:
+            self.pre_roll.append(audio)
+            self.pre_roll_bytes += len(audio)
+            while self.pre_roll_bytes > self.max_pre_roll_bytes and self.pre_roll:
+                dropped = self.pre_roll.popleft()
+                self.pre_roll_bytes -= len(dropped)
+                self.suppressed_bytes += len(dropped)
+            return []
+        self.sent_bytes += sum(len(chunk) for chunk in chunks)
+        return chunks
+
+
+def create_gate(encoding, sample_rate, bytes_per_second, name=STT_VAD):
+    """Gate for a stream, None when the VAD is disabled."""
+    factory = detectors.get(name)
+    if factory is None:
+        return None
+    return VADGate(factory(sample_rate), encoding, bytes_per_second)
+
+
+def reference_speech(energy, margin_db=15.0, min_dbfs=-50.0, fill_frames=10):
+    """Offline speech labels of a whole file, used as the reference of the gate.
+
+    A frame is speech when it is margin_db above the 10th percentile energy
+    of the file, and pauses shorter than fill_frames inside speech are
+    speech too. Unlike the gate it sees the whole file at once.
+    """
+    floor = np.percentile(energy, 10)
+    speech = energy > max(floor + margin_db, min_dbfs)
+    indexes = np.flatnonzero(speech)
+    if len(indexes) > 1:
+        gaps = np.flatnonzero(np.diff(indexes) <= fill_frames)
+        for start, end in zip(indexes[gaps], indexes[gaps + 1]):
+            speech[start:end] = True
+    return speech
+
+
+def evaluate_file(path, chunk_ms=20, name=STT_VAD):
+    """Stream a WAV of audio_logs through a gate and compare the forwarded audio with the reference labels."""
+    import wave
+
+    with wave.open(path) as f:
+        sample_rate = f.getframerate()
+        samples = np.frombuffer(f.readframes(f.getnframes()), dtype='<i2')
+    bytes_per_second = sample_rate * 2
+    chunk_size = sample_rate * chunk_ms // 1000
+    gate = create_gate('linear16', sample_rate, bytes_per_second, name)
+
+    # Forwarded flag of every chunk, a chunk sent from the pre-roll counts as forwarded
+    chunks = [samples[i:i + chunk_size] for i in range(0, len(samples) - chunk_size + 1, chunk_size)]
+    forwarded = np.zeros(len(chunks), dtype=bool)
+    pending = deque()
+    for index, chunk in enumerate(chunks):
+        audio = chunk.tobytes()
+        sent = gate.process(audio) if gate else [audio]
+        pending.append(index)
+        if sent:
+            for sent_index in list(pending)[-len(sent):]:
+                forwarded[sent_index] = True
+            pending.clear()
+
+    energy, _ = EnergyVAD(sample_rate, chunk_ms).frame_features(samples[:len(chunks) * chunk_size])
+    reference = reference_speech(energy)
+    speech_frames = int(reference.sum())
+    return {
+        'seconds': round(len(samples) / sample_rate, 1),
+        'speech seconds': round(speech_frames * chunk_ms / 1000, 1),
+        'forwarded': round(float(forwarded.mean()), 3),
+        'false reject': round(float((reference & ~forwarded).sum() / speech_frames), 4) if speech_frames else 0.0,
+    }
+
+
+if __name__ == '__main__':
+    # False-reject rate and savings on the recorded calls: python -m libs.assistant.vad audio_logs/*.wav
+    import sys
+
+    totals = {'seconds': 0.0, 'speech': 0.0, 'forwarded': 0.0, 'rejected': 0.0}
+    for path in sys.argv[1:]:
+        result = evaluate_file(path)
+        print(f"{os.path.basename(path)}: {result}")
+        totals['seconds'] += result['seconds']
+        totals['speech'] += result['speech seconds']
+        totals['forwarded'] += result['forwarded'] * result['seconds']
+        totals['rejected'] += result['false reject'] * result['speech seconds']
+    if totals['seconds']:
+        print(f"total: {totals['seconds']:.1f}s, forwarded {totals['forwarded'] / totals['seconds']:.1%}, "
+              f"false reject {totals['rejected'] / max(totals['speech'], 1e-9):.2%}")
@@ -0,0 +1,164 @@
+from collections import OrderedDict
+import logging
+import os
+
+from chromadb.api import ServerAPI
+from chromadb.api.client import Client
+from chromadb.config import Settings, System
+from chromadb.telemetry.product import ProductTelemetryClient
+from eventlet.semaphore import Semaphore
+from langchain_chroma import Chroma
+from langchain_openai import OpenAIEmbeddings
+
+from app import metrics
+from libs.assistant.embedding_cache import CachedQueryEmbeddings
+
+# Approximate memory the unused vector stores may keep, measured as the size of their chroma_db folders
+VECTOR_STORE_CACHE_MAX_BYTES = int(os.getenv("VECTOR_STORE_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+
+
+def index_generation(knowledge):
+    """Version of the index of a knowledge base, bumped by process_base_knowledge through last_loaded."""
+    return knowledge.last_loaded.isoformat() if knowledge.last_loaded else None
+
+
+def folder_size(path):
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return size
+
+
+def open_client(path):
+    """Chroma client of the folder at path on a system of its own, returns (system, client).
+
+    Chroma shares one system per folder in the process, and its HNSW index
+    does not see what the Celery worker writes afterwards. Every generation
+    gets a fresh system, stopped when the generation is closed.
+    chromadb.PersistentClient cannot do this, it returns the shared system
+    of the folder, so System and Client are built directly. They are not
+    public API, chromadb is pinned in requirements.txt for this reason.
+    """
+    system = System(Settings(is_persistent=True, persist_directory=path))
+    system.instance(ProductTelemetryClient)
+    system.instance(ServerAPI)
+    system.start()
+    return system, Client.from_system(system)
+
+
+class VectorStoreEntry:
+    __slots__ = ('store', 'system', 'path', 'size', 'refs')
+
+    def __init__(self, store, system, path, size):
+        self.store = store
+        self.system = system
+        self.path = path
+        self.size = size
+        self.refs = 0
+
+
+class VectorStoreRegistry:
+    """Chroma stores of the knowledge bases, opened once per process and shared by every AssistantLLM.
+
+    Stores are keyed by knowledge base id and index generation, so a call
+    opens the SQLite store and loads the HNSW index only the first time a
+    generation is used. Every acquire is matched by a release. Stores no
+    AssistantLLM holds stay open in LRU order while they fit in max_bytes,
+    and older generations are closed as soon as they are released.
+    """
+
+    def __init__(self, max_bytes=VECTOR_STORE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        # (base_knowledge_id, generation) -> VectorStoreEntry, least recently used first
+        self.entries = OrderedDict()
+        self.lock = Semaphore()
+        self.embedding_function = None
+
+        metrics.register_gauge('vector_stores', self.stats)
+
+    def acquire(self, knowledge):
+        """Store of a knowledge base, returns (key, store). The key is handed back to release."""
+        key = (knowledge.id, index_generation(knowledge))
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                metrics.increment('vector_stores.hits')
+                self.entries.move_to_end(key)
+            else:
+                metrics.increment('vector_stores.misses')
+                entry = self.entries[key] = self.open(knowledge)
+            entry.refs += 1
+            self.evict()
+            return key, entry.store
+
+    def release(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return
+            entry.refs = max(0, entry.refs - 1)
+            self.evict()
+
+    def invalidate(self, base_knowledge_id):
+        """Close the unused stores of a knowledge base, before its folder is deleted."""
+        with self.lock:
+            self.close_unused(base_knowledge_id)
+
+    def close_unused(self, base_knowledge_id):
+        for key in [key for key in self.entries if key[0] == base_knowledge_id]:
+            if not self.entries[key].refs:
+                self.close(key)
+
+    def get_embedding_function(self):
+        """Embedding function of every store, created on first use."""
+        if self.embedding_function is None:
+            # Callers ask the same questions over and over, their embeddings are cached
+            self.embedding_function = CachedQueryEmbeddings(OpenAIEmbeddings())
+        return self.embedding_function
+
+    def open(self, knowledge):
+        self.get_embedding_function()
+        path = os.path.join(knowledge.folder_path, 'chroma_db')
+        system, client = open_client(path)
+        store = Chroma(client=client, embedding_function=self.embedding_function)
+        logging.info(f"🤖 [LLM] Opened vector store of knowledge base {knowledge.id} ({path})")
+        return VectorStoreEntry(store, system, path, folder_size(path))
+
+    def evict(self):
+        latest = {}
+        for key in self.entries:
+            latest[key[0]] = max(latest.get(key[0], key), key, key=lambda k: k[1] or '')
+        # Older generations are never used again
+        for key, entry in list(self.entries.items()):
+            if not entry.refs and latest[key[0]] != key:
+                self.close(key)
+        total = sum(entry.size for entry in self.entries.values())
+        for key, entry in list(self.entries.items()):
+            if total <= self.max_bytes:
+                break
+            if not entry.refs:
+                total -= entry.size
+                self.close(key)
+                metrics.increment('vector_stores.evicted')
+
+    def close(self, key):
+        entry = self.entries.pop(key)
+        try:
+            entry.system.stop()
+        except Exception as e:
+            logging.warning(f"Could not close the Chroma client of {entry.path}: {str(e)}")
+        logging.info(f"🤖 [LLM] Closed vector store of knowledge base {key[0]} generation {key[1]}")
+
+    def stats(self):
+        return {
+            'open': len(self.entries),
+            'in_use': sum(1 for entry in self.entries.values() if entry.refs),
+            'bytes': sum(entry.size for entry in self.entries.values()),
+        }
+
+
+vector_store_registry = VectorStoreRegistry()
@@ -31,6 +31,15 @@ import os
 
 app = create_app()
 
+# Only the Socket.IO worker owns active calls, the Celery worker never runs this
+from app.calls.reaper import start_call_reaper
+from libs.assistant.component_pool import component_pool
+from libs.assistant.cartesia_connection import cartesia_connection
+start_call_reaper(app)
+component_pool.warm(app)
+# Open the shared TTS websocket before the first call needs it
+eventlet.spawn(cartesia_connection.connect)
+
 if __name__ == "__main__":
     cert_dir = os.path.join(os.path.dirname(__file__), 'certs')
     ssl_context = (
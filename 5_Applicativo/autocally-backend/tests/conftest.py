@@ -0,0 +1,19 @@
+import os
+import sys
+
+import eventlet
+eventlet.monkey_patch()  # Same as run.py, before anything else is imported
+
+# The clients of the providers only need a key to be created, the tests never reach them
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("GROQ_API_KEY", "test")
+os.environ.setdefault("DEEPGRAM_API_KEY", "test")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Same import order as create_app, the assistant libraries and the blueprints import each other
+import app.security  # noqa: E402,F401
+import app.phone_numbers  # noqa: E402,F401
+import app.assistants  # noqa: E402,F401
+import app.base_knowledge  # noqa: E402,F401
+import app.calls  # noqa: E402,F401
@@ -0,0 +1,18 @@
+from libs.assistant.answer_cache import AnswerCache
+
+
+def test_instances_of_two_versions_keep_their_answers():
+    cache = AnswerCache(threshold=0.95, size=8)
+    question = [1.0, 0.0, 0.0]
+
+    cache.store(1, 'old', question, 'We open at nine.')
+    # An instance built after the prompt changed, while the old one is still in a call
+    cache.store(1, 'new', question, 'We open at ten.')
+
+    assert cache.lookup(1, 'old', question) == 'We open at nine.'
+    assert cache.lookup(1, 'new', question) == 'We open at ten.'
+
+    # A third version drops the least recently used one
+    cache.store(1, 'newest', question, 'We open at eleven.')
+    assert cache.lookup(1, 'new', question) == 'We open at ten.'
+    assert cache.lookup(1, 'old', question) is None
@@ -0,0 +1,79 @@
+from types import SimpleNamespace
+
+import eventlet
+
+from libs.assistant import assistant_llm as assistant_llm_module
+from libs.assistant.assistant_llm import AssistantLLM
+from libs.assistant.text_segmenter import segment_text
+
+
+class FakeCompletions:
+    """Groq chat completions streaming canned responses, one per call."""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.finished = 0
+
+    def create(self, messages, stream=False, **params):
+        return self.stream(self.responses.pop(0))
+
+    def stream(self, deltas):
+        for delta in deltas:
+            # The network, the other greenlets run meanwhile
+            eventlet.sleep(0.01)
+            yield {'choices': [{'index': 0, 'delta': {'role': 'assistant', **delta}, 'finish_reason': None}]}
+        self.finished += 1
+
+
+def text(*tokens):
+    return [{'content': token} for token in tokens]
+
+
+def tool_call(content, name, arguments):
+    return [{'content': content, 'tool_calls': [{
+        'index': 0,
+        'id': 'call_1',
+        'type': 'function',
+        'function': {'name': name, 'arguments': arguments},
+    }]}]
+
+
+def make_assistant_llm(monkeypatch, rag_mode, completions):
+    assistant = SimpleNamespace(
+        prompt='Answer the questions about the office.',
+        llm_model='llama-3.3-70b-versatile',
+        llm_temperature=0.0,
+        llm_max_tokens=200,
+        rag_mode=rag_mode,
+        answer_cache=False,
+    )
+    monkeypatch.setattr(assistant_llm_module, 'Assistant', SimpleNamespace(query=SimpleNamespace(get=lambda _: assistant)))
+    monkeypatch.setattr(AssistantLLM, 'get_knowledge_base', lambda self: None)
+    assistant_llm = AssistantLLM(1)
+    assistant_llm.llm.client = completions
+    return assistant_llm
+
+
+def test_first_segment_is_yielded_before_the_llm_call_returns(monkeypatch):
+    completions = FakeCompletions([text('Well, ', 'the office ', 'opens at nine. ', 'It closes ', 'at six.')])
+    assistant_llm = make_assistant_llm(monkeypatch, 'direct', completions)
+
+    segments = segment_text(assistant_llm.stream_response('When are you open?'))
+
+    assert next(segments) == 'Well, the office opens at nine.'
+    assert completions.finished == 0
+    assert list(segments) == ['It closes at six.']
+    assert completions.finished == 1
+
+
+def test_tokens_of_tool_calls_are_not_streamed(monkeypatch):
+    completions = FakeCompletions([
+        tool_call('Let me check. ', 'knowledge_base', '{"__arg1": "opening hours"}'),
+        text('The office ', 'opens at nine.'),
+    ])
+    assistant_llm = make_assistant_llm(monkeypatch, 'agent', completions)
+
+    tokens = list(assistant_llm.stream_response('When are you open?'))
+
+    assert ''.join(tokens) == 'The office opens at nine.'
+    assert completions.finished == 2
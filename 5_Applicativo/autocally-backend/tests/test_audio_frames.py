@@ -0,0 +1,46 @@
+from types import SimpleNamespace
+
+from flask import Flask, request
+
+from app import metrics
+from app.calls import socket_events
+from app.calls.framing import close_channel, open_channel
+from libs.assistant.audio_codec import pack_audio_frame
+
+app = Flask(__name__)
+
+
+def make_session(monkeypatch):
+    processed = []
+    monkeypatch.setattr(socket_events, 'process_audio_chunk', lambda stt, audio, call_id, *args: processed.append(bytes(audio)))
+    session = SimpleNamespace(call_id='frames', client_sid='owner', stt=None, touch=lambda: None)
+    session.audio_channel = open_channel(session.call_id, socket_events.call_room(session.call_id))
+    monkeypatch.setitem(socket_events.active_calls, session.call_id, session)
+    return session, processed
+
+
+def send_as(sid, data):
+    with app.test_request_context():
+        request.sid = sid
+        socket_events.handle_audio_chunk(data)
+
+
+def test_audio_of_another_client_is_dropped(monkeypatch):
+    session, processed = make_session(monkeypatch)
+    slot = session.audio_channel.slot
+    dropped = metrics.get('calls.foreign_audio')
+
+    try:
+        # A client guessing the slot or the call_id of the call
+        send_as('intruder', pack_audio_frame(slot, 0, 0, b'\x01\x02'))
+        send_as('intruder', {'call_id': session.call_id, 'audio': b'\x03\x04'})
+        assert processed == []
+        assert session.audio_channel.received is None
+        assert metrics.get('calls.foreign_audio') == dropped + 2
+
+        send_as('owner', pack_audio_frame(slot, 0, 0, b'\x05\x06'))
+        send_as('owner', {'call_id': session.call_id, 'audio': b'\x07\x08'})
+        assert processed == [b'\x05\x06', b'\x07\x08']
+        assert session.audio_channel.received == 0
+    finally:
+        close_channel(session.audio_channel)
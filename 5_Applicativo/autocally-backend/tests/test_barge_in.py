@@ -0,0 +1,92 @@
+import eventlet
+
+from app.calls import socket_events
+from app.calls.session import CallSession, CallState
+
+# 20 ms of pcm_f32le audio at 22050 Hz
+CHUNK = bytes(441 * 4)
+
+
+class FakeAssistantLLM:
+    def __init__(self):
+        self.streamed = []
+        self.blocking = []
+
+    def stream_response(self, text):
+        self.streamed.append(text)
+        yield f'Answer to {text}'
+
+    def get_response(self, text):
+        self.blocking.append(text)
+        return f'Answer to {text}'
+
+
+class FakeTTS:
+    """Speaks every segment for a second, one chunk at a time."""
+
+    def synthesize_stream(self, segments):
+        for _ in segments:
+            for _ in range(50):
+                eventlet.sleep(0.02)
+                yield CHUNK
+
+
+class FakeMediaStream:
+    def __init__(self):
+        self.sent = []
+        self.cleared = 0
+
+    def send(self, payload):
+        self.sent.append(payload)
+
+    def clear(self):
+        self.cleared += 1
+
+
+def make_session(monkeypatch):
+    monkeypatch.setattr(socket_events.socketio, 'emit', lambda *args, **kwargs: None)
+    monkeypatch.setattr(socket_events, 'store_transcripts', lambda *args: None)
+    session = CallSession('barge-in', 1, None, FakeAssistantLLM(), FakeTTS(), stt=None)
+    session.state = CallState.listening
+    session.media_stream = FakeMediaStream()
+    monkeypatch.setitem(socket_events.active_calls, session.call_id, session)
+    return session
+
+
+def wait_for(condition, timeout=5.0):
+    with eventlet.Timeout(timeout):
+        while not condition():
+            eventlet.sleep(0.01)
+
+
+def test_barge_in_hands_the_output_to_the_new_turn(monkeypatch):
+    session = make_session(monkeypatch)
+    socket_events.process_stt_transcript(session, 'When do you open?', True)
+    wait_for(lambda: session.is_speaking)
+
+    socket_events.process_stt_transcript(session, 'And on Sunday?', True)
+
+    # The new turn is streamed right away instead of waiting for the interrupted one
+    wait_for(lambda: len(session.assistant_llm.streamed) == 2)
+    assert session.assistant_llm.streamed == ['When do you open?', 'And on Sunday?']
+    assert session.assistant_llm.blocking == []
+    assert session.media_stream.cleared == 1
+
+    wait_for(lambda: session.state is CallState.listening)
+    finals = [payload for payload in session.media_stream.sent if payload.get('final')]
+    # Only the answer that was not interrupted is marked as played
+    assert len(finals) == 1
+
+
+def test_short_transcript_does_not_interrupt(monkeypatch):
+    session = make_session(monkeypatch)
+    socket_events.process_stt_transcript(session, 'When do you open?', True)
+    wait_for(lambda: session.is_speaking)
+    generation = session.output_generation
+
+    socket_events.process_stt_transcript(session, 'Ok', False)
+
+    assert session.is_speaking
+    assert session.output_generation == generation
+    assert session.media_stream.cleared == 0
+    socket_events.barge_in(session, 'test')
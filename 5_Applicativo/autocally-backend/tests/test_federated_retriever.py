@@ -0,0 +1,50 @@
+import time
+
+from eventlet import patcher
+from langchain_core.documents import Document
+
+from libs.assistant.federated_retriever import FederatedRetriever
+
+# Blocks the OS thread without yielding to the hub, like the C code of hnswlib and SQLite
+blocking_sleep = patcher.original('time').sleep
+
+
+class SlowStore:
+    """Store answering after a blocking delay that releases the GIL."""
+
+    def __init__(self, texts, delay=0.2):
+        self.texts = texts
+        self.delay = delay
+
+    def similarity_search_by_vector(self, embedding, k):
+        blocking_sleep(self.delay)
+        return [Document(page_content=text) for text in self.texts[:k]]
+
+
+class FixedEmbeddings:
+    def embed_query(self, text):
+        return [1.0, 0.0]
+
+
+def test_stores_are_searched_in_parallel():
+    stores = [(f'kb{i}', SlowStore([f'chunk {i}'])) for i in range(4)]
+    retriever = FederatedRetriever(stores, FixedEmbeddings(), top_k=10)
+
+    start = time.perf_counter()
+    hits = retriever.search('question')
+
+    assert time.perf_counter() - start < 0.4
+    assert sorted(name for name, _, _ in hits) == ['kb0', 'kb1', 'kb2', 'kb3']
+
+
+def test_hits_are_merged_by_reciprocal_rank():
+    stores = [
+        ('hours', SlowStore(['Open at nine.', 'Closed on Sunday.'], delay=0)),
+        ('faq', SlowStore(['Closed on Sunday.', 'Parking is free.'], delay=0)),
+    ]
+    retriever = FederatedRetriever(stores, FixedEmbeddings(), top_k=3)
+
+    hits = retriever.search('question')
+
+    # Found in both knowledge bases, its scores add up
+    assert [document.page_content for _, document, _ in hits] == ['Closed on Sunday.', 'Open at nine.', 'Parking is free.']
@@ -0,0 +1,75 @@
+import asyncio
+from types import SimpleNamespace
+
+import eventlet
+
+from libs.assistant.speech_to_text import SpeechToText
+
+
+def result(words, is_final=True, start=0.0):
+    """Deepgram result with the (word, start, end) of words, times relative to the connection."""
+    return SimpleNamespace(
+        start=start,
+        duration=max(end for _, _, end in words) - start,
+        is_final=is_final,
+        speech_final=False,
+        channel=SimpleNamespace(alternatives=[SimpleNamespace(
+            transcript=' '.join(word for word, _, _ in words),
+            words=[SimpleNamespace(word=word.lower().strip(',.?'), punctuated_word=word, start=word_start, end=end)
+                   for word, word_start, end in words],
+        )]),
+    )
+
+
+def make_stt():
+    stt = SpeechToText(1, call_id='1')
+    added = []
+    stt.assembler = SimpleNamespace(add_result=lambda sentence, is_final, speech_final: added.append((sentence, is_final)))
+    return stt, added
+
+
+def test_result_crossing_the_last_final_keeps_its_new_words():
+    stt, added = make_stt()
+    stt.handle_transcript(None, result([('Vorrei', 0.2, 0.6), ('prenotare', 0.6, 1.1), ('un', 1.1, 1.3), ('tavolo', 1.3, 1.8)]))
+
+    # The connection dropped, the last second of audio is sent again to the new one
+    stt.stream_offset = 1.0
+    stt.handle_transcript(None, result([('un', 0.1, 0.3), ('tavolo', 0.3, 0.8), ('per', 0.9, 1.1), ('due.', 1.1, 1.5)]))
+
+    assert added == [('Vorrei prenotare un tavolo', True), ('per due.', True)]
+    assert stt.final_until == 2.5
+
+
+def test_replayed_result_is_skipped():
+    stt, added = make_stt()
+    stt.handle_transcript(None, result([('Buongiorno.', 0.2, 0.9)]))
+
+    stt.stream_offset = 0.5
+    stt.handle_transcript(None, result([('Buongiorno.', 0.0, 0.4)], is_final=False))
+
+    assert added == [('Buongiorno.', True)]
+
+
+def test_connection_attempts_close_their_event_loop(monkeypatch):
+    loops = []
+    new_event_loop = asyncio.new_event_loop
+
+    def tracked_event_loop():
+        loops.append(new_event_loop())
+        return loops[-1]
+
+    async def failed_connection(self):
+        return False
+
+    monkeypatch.setattr(asyncio, 'new_event_loop', tracked_event_loop)
+    monkeypatch.setattr(SpeechToText, '_initialize_connection', failed_connection)
+    stt = SpeechToText(1, call_id='1')
+
+    # Starts and reconnects of many calls, each in a greenlet of its own
+    pool = eventlet.GreenPool()
+    for _ in range(50):
+        pool.spawn(stt.open_connection)
+    pool.waitall()
+
+    assert len(loops) == 50
+    assert all(loop.is_closed() for loop in loops)
@@ -0,0 +1,93 @@
+from types import SimpleNamespace
+
+import eventlet
+from eventlet.queue import Queue
+
+from libs.assistant import text_to_speech
+from libs.assistant.audio_cache import AudioCache
+from libs.assistant.text_to_speech import TTS
+
+
+class FakeContext:
+    """Cartesia context answering every transcript with one chunk of audio."""
+
+    def __init__(self):
+        self.queue = Queue()
+        self.transcripts = []
+
+    @property
+    def sent(self):
+        return bool(self.transcripts)
+
+    def send(self, transcript, more=False):
+        self.transcripts.append((transcript, more))
+        if transcript:
+            self.queue.put(transcript.strip().encode('utf-8'))
+        if not more:
+            self.queue.put(None)
+
+    def __iter__(self):
+        while True:
+            chunk = self.queue.get()
+            if chunk is None:
+                return
+            if isinstance(chunk, dict):
+                if 'error' in chunk:
+                    raise RuntimeError(chunk['error'])
+                return
+            yield chunk
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self):
+        self.contexts = []
+
+    def context(self, **request):
+        context = FakeContext()
+        self.contexts.append(context)
+        return context
+
+
+def make_tts(monkeypatch):
+    assistant = SimpleNamespace(cartesia_voice_id='voice')
+    monkeypatch.setattr(text_to_speech, 'Assistant', SimpleNamespace(query=SimpleNamespace(get=lambda _: assistant)))
+    monkeypatch.setattr(text_to_speech, 'phrase_cache', AudioCache('test_phrase_cache', max_bytes=1024 * 1024))
+    tts = TTS(1)
+    tts.connection = FakeConnection()
+    return tts
+
+
+def test_text_given_at_once_goes_through_the_phrase_cache(monkeypatch):
+    tts = make_tts(monkeypatch)
+    segments = ['Sorry, I did not get that.', 'Could you repeat?']
+
+    first = list(tts.synthesize_stream(iter(segments)))
+    second = list(tts.synthesize_stream(iter(segments)))
+
+    assert first == second == [b'Sorry, I did not get that. Could you repeat?']
+    # The second answer is replayed from the cache without a context
+    assert len(tts.connection.contexts) == 1
+    assert tts.connection.contexts[0].transcripts == [('Sorry, I did not get that. Could you repeat?', False)]
+
+
+def test_streamed_segments_share_one_context(monkeypatch):
+    tts = make_tts(monkeypatch)
+
+    def segments():
+        for segment in ['The office opens at nine.', 'It closes at six.']:
+            # The LLM is still writing
+            eventlet.sleep(0.01)
+            yield segment
+
+    chunks = list(tts.synthesize_stream(segments()))
+
+    assert chunks == [b'The office opens at nine.', b'It closes at six.']
+    assert len(tts.connection.contexts) == 1
+    assert tts.connection.contexts[0].transcripts == [
+        ('The office opens at nine. ', True),
+        ('It closes at six. ', True),
+        ('', False),
+    ]
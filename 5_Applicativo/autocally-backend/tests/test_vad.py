@@ -0,0 +1,60 @@
+import numpy as np
+
+from libs.assistant.utterance_assembler import STT_UTTERANCE_END_MS, UtteranceAssembler
+from libs.assistant.vad import EnergyVAD, VADGate
+
+SAMPLE_RATE = 16000
+BYTES_PER_SECOND = SAMPLE_RATE * 2
+CHUNK_MS = 20
+
+
+def chunks(seconds, amplitude):
+    """20 ms linear16 chunks of a 220 Hz tone, digital silence with amplitude 0."""
+    size = SAMPLE_RATE * CHUNK_MS // 1000
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    samples = (amplitude * np.sin(2 * np.pi * 220 * t)).astype('<i2')
+    return [samples[i:i + size].tobytes() for i in range(0, len(samples), size)]
+
+
+class FakeDeepgram:
+    """Final result when the words stop, UtteranceEnd after STT_UTTERANCE_END_MS of audio without words.
+
+    Like Deepgram it only counts the audio it receives, the chunks held back
+    by the gate do not move its clock.
+    """
+
+    def __init__(self, assembler, words):
+        self.assembler = assembler
+        self.words = words
+        self.speaking = False
+        self.silence_ms = None
+
+    def send(self, audio):
+        if np.abs(np.frombuffer(audio, dtype='<i2')).max() > 0:
+            self.speaking = True
+            self.silence_ms = None
+            return
+        if self.speaking:
+            self.speaking = False
+            self.silence_ms = 0
+            self.assembler.add_result(self.words, True)
+        if self.silence_ms is not None:
+            self.silence_ms += len(audio) * 1000 // BYTES_PER_SECOND
+            if self.silence_ms >= STT_UTTERANCE_END_MS:
+                self.silence_ms = None
+                self.assembler.utterance_end()
+
+
+def test_gated_silence_still_ends_the_turn_with_utterance_end():
+    turns = []
+    assembler = UtteranceAssembler(lambda text, is_final: is_final and turns.append(text), silence_timeout=None)
+    deepgram = FakeDeepgram(assembler, 'Vorrei prenotare un tavolo')
+    gate = VADGate(EnergyVAD(SAMPLE_RATE), 'linear16', BYTES_PER_SECOND)
+
+    for chunk in chunks(1.0, 0) + chunks(1.5, 8000) + chunks(3.0, 0):
+        for sent in gate.process(chunk):
+            deepgram.send(sent)
+
+    assert turns == ['Vorrei prenotare un tavolo']
+    # The rest of the silence was held back
+    assert gate.suppressed_bytes > 0
@@ -0,0 +1,58 @@
+from datetime import datetime
+import json
+import os
+import subprocess
+import sys
+from types import SimpleNamespace
+
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from libs.assistant.vector_store_registry import VectorStoreRegistry
+
+EMBEDDING_SIZE = 16
+
+# The Celery worker indexing a knowledge base, in a process of its own
+WRITER = """
+import json, sys
+import chromadb
+path, ids, documents, embeddings = json.loads(sys.argv[1])
+collection = chromadb.PersistentClient(path).get_or_create_collection('langchain')
+collection.add(ids=ids, documents=documents, embeddings=embeddings)
+"""
+
+
+def write(path, documents):
+    embedding = DeterministicFakeEmbedding(size=EMBEDDING_SIZE)
+    arguments = [path, documents, documents, embedding.embed_documents(documents)]
+    subprocess.run([sys.executable, '-c', WRITER, json.dumps(arguments)], check=True)
+
+
+def search(store, text):
+    embedding = DeterministicFakeEmbedding(size=EMBEDDING_SIZE).embed_query(text)
+    return sorted(document.page_content for document in store.similarity_search_by_vector(embedding, k=10))
+
+
+def test_new_generation_sees_the_rebuilt_index_while_the_old_one_is_in_use(tmp_path):
+    knowledge = SimpleNamespace(id=1, folder_path=str(tmp_path), last_loaded=datetime(2026, 1, 1))
+    path = os.path.join(str(tmp_path), 'chroma_db')
+    registry = VectorStoreRegistry()
+    registry.embedding_function = DeterministicFakeEmbedding(size=EMBEDDING_SIZE)
+
+    write(path, ['Opening hours'])
+    old_key, old_store = registry.acquire(knowledge)
+    assert search(old_store, 'hours') == ['Opening hours']
+
+    write(path, ['Prices'])
+    knowledge.last_loaded = datetime(2026, 1, 2)
+    new_key, new_store = registry.acquire(knowledge)
+
+    assert new_key != old_key
+    assert registry.entries[old_key].refs == 1
+    assert search(new_store, 'hours') == ['Opening hours', 'Prices']
+    # The old generation is still open for the calls holding it
+    assert 'Opening hours' in search(old_store, 'hours')
+
+    registry.release(old_key)
+    assert old_key not in registry.entries
+    assert search(new_store, 'prices') == ['Opening hours', 'Prices']
+    registry.release(new_key)
@@ -82,6 +82,8 @@ export const assistantsApi = {
     llm_model?: string;
     llm_temperature?: number;
     llm_max_tokens?: number;
+    rag_mode?: string;
+    answer_cache?: boolean;
   }) => {
     const response = await axiosInstance.put(`/assistants/update/${id}`, data, getHeaders())
     return response.data
@@ -14,4 +14,6 @@ export interface Assistant {
   llm_model: string
   llm_temperature: number
   llm_max_tokens: number
+  rag_mode?: 'agent' | 'direct'
+  answer_cache?: boolean
 } 
\ No newline at end of file